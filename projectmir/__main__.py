@@ -1,15 +1,165 @@
-import os
+import argparse
 from pathlib import Path
-import stanfordnlp
-
-# Find 'stanfordmlp_resources' folder which containes models
-currentPath = Path(os.getcwd())
-MODELS_DIR = os.path.join(currentPath, 'data/stanfordnlp_resources')
-
-def main():
-    nlp = stanfordnlp.Pipeline(processors='tokenize,mwt,pos', models_dir=MODELS_DIR)
-    doc = nlp("Barack Obama was born in Hawaii.")
-    print(*[f'word: {word.text+" "}\tupos: {word.upos}\txpos: {word.xpos}' for sent in doc.sentences for word in sent.words], sep='\n')
-    
-if __name__=='__main__':
+
+from projectmir.async_pipeline import AsyncPipeline
+from projectmir.corpus_index import CorpusIndex
+from projectmir.corenlp_session import CoreNLPSession
+from projectmir.corpus_runner import CorpusRunner, DumpCheckpoint, JSONLinesSink, dump_tasks
+from projectmir.noun_phrases import (ChunkerNounPhraseBackend, CoreNLPNounPhraseBackend,
+                                     compare_noun_phrase_backends)
+from projectmir.wikipedia_dump import WikipediaDumpReader
+from projectmir.xmldocument import XMLDocument
+
+
+def run(args):
+    checkpoint = None
+    if args.dump:
+        checkpoint = DumpCheckpoint(args.checkpoint or f'{args.output}.offset')
+        offset = checkpoint.load() if args.offset is None else args.offset
+        if offset:
+            print(f'resuming {args.dump} from offset {offset}')
+        tasks = dump_tasks(WikipediaDumpReader(
+            args.dump, namespaces=set(args.namespace) if args.namespace else None,
+            offset=offset), checkpoint)
+    else:
+        tasks = [str(path) for input_path in args.paths
+                 for path in (sorted(Path(input_path).glob('*.html'))
+                              if Path(input_path).is_dir() else [input_path])]
+    document_kwargs = {'trace_memory': args.trace_memory}
+    if args.chunker:
+        document_kwargs['noun_phrase_backend'] = ChunkerNounPhraseBackend()
+    # the chunker sends no CoreNLP request.
+    start_corenlp = not (args.no_corenlp or args.chunker)
+    if args.asyncio:
+        runner = AsyncPipeline(document_kwargs=document_kwargs,
+                               corenlp_endpoint=args.corenlp_endpoint,
+                               start_corenlp=start_corenlp,
+                               max_corenlp_requests=args.corenlp_requests)
+    else:
+        runner = CorpusRunner(workers=args.workers,
+                              max_in_flight=args.max_in_flight,
+                              document_kwargs=document_kwargs,
+                              corenlp_endpoint=args.corenlp_endpoint,
+                              start_corenlp=start_corenlp)
+    index = CorpusIndex(args.index) if args.index else None
+    with JSONLinesSink(args.output) as sink:
+        def write(record):
+            sink(record)
+            if index is not None and record['status'] == 'ok':
+                index.add_record(record)
+            if checkpoint is not None:
+                checkpoint.completed(record['path'])
+
+        summary = runner.run(tasks, write)
+    if index is not None:
+        index.close()
+    print(f'processed: {summary["ok"]}, failed: {summary["error"]}')
+    if checkpoint is not None:
+        checkpoint.save()
+        print(f'offset {checkpoint.offset} saved to {checkpoint.path}')
+    if args.metrics:
+        runner.metrics.write_json(args.metrics)
+
+
+def query(args):
+    with CorpusIndex(args.index) as index:
+        if args.prefix:
+            print('\n'.join(index.identifiers_with_prefix(args.text_tex, args.top_k)))
+        elif args.component:
+            print('\n'.join(index.identifiers_with_component(args.text_tex, args.top_k)))
+        else:
+            for definition in index.lookup(args.text_tex, args.top_k):
+                print(f'{definition.score:.4f}\t{definition.definition}\t'
+                      f'{definition.document_id}\t{definition.path}')
+
+
+def compare_noun_phrases(args):
+    if args.corenlp_endpoint is None:
+        session = CoreNLPSession(timeout=30000, memory='16G')
+    else:
+        session = CoreNLPSession(endpoint=args.corenlp_endpoint, start_server=False)
+    with session:
+        documents = [XMLDocument(path, stages=['pos_tagging'], corenlp_session=session)
+                     for path in args.paths]
+        results = compare_noun_phrase_backends(
+            documents, {'corenlp': CoreNLPNounPhraseBackend(session),
+                        'chunker': ChunkerNounPhraseBackend()})
+    for name, result in results.items():
+        print(f'{name}\tcandidates: {result["candidates"]}\t'
+              f'recall: {result["recall"]:.4f}\tprecision: {result["precision"]:.4f}\t'
+              f'time: {result["wall_time"]:.3f}s')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='projectmir')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help='extract identifier definitions from a corpus.')
+    run_parser.add_argument('paths', nargs='*',
+                            help='documents, or directories of *.html documents.')
+    run_parser.add_argument('--dump', help='Wikipedia dump (.xml, .bz2 or .gz).')
+    run_parser.add_argument('--namespace', action='append',
+                            help='namespace of dump pages to process (repeatable).')
+    run_parser.add_argument('--offset', type=int, default=None,
+                            help='byte offset in the dump to start from '
+                                 '(default: the offset saved in the checkpoint).')
+    run_parser.add_argument('--checkpoint', default=None,
+                            help='file where the offset reached in the dump is saved '
+                                 '(default: <output>.offset); a rerun with the same '
+                                 'options resumes from it.')
+    run_parser.add_argument('-o', '--output', default='results.jsonl')
+    run_parser.add_argument('-j', '--workers', type=int, default=None)
+    run_parser.add_argument('--max-in-flight', type=int, default=None)
+    run_parser.add_argument('--corenlp-endpoint', default=None,
+                            help='endpoint of a running CoreNLP server.')
+    run_parser.add_argument('--no-corenlp', action='store_true',
+                            help='do not start a shared CoreNLP server (needs '
+                                 '--corenlp-endpoint or --chunker, otherwise each '
+                                 'document would start its own server).')
+    run_parser.add_argument('--metrics', default=None,
+                            help='write the metrics aggregated over documents (JSON).')
+    run_parser.add_argument('--trace-memory', action='store_true',
+                            help='trace the peak memory of each stage (not with --asyncio).')
+    run_parser.add_argument('--asyncio', action='store_true',
+                            help='process documents in one process, overlapping '
+                                 'stanza and CoreNLP requests.')
+    run_parser.add_argument('--corenlp-requests', type=int, default=4,
+                            help='CoreNLP requests in flight at a time (with --asyncio).')
+    run_parser.add_argument('--chunker', action='store_true',
+                            help='extract noun phrases with the POS tag chunker '
+                                 'instead of CoreNLP (no CoreNLP server is started).')
+    run_parser.add_argument('--index', default=None,
+                            help='add the definitions of each document to a corpus index.')
+    run_parser.set_defaults(function=run)
+
+    query_parser = subparsers.add_parser(
+        'query', help='look up identifiers in a corpus index.')
+    query_parser.add_argument('index', help='corpus index (see run --index).')
+    query_parser.add_argument('text_tex', help='identifier, e.g. T_{ref}.')
+    query_parser.add_argument('-k', '--top-k', type=int, default=10)
+    query_parser.add_argument('--prefix', action='store_true',
+                              help='list the identifiers starting with text_tex.')
+    query_parser.add_argument('--component', action='store_true',
+                              help='list the identifiers having text_tex as a component.')
+    query_parser.set_defaults(function=query)
+
+    compare_parser = subparsers.add_parser(
+        'compare-noun-phrases',
+        help='compare the candidates of the chunker with those of CoreNLP.')
+    compare_parser.add_argument('paths', nargs='+', help='documents.')
+    compare_parser.add_argument('--corenlp-endpoint', default=None,
+                                help='endpoint of a running CoreNLP server.')
+    compare_parser.set_defaults(function=compare_noun_phrases)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.no_corenlp \
+            and args.corenlp_endpoint is None and not args.chunker:
+        run_parser.error('--no-corenlp needs --corenlp-endpoint or --chunker')
+    if args.command == 'run' and args.asyncio and args.trace_memory:
+        run_parser.error('--trace-memory can not be used with --asyncio')
+    args.function(args)
+
+
+if __name__ == '__main__':
     main()
@@ -0,0 +1,200 @@
+import contextlib
+from dataclasses import dataclass, field
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+@dataclass
+class AnnotationCache:
+    """on-disk, content-addressed cache of NLP annotations.
+
+    Annotations are stored in SQLite, keyed by
+    hash(annotator + model version + text), so that reruns on the same
+    documents (e.g. parameter sweeps of the ranking) skip stanza and CoreNLP.
+    When the cache grows beyond `max_bytes`, the least recently used
+    annotations are evicted. The size is read from the database, so several
+    processes may share one cache file.
+
+    ----------------------
+    usage:
+    cache = AnnotationCache('annotation_cache.sqlite3')
+    doc = XMLDocument(path, annotation_cache=cache)
+    print(cache.stats())
+    """
+    path: str = 'annotation_cache.sqlite3'
+    max_bytes: int = 1 << 30
+    hits: int = 0
+    misses: int = 0
+    _connection: Optional[sqlite3.Connection] = field(
+        default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS annotation ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+            'size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS annotation_last_access '
+            'ON annotation (last_access)')
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(text: str, annotator: str, model_version: str = '') -> str:
+        """return the content address of an annotation."""
+        digest = hashlib.sha1()
+        for part in (annotator, model_version, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """return the cached annotations of `keys` (missing keys are omitted).
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    'SELECT key, value FROM annotation WHERE key IN '
+                    f'({",".join("?" * len(chunk))})', chunk).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    'UPDATE annotation SET last_access = ? WHERE key = ?',
+                    [(now, key) for key in found])
+                self._connection.commit()
+        return found
+
+    def put_many(self, items: Dict[str, Any]):
+        """store annotations keyed by their content address."""
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            value_ = json.dumps(value, ensure_ascii=False).encode('utf-8')
+            rows.append((key, value_, len(value_), now))
+        with self._write_transaction():
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO annotation VALUES (?, ?, ?, ?)', rows)
+            if self._total_bytes() > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    @contextlib.contextmanager
+    def _write_transaction(self):
+        # other processes wait for the write lock of the database until the
+        # transaction is committed, so that the size read in it stays exact.
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._connection.rollback()
+                raise
+            self._connection.commit()
+
+    def _total_bytes(self) -> int:
+        # size of all the annotations, including those of other processes.
+        return self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM annotation').fetchone()[0]
+
+    def annotate(self,
+                 texts: List[str],
+                 annotator: str,
+                 annotate_function: Callable[[List[str]], List[Any]],
+                 model_version: str = '') -> List[Any]:
+        """return the annotations of `texts`, computing only the missing ones.
+
+        Args:
+            texts (list): texts (str) to be annotated.
+            annotator (str): name of the annotator (e.g. 'stanza:pos').
+            annotate_function (callable): function that annotates a list of
+                texts and returns their annotations in the same order.
+            model_version (str): version of the model behind the annotator.
+
+        Returns:
+            annotations (list): annotation of each text.
+        """
+        keys = [self.make_key(text, annotator, model_version) for text in texts]
+        found = self.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(keys) - sum(key in missing for key in keys)
+        self.misses += len(missing)
+        if missing:
+            computed = dict(zip(missing.keys(),
+                                annotate_function(list(missing.values()))))
+            # store what would be read back, so that hits and misses agree.
+            computed = {key: json.loads(json.dumps(value))
+                        for key, value in computed.items()}
+            self.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def evict(self, target_bytes: Optional[int] = None) -> int:
+        """evict least recently used annotations down to `target_bytes`
+        (90% of `max_bytes` by default).
+
+        Returns:
+            int: number of evicted annotations.
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+        with self._write_transaction():
+            return self._evict(target_bytes)
+
+    def _evict(self, target_bytes: int) -> int:
+        # called in a write transaction (see _write_transaction).
+        excess = self._total_bytes() - target_bytes
+        n_evicted = 0
+        while excess > 0:
+            rows = self._connection.execute(
+                'SELECT key, size FROM annotation '
+                'ORDER BY last_access LIMIT 256').fetchall()
+            if not rows:
+                break
+            evicted_keys = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                evicted_keys.append((key,))
+                excess -= size
+            self._connection.executemany(
+                'DELETE FROM annotation WHERE key = ?', evicted_keys)
+            n_evicted += len(evicted_keys)
+        return n_evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            n_entries, n_bytes = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM annotation').fetchone()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': n_entries,
+                'bytes': n_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM annotation')
+            self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getstate__(self):
+        # the connection is reopened by the process that unpickles the cache.
+        return {'path': self.path, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self.__post_init__()
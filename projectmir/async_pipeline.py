@@ -0,0 +1,250 @@
+import asyncio
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import traceback
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional
+
+from projectmir.corenlp_session import CoreNLPSession
+from projectmir.corpus_runner import Task, _task_path, document_to_dict
+from projectmir.instrumentation import CorpusMetrics, DocumentMetrics
+from projectmir.pipeline_pool import pipeline_pool
+from projectmir.xmldocument import STAGES, XMLDocument
+
+# stages run before POS tagging and noun phrase extraction, which overlap.
+PARSE_STAGES = ['processor', 'extract_identifiers', 'extract_formulae']
+
+# end of a queue.
+_STOP = object()
+
+
+@dataclass
+class _Job:
+    """a parsed document waiting for POS tagging and its noun phrases."""
+    path: str
+    doc: XMLDocument
+    pending: int = 2
+    error: Optional[str] = None
+    # metrics of noun phrase extraction, recorded apart from doc.metrics.
+    noun_phrase_metrics: Optional[DocumentMetrics] = None
+
+
+def _warmup():
+    # load the models once, before the first document.
+    pipeline_pool.warmup(lang='en', processors='tokenize')
+    pipeline_pool.warmup(lang='en', tokenize_pretokenized=True)
+
+
+def _parse(path: str, source: Optional[str], document_kwargs: Dict[str, Any]) -> XMLDocument:
+    doc = XMLDocument(path, source=source, lazy=True, **document_kwargs)
+    doc.run_stages(PARSE_STAGES)
+    return doc
+
+
+def _extract_noun_phrases(doc: XMLDocument) -> DocumentMetrics:
+    # runs beside pos_tagging, which writes doc.metrics: a shallow copy of the
+    # document records the metrics of this thread, merged by _finish.
+    view = copy.copy(doc)
+    view.metrics = DocumentMetrics()
+    with view.metrics.measure('extract_definition_candidate:noun_phrases'):
+        # handed to extract_definition_candidate, which then sends no request.
+        doc._noun_phrases = view.extract_noun_phrases()
+    return view.metrics
+
+
+def _finish(doc: XMLDocument, noun_phrase_metrics: Optional[DocumentMetrics]) -> Dict[str, Any]:
+    if noun_phrase_metrics is not None:
+        doc.metrics.merge(noun_phrase_metrics)
+    doc.run_stages(STAGES)
+    return {'status': 'ok', **document_to_dict(doc)}
+
+
+@dataclass
+class AsyncPipeline:
+    """process documents in one process, overlapping stanza and CoreNLP.
+
+    Documents flow through stages connected by bounded queues: parsing and
+    identifier extraction, then POS tagging (stanza, in `cpu_workers`
+    threads) and noun phrase extraction (CoreNLP tregex, at most
+    `max_corenlp_requests` requests in flight) side by side, then candidates
+    and ranking features. While stanza tags a document, the CoreNLP server
+    works on others, so throughput approaches that of the slower back end.
+    Results (see corpus_runner.document_to_dict) come in order of completion.
+    Memory can not be traced (trace_memory): tracemalloc is global to the
+    process, where several documents are processed at a time.
+
+    ----------------------
+    usage:
+    pipeline = AsyncPipeline(max_corenlp_requests=4)
+    with JSONLinesSink('results.jsonl') as sink:
+        summary = pipeline.run(Path('./data/test_latexml/').glob('*.html'), sink)
+    """
+    # keyword arguments passed to XMLDocument.
+    document_kwargs: Dict[str, Any] = field(default_factory=dict)
+    # endpoint of a running CoreNLP server; one is started if None.
+    corenlp_endpoint: Optional[str] = None
+    start_corenlp: bool = True
+    # threads running stanza (pipelines are shared, so 1 unless they are not).
+    cpu_workers: int = 1
+    max_corenlp_requests: int = 4
+    # documents waiting between two stages.
+    queue_size: int = 8
+    warmup: bool = True
+    # metrics of the documents processed by run(), aggregated.
+    metrics: CorpusMetrics = field(default_factory=CorpusMetrics, init=False)
+
+    def __post_init__(self):
+        if self.document_kwargs.get('trace_memory'):
+            raise ValueError('trace_memory is not supported by AsyncPipeline')
+
+    async def iter_results(self, tasks: Iterable[Task]) -> AsyncIterator[Dict[str, Any]]:
+        """process tasks and yield their results in order of completion.
+
+        Args:
+            tasks (iterable): paths of documents, or (path, source) pairs.
+
+        Returns:
+            results (async iterator): result (dict) of each document.
+        """
+        session = None
+        document_kwargs = dict(self.document_kwargs)
+        if self.corenlp_endpoint is not None or self.start_corenlp:
+            if self.corenlp_endpoint is None:
+                session = CoreNLPSession(timeout=30000, memory='16G')
+            else:
+                session = CoreNLPSession(endpoint=self.corenlp_endpoint, start_server=False)
+            # started here, not concurrently by the first requests.
+            session.start()
+            document_kwargs['corenlp_session'] = session
+        cpu_executor = ThreadPoolExecutor(self.cpu_workers, thread_name_prefix='stanza')
+        io_executor = ThreadPoolExecutor(self.max_corenlp_requests, thread_name_prefix='corenlp')
+        results = asyncio.Queue(self.queue_size)
+        pipeline = asyncio.ensure_future(self._run(
+            tasks, document_kwargs, results, cpu_executor, io_executor))
+        try:
+            while True:
+                result = await results.get()
+                if result is _STOP:
+                    break
+                yield result
+            await pipeline
+        finally:
+            pipeline.cancel()
+            cpu_executor.shutdown(wait=True)
+            io_executor.shutdown(wait=True)
+            if session is not None and self.corenlp_endpoint is None:
+                session.stop()
+
+    async def _run(self, tasks, document_kwargs, results, cpu_executor, io_executor):
+        loop = asyncio.get_running_loop()
+        parse_queue = asyncio.Queue(self.queue_size)
+        tag_queue = asyncio.Queue(self.queue_size)
+        noun_phrase_queue = asyncio.Queue(self.queue_size)
+        corenlp_slots = asyncio.Semaphore(self.max_corenlp_requests)
+
+        async def feed():
+            for task in tasks:
+                await parse_queue.put(task)
+            for _ in range(self.cpu_workers):
+                await parse_queue.put(_STOP)
+
+        async def parse():
+            while True:
+                task = await parse_queue.get()
+                if task is _STOP:
+                    return
+                path, source = task if isinstance(task, tuple) else (str(task), None)
+                try:
+                    doc = await loop.run_in_executor(
+                        cpu_executor, _parse, path, source, document_kwargs)
+                except Exception:
+                    await results.put({'status': 'error', 'path': _task_path(task),
+                                       'error': traceback.format_exc()})
+                    continue
+                if doc.get_noun_phrase_backend().uses_pos_tags:
+                    # noun phrases are extracted after tagging, by _finish.
+                    job = _Job(path=path, doc=doc, pending=1)
+                    await tag_queue.put(job)
+                    continue
+                job = _Job(path=path, doc=doc)
+                await tag_queue.put(job)
+                await noun_phrase_queue.put(job)
+
+        async def done(job: _Job):
+            # the last of POS tagging and noun phrase extraction finishes the job.
+            job.pending -= 1
+            if job.pending:
+                return
+            if job.error is None:
+                try:
+                    result = await loop.run_in_executor(
+                        cpu_executor, _finish, job.doc, job.noun_phrase_metrics)
+                except Exception:
+                    job.error = traceback.format_exc()
+            if job.error is not None:
+                result = {'status': 'error', 'path': job.path, 'error': job.error}
+            await results.put(result)
+
+        async def tag():
+            while True:
+                job = await tag_queue.get()
+                if job is _STOP:
+                    return
+                try:
+                    await loop.run_in_executor(
+                        cpu_executor, job.doc.run_stage, 'pos_tagging')
+                except Exception:
+                    job.error = traceback.format_exc()
+                await done(job)
+
+        async def extract_noun_phrases():
+            while True:
+                job = await noun_phrase_queue.get()
+                if job is _STOP:
+                    return
+                try:
+                    async with corenlp_slots:
+                        job.noun_phrase_metrics = await loop.run_in_executor(
+                            io_executor, _extract_noun_phrases, job.doc)
+                except Exception:
+                    job.error = traceback.format_exc()
+                await done(job)
+
+        parsers = [asyncio.ensure_future(parse()) for _ in range(self.cpu_workers)]
+        workers = [asyncio.ensure_future(tag()) for _ in range(self.cpu_workers)] \
+            + [asyncio.ensure_future(extract_noun_phrases())
+               for _ in range(self.max_corenlp_requests)]
+        try:
+            if self.warmup:
+                await loop.run_in_executor(cpu_executor, _warmup)
+            await feed()
+            await asyncio.gather(*parsers)
+            for _ in range(self.cpu_workers):
+                await tag_queue.put(_STOP)
+            for _ in range(self.max_corenlp_requests):
+                await noun_phrase_queue.put(_STOP)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in parsers + workers:
+                worker.cancel()
+            # also on errors (e.g. of `tasks`), which `await pipeline` raises.
+            await results.put(_STOP)
+
+    def run(self,
+            tasks: Iterable[Task],
+            sink: Callable[[Dict[str, Any]], Any]) -> Dict[str, int]:
+        """process tasks and stream every result to `sink`.
+
+        Returns:
+            summary (dict): number of processed and failed documents.
+        """
+        async def consume():
+            summary = {'ok': 0, 'error': 0}
+            async for result in self.iter_results(tasks):
+                summary[result['status']] += 1
+                if 'metrics' in result:
+                    self.metrics.add(DocumentMetrics.from_dict(result['metrics']))
+                sink(result)
+            return summary
+
+        return asyncio.run(consume())
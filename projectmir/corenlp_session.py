@@ -0,0 +1,250 @@
+import ast
+from dataclasses import dataclass, field
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from stanza.server import CoreNLPClient, StartServer
+
+NOUN_PHRASE_ANNOTATORS = 'tokenize,ssplit,pos,lemma,parse'
+
+
+@dataclass
+class CoreNLPSession:
+    """long-lived CoreNLP server session shared by many XMLDocuments.
+
+    The JVM is started once (on `start` or on the first request) and
+    every sentence of a document is sent in a single tregex request,
+    one sentence per line (`ssplit.eolonly`), then split back per sentence.
+
+    ----------------------
+    usage:
+    with CoreNLPSession(memory='16G') as session:
+        for path in paths:
+            doc = XMLDocument(path, corenlp_session=session)
+
+    # connect to an already running server (e.g. StubCoreNLPServer).
+    session = CoreNLPSession(endpoint=server.endpoint, start_server=False)
+    """
+    timeout: int = 30000
+    memory: str = '16G'
+    endpoint: Optional[str] = None
+    start_server: bool = True
+    # maximum number of sentences sent in one request.
+    max_sentences_per_request: int = 500
+    # version of CoreNLP behind the server (that of CORENLP_HOME if None);
+    # it is a part of the annotation cache keys.
+    server_version: Optional[str] = None
+    client_kwargs: Dict[str, Any] = field(default_factory=dict)
+    client: Optional[CoreNLPClient] = field(default=None, init=False, repr=False)
+
+    @property
+    def version(self) -> str:
+        if self.server_version is not None:
+            return self.server_version
+        return corenlp_version()
+
+    def start(self):
+        """start the server (if needed) and connect the client."""
+        if self.client is not None:
+            return self
+        kwargs = dict(self.client_kwargs)
+        if self.endpoint is not None:
+            kwargs['endpoint'] = self.endpoint
+        if not self.start_server:
+            kwargs['start_server'] = StartServer.DONT_START
+        self.client = CoreNLPClient(
+            timeout=self.timeout, memory=self.memory, **kwargs)
+        self.client.start()
+        return self
+
+    def stop(self):
+        """stop the server started by this session."""
+        if self.client is not None:
+            self.client.stop()
+            self.client = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __getstate__(self):
+        # the client holds a server process and can not be shared
+        # with other processes.
+        state = dict(self.__dict__)
+        state['client'] = None
+        return state
+
+    def tregex(self, sentences: List[str], pattern: str,
+               annotators=NOUN_PHRASE_ANNOTATORS) -> List[Dict]:
+        """run a tregex pattern on each sentence with bulk requests.
+
+        Args:
+            sentences (list): sentences (str) to be matched.
+            pattern (str): tregex pattern.
+            annotators (str): annotators needed by the pattern.
+
+        Returns:
+            matches (list): tregex matches (dict) of each sentence.
+        """
+        self.start()
+        matches_list = []
+        chunk_size = self.max_sentences_per_request or len(sentences) or 1
+        for start in range(0, len(sentences), chunk_size):
+            chunk = [sentence.replace('\n', ' ')
+                     for sentence in sentences[start:start + chunk_size]]
+            matches = self.client.tregex(
+                '\n'.join(chunk), pattern, annotators=annotators,
+                properties={'ssplit.eolonly': 'true'})
+            if len(matches['sentences']) == len(chunk):
+                matches_list.extend(matches['sentences'])
+            else:
+                # the server split the request differently from the input;
+                # fall back to one request per sentence.
+                for sentence in chunk:
+                    matches = self.client.tregex(
+                        sentence, pattern, annotators=annotators)
+                    matches_list.append(
+                        {f'{sentence_id}-{match_id}': match
+                         for sentence_id, sentence_matches
+                         in enumerate(matches['sentences'])
+                         for match_id, match in sentence_matches.items()})
+        return matches_list
+
+    def noun_phrases(self, sentences: List[str]) -> List[List[str]]:
+        """return the noun phrases (tregex 'NP') of each sentence.
+        """
+        # https://github.com/stanfordnlp/stanza/issues/288
+        return [[sentence_matches[match_id]['spanString']
+                 for match_id in sentence_matches]
+                for sentence_matches in self.tregex(sentences, 'NP')]
+
+
+@functools.lru_cache(maxsize=None)
+def corenlp_version(corenlp_home: Optional[str] = None) -> str:
+    """return the version of the CoreNLP jar installed in `corenlp_home`
+    (CORENLP_HOME, or the directory of stanza.install_corenlp, by default).
+    'unknown' if no jar is found.
+    """
+    if corenlp_home is None:
+        corenlp_home = os.environ.get(
+            'CORENLP_HOME', os.path.join(os.path.expanduser('~'), 'stanza_corenlp'))
+    versions = []
+    if os.path.isdir(corenlp_home):
+        for name in os.listdir(corenlp_home):
+            match = re.fullmatch(r'stanford-corenlp-(\d+(?:\.\d+)*)\.jar', name)
+            if match:
+                versions.append(tuple(int(part) for part in match.group(1).split('.')))
+    if not versions:
+        return 'unknown'
+    return '.'.join(str(part) for part in max(versions))
+
+
+class StubCoreNLPServer:
+    """local HTTP server that imitates the tregex endpoint of CoreNLP.
+
+    It lets CoreNLPSession be used without starting a JVM (e.g. in tests).
+    `responder(sentence, pattern)` returns the span strings matched in
+    a sentence; by default no span is matched.
+
+    ----------------------
+    usage:
+    with StubCoreNLPServer(lambda s, p: s.split()[:1]) as server:
+        session = CoreNLPSession(endpoint=server.endpoint, start_server=False)
+        session.noun_phrases(['the heat MATH000000 denotes the enthalpy .'])
+    """
+
+    def __init__(self,
+                 responder: Optional[Callable[[str, str], List[str]]] = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0):
+        self.responder = responder or (lambda sentence, pattern: [])
+        self.requests = []
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def respond(self, text: str, pattern: str, properties: Dict) -> Dict:
+        if str(properties.get('ssplit.eolonly', '')).lower() == 'true':
+            sentences = text.split('\n')
+        else:
+            sentences = [text]
+        self.requests.append((pattern, sentences))
+        return {'sentences': [
+            {str(i): {'spanString': span, 'match': span, 'namedNodes': []}
+             for i, span in enumerate(self.responder(sentence, pattern))}
+            for sentence in sentences]}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._send(b'pong', 'text/plain')
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                query = {key: values[0]
+                         for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                text = self.rfile.read(length).decode('utf-8')
+                if url.path.rstrip('/') == '/tregex':
+                    body = stub.respond(text, query.get('pattern', ''),
+                                        _parse_properties(query.get('properties')))
+                    self._send(json.dumps(body).encode('utf-8'),
+                               'application/json')
+                else:
+                    # annotate request: an empty, length-delimited Document.
+                    self._send(b'\x00', 'application/octet-stream')
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _parse_properties(properties: Optional[str]) -> Dict:
+    if not properties:
+        return {}
+    try:
+        return json.loads(properties)
+    except ValueError:
+        return ast.literal_eval(properties)
@@ -0,0 +1,229 @@
+from dataclasses import dataclass, field
+import json
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from projectmir.docstore import load_document
+from projectmir.extract_definition import Definition
+from projectmir.ranking import kato_ranking
+from projectmir.xmldoc_child import Identifier
+
+# identifiers whose text_tex starts with a prefix are those in
+# [prefix, prefix + _MAX_CHAR) in the order of the text_tex index.
+_MAX_CHAR = '\U0010ffff'
+
+
+@dataclass
+class IndexedDefinition:
+    """a ranked definition of an identifier in one document of the corpus."""
+    text_tex: str
+    definition: str
+    score: float
+    rank: int
+    path: str
+    document_id: str = ''
+
+
+@dataclass
+class CorpusIndex:
+    """persistent index of the identifiers and ranked definitions of a corpus.
+
+    Definitions are stored in SQLite, keyed by the canonical form of their
+    identifier (Identifier.text_tex) and ordered by score, so a lookup is one
+    range scan of an index. The components of identifiers (mi_list) are
+    indexed too, to find the identifiers containing a symbol. Documents are
+    added one at a time as they are processed; adding a document again
+    replaces its previous entries.
+
+    ----------------------
+    usage:
+    index = CorpusIndex('corpus_index.sqlite3')
+    index.add_document(doc)
+    index.lookup('T_{ref}', top_k=5)    # definitions in each document
+    index.definitions('T_{ref}')        # definitions merged over documents
+    index.identifiers_with_prefix('T_')
+    index.identifiers_with_component('T')
+    """
+    path: str = 'corpus_index.sqlite3'
+    # number of definitions indexed per identifier and document (all if None).
+    top_k: Optional[int] = 5
+    _connection: Optional[sqlite3.Connection] = field(
+        default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.executescript(
+            'CREATE TABLE IF NOT EXISTS document ('
+            'id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, '
+            'title TEXT NOT NULL, document_id TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS identifier ('
+            'document INTEGER NOT NULL, text_tex TEXT NOT NULL, mi_list TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS component ('
+            'component TEXT NOT NULL, text_tex TEXT NOT NULL, document INTEGER NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS definition ('
+            'text_tex TEXT NOT NULL, document INTEGER NOT NULL, rank INTEGER NOT NULL, '
+            'definition TEXT NOT NULL, score REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS identifier_text_tex ON identifier (text_tex);'
+            'CREATE INDEX IF NOT EXISTS identifier_document ON identifier (document);'
+            'CREATE INDEX IF NOT EXISTS component_component ON component (component, text_tex);'
+            'CREATE INDEX IF NOT EXISTS component_document ON component (document);'
+            'CREATE INDEX IF NOT EXISTS definition_text_tex '
+            'ON definition (text_tex, score DESC, rank);'
+            'CREATE INDEX IF NOT EXISTS definition_document ON definition (document);')
+        self._connection.commit()
+
+    def add_document(self,
+                     doc,
+                     ranking: Callable[..., List[List[Definition]]] = kato_ranking):
+        """index the identifiers of a processed document and their definitions.
+
+        Args:
+            doc (XMLDocument): processed document.
+            ranking (callable): ranking of the candidates of identifiers
+                (kato_ranking or pagel_ranking).
+        """
+        identifiers: List[Identifier] = doc.identifiers
+        definition_list_list = ranking(identifiers, top_k=self.top_k)
+        self._add(str(doc.path), doc.title, str(doc.document_id),
+                  [(identifier.text_tex, identifier.mi_list,
+                    [(definition.definition, definition.score)
+                     for definition in definition_list if definition.definition])
+                   for identifier, definition_list in zip(identifiers, definition_list_list)])
+
+    def add_record(self, record: Dict[str, Any]):
+        """index a result of the corpus runner (see corpus_runner.document_to_dict)."""
+        self._add(record['path'], record['title'], str(record['document_id']),
+                  [(identifier['text_tex'], identifier['mi_list'],
+                    [(definition['text'], definition['score'])
+                     for definition in identifier.get('definitions', [])][:self.top_k])
+                   for identifier in record['identifiers']])
+
+    def _add(self, path: str, title: str, document_id: str,
+             identifiers: List[Tuple[str, List[str], List[Tuple[str, float]]]]):
+        with self._lock:
+            self._delete(path)
+            document = self._connection.execute(
+                'INSERT INTO document (path, title, document_id) VALUES (?, ?, ?)',
+                (path, title, document_id)).lastrowid
+            self._connection.executemany(
+                'INSERT INTO identifier VALUES (?, ?, ?)',
+                [(document, text_tex, json.dumps(mi_list, ensure_ascii=False))
+                 for text_tex, mi_list, _ in identifiers])
+            self._connection.executemany(
+                'INSERT INTO component VALUES (?, ?, ?)',
+                [(component, text_tex, document)
+                 for text_tex, mi_list, _ in identifiers for component in set(mi_list)])
+            self._connection.executemany(
+                'INSERT INTO definition VALUES (?, ?, ?, ?, ?)',
+                [(text_tex, document, rank, definition, score)
+                 for text_tex, _, definitions in identifiers
+                 for rank, (definition, score) in enumerate(definitions)])
+            self._connection.commit()
+
+    def _delete(self, path: str):
+        row = self._connection.execute(
+            'SELECT id FROM document WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return
+        for table in ('identifier', 'component', 'definition'):
+            self._connection.execute(f'DELETE FROM {table} WHERE document = ?', row)
+        self._connection.execute('DELETE FROM document WHERE id = ?', row)
+
+    def remove_document(self, path: str):
+        with self._lock:
+            self._delete(str(path))
+            self._connection.commit()
+
+    def lookup(self, text_tex: str, top_k: Optional[int] = None) -> List[IndexedDefinition]:
+        """return the definitions of an identifier in every document,
+        by descending score.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT definition.text_tex, definition, score, rank, path, document_id '
+                'FROM definition JOIN document ON document.id = definition.document '
+                'WHERE text_tex = ? ORDER BY score DESC, rank LIMIT ?',
+                (text_tex, -1 if top_k is None else top_k)).fetchall()
+        return [IndexedDefinition(*row) for row in rows]
+
+    def definitions(self, text_tex: str, top_k: Optional[int] = None) -> List[Definition]:
+        """return the definitions of an identifier merged over documents:
+        the score of a definition is the sum of its scores in the documents.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT definition, SUM(score) AS total FROM definition '
+                'WHERE text_tex = ? GROUP BY definition ORDER BY total DESC, definition '
+                'LIMIT ?', (text_tex, -1 if top_k is None else top_k)).fetchall()
+        return [Definition(definition=definition, score=score) for definition, score in rows]
+
+    def identifiers_with_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """return the identifiers (text_tex) starting with `prefix`, in order."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT DISTINCT text_tex FROM identifier '
+                'WHERE text_tex >= ? AND text_tex < ? ORDER BY text_tex LIMIT ?',
+                (prefix, prefix + _MAX_CHAR, -1 if limit is None else limit)).fetchall()
+        return [text_tex for text_tex, in rows]
+
+    def identifiers_with_component(self, component: str,
+                                   limit: Optional[int] = None) -> List[str]:
+        """return the identifiers (text_tex) one of whose components (mi_list)
+        is `component`, in order.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT DISTINCT text_tex FROM component WHERE component = ? '
+                'ORDER BY text_tex LIMIT ?',
+                (component, -1 if limit is None else limit)).fetchall()
+        return [text_tex for text_tex, in rows]
+
+    def documents_with_identifier(self, text_tex: str) -> List[Tuple[str, str]]:
+        """return (path, document_id) of the documents containing an identifier."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT DISTINCT path, document_id FROM identifier '
+                'JOIN document ON document.id = identifier.document '
+                'WHERE text_tex = ? ORDER BY path', (text_tex,)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {table: self._connection.execute(
+                        f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('document', 'identifier', 'definition')}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback_):
+        self.close()
+
+    def __getstate__(self):
+        # the connection is reopened by the process that unpickles the index.
+        return {'path': self.path, 'top_k': self.top_k}
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._connection = None
+        self.__post_init__()
+
+
+def build_index(paths: Iterable[str], index_path: str, **index_kwargs) -> CorpusIndex:
+    """index documents saved by docstore.save_document.
+
+    ----------------------
+    usage:
+    index = build_index(Path('./store/').glob('*.pmirdoc'), 'corpus_index.sqlite3')
+    """
+    index = CorpusIndex(index_path, **index_kwargs)
+    for path in paths:
+        index.add_document(load_document(str(path)))
+    return index
@@ -0,0 +1,288 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+import json
+import os
+import traceback
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+
+from projectmir.corenlp_session import CoreNLPSession
+from projectmir.instrumentation import CorpusMetrics, DocumentMetrics
+from projectmir.pipeline_pool import pipeline_pool
+from projectmir.ranking import kato_ranking
+from projectmir.wikipedia_dump import WikipediaDumpReader
+from projectmir.xmldocument import XMLDocument
+
+# a task is either the path of a document or (path, source) of a dump page.
+Task = Union[str, os.PathLike, Tuple[str, str]]
+
+# state of a worker process, set once by _initialize_worker.
+_worker_state: Dict[str, Any] = {}
+
+
+def document_to_dict(doc: XMLDocument, top_k: Optional[int] = 5) -> Dict[str, Any]:
+    """return a JSON-serializable summary of a processed document, with the
+    `top_k` definitions of each identifier ranked by kato_ranking
+    (see corpus_index.CorpusIndex.add_record).
+    """
+    definition_list_list = kato_ranking(doc.identifiers, top_k=top_k)
+    return {
+        'path': doc.path,
+        'title': doc.title,
+        'namespace': doc.namespace,
+        'document_id': doc.document_id,
+        'identifiers': [
+            {'id': identifier.id,
+             'text_tex': identifier.text_tex,
+             'mi_list': identifier.mi_list,
+             'sentences': [sentence.id for sentence in identifier.sentences],
+             'candidates': [
+                 {'text': candidate.text,
+                  'sentence_id': candidate.sentence.id,
+                  'word_count_btwn_var_cand': candidate.word_count_btwn_var_cand,
+                  'candidate_count_in_sentence': candidate.candidate_count_in_sentence,
+                  'score_match_character': candidate.score_match_character}
+                 for candidate in identifier.candidates],
+             'definitions': [{'text': definition.definition, 'score': definition.score}
+                             for definition in definition_list if definition.definition]}
+            for identifier, definition_list in zip(doc.identifiers, definition_list_list)],
+        'formulae': [{'text_tex': formula.text_tex,
+                      'text_replaced': formula.text_replaced,
+                      'identifier_ids': formula.identifier_ids}
+                     for formula in doc.formulae],
+        'metrics': doc.metrics.to_dict(),
+    }
+
+
+def _initialize_worker(document_kwargs, warmup, corenlp_endpoint, torch_threads):
+    if torch_threads:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+    document_kwargs = dict(document_kwargs)
+    if corenlp_endpoint is not None:
+        document_kwargs['corenlp_session'] = CoreNLPSession(
+            endpoint=corenlp_endpoint, start_server=False)
+    _worker_state['document_kwargs'] = document_kwargs
+    if warmup:
+        # load the models once per worker instead of once per document.
+        pipeline_pool.warmup(lang='en', processors='tokenize')
+        pipeline_pool.warmup(lang='en', tokenize_pretokenized=True)
+
+
+def _process_document(task: Task) -> Dict[str, Any]:
+    path, source = task if isinstance(task, tuple) else (str(task), None)
+    try:
+        doc = XMLDocument(path, source=source, **_worker_state['document_kwargs'])
+        return {'status': 'ok', **document_to_dict(doc)}
+    except Exception:
+        return {'status': 'error', 'path': path, 'error': traceback.format_exc()}
+
+
+def _task_path(task: Task) -> str:
+    return task[0] if isinstance(task, tuple) else str(task)
+
+
+@dataclass
+class JSONLinesSink:
+    """write each result as one JSON line (flushed per document)."""
+    path: str
+    mode: str = 'a'
+
+    def __post_init__(self):
+        self._file = open(self.path, self.mode, encoding='utf-8')
+
+    def __call__(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback_):
+        self.close()
+
+
+@dataclass
+class CorpusRunner:
+    """process many documents with a pool of worker processes.
+
+    Each worker loads the stanza pipelines once (`warmup`) and connects to
+    one CoreNLP server shared by all workers. At most `max_in_flight`
+    documents are submitted at a time, and an exception (or a crashed
+    worker) only produces an error record for the document concerned.
+
+    ----------------------
+    usage:
+    runner = CorpusRunner(workers=8)
+    with JSONLinesSink('results.jsonl') as sink:
+        summary = runner.run(Path('./data/test_latexml/').glob('*.html'), sink)
+    """
+    workers: Optional[int] = None
+    max_in_flight: Optional[int] = None
+    warmup: bool = True
+    # keyword arguments passed to XMLDocument in the workers.
+    document_kwargs: Dict[str, Any] = field(default_factory=dict)
+    # endpoint of a running CoreNLP server; one is started if None.
+    corenlp_endpoint: Optional[str] = None
+    start_corenlp: bool = True
+    # threads used by torch in each worker (1 avoids oversubscription).
+    torch_threads: int = 1
+    # metrics of the documents processed by run(), aggregated.
+    metrics: CorpusMetrics = field(default_factory=CorpusMetrics, init=False)
+
+    def _executor(self, workers, corenlp_endpoint):
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(self.document_kwargs, self.warmup,
+                      corenlp_endpoint, self.torch_threads))
+
+    def iter_results(self, tasks: Iterable[Task]) -> Iterator[Dict[str, Any]]:
+        """process tasks and yield their results in order of completion.
+
+        Args:
+            tasks (iterable): paths of documents, or (path, source) pairs.
+
+        Returns:
+            results (iterator): result (dict) of each document.
+        """
+        session = None
+        corenlp_endpoint = self.corenlp_endpoint
+        if corenlp_endpoint is None and self.start_corenlp:
+            session = CoreNLPSession(timeout=30000, memory='16G').start()
+            corenlp_endpoint = session.client.endpoint
+        workers = self.workers or os.cpu_count() or 1
+        max_in_flight = self.max_in_flight or 2 * workers
+        tasks = iter(tasks)
+        executor = self._executor(workers, corenlp_endpoint)
+        in_flight = {}
+        retried = set()
+        try:
+            while True:
+                for task in tasks:
+                    in_flight[executor.submit(_process_document, task)] = task
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                lost = []
+                for future in done:
+                    task = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # a worker died; retry its documents once in a new pool.
+                        if _task_path(task) in retried:
+                            yield {'status': 'error', 'path': _task_path(task),
+                                   'error': 'worker process terminated abruptly'}
+                        else:
+                            retried.add(_task_path(task))
+                            lost.append(task)
+                    else:
+                        yield result
+                if lost:
+                    executor.shutdown(wait=False)
+                    executor = self._executor(workers, corenlp_endpoint)
+                    in_flight = {executor.submit(_process_document, task): task
+                                 for task in list(in_flight.values()) + lost}
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if session is not None:
+                session.stop()
+
+    def run(self,
+            tasks: Iterable[Task],
+            sink: Callable[[Dict[str, Any]], Any]) -> Dict[str, int]:
+        """process tasks and stream every result to `sink`.
+
+        Returns:
+            summary (dict): number of processed and failed documents.
+        """
+        summary = {'ok': 0, 'error': 0}
+        for result in self.iter_results(tasks):
+            summary[result['status']] += 1
+            if 'metrics' in result:
+                self.metrics.add(DocumentMetrics.from_dict(result['metrics']))
+            sink(result)
+        return summary
+
+
+@dataclass
+class DumpCheckpoint:
+    """offset from which a stopped run over a Wikipedia dump resumes.
+
+    dump_tasks registers the pages it hands out, and `completed` is called
+    once the result of a page is written. Results come in order of
+    completion, so the checkpoint is the offset of the first page whose
+    result is not written yet (every page before it is done), or the end of
+    the last page read if none is pending. It is written to `path` after
+    each completed page; pages after it that were already done are processed
+    again on resume.
+
+    ----------------------
+    usage:
+    checkpoint = DumpCheckpoint('results.jsonl.offset')
+    reader = WikipediaDumpReader(dump_path, offset=checkpoint.load())
+    def write(record):
+        sink(record)
+        checkpoint.completed(record['path'])
+    runner.run(dump_tasks(reader, checkpoint), write)
+    """
+    path: Optional[str] = None
+    # end of the last page read.
+    read_offset: int = 0
+    # offsets of the pages handed out whose result is not written yet.
+    pending: Set[int] = field(default_factory=set)
+
+    @property
+    def offset(self) -> int:
+        return min(self.pending) if self.pending else self.read_offset
+
+    def load(self) -> int:
+        """return the offset saved at `path` (0 if there is none)."""
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+
+    def started(self, page_offset: int, page_end: int, pending: bool = True):
+        """register a page read from the dump (not pending if it is skipped)."""
+        if pending:
+            self.pending.add(page_offset)
+        self.read_offset = page_end
+
+    def completed(self, task_path: str):
+        """register the written result of a page (path 'dump#offset')."""
+        self.pending.discard(int(task_path.rpartition('#')[2]))
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(f'{self.offset}\n')
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def dump_tasks(reader: WikipediaDumpReader,
+               checkpoint: Optional[DumpCheckpoint] = None) -> Iterator[Task]:
+    """tasks of the pages of a Wikipedia dump (read by the parent process).
+    pages are registered in `checkpoint` as they are handed out.
+    """
+    if checkpoint is not None:
+        checkpoint.read_offset = reader.offset
+    for page_offset, page in reader.iter_pages():
+        accepted = reader.accept(page)
+        if checkpoint is not None:
+            checkpoint.started(page_offset, page_offset + len(page), pending=accepted)
+        if accepted:
+            yield f'{reader.path}#{page_offset}', page.decode('utf-8')
@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from projectmir.xmldoc_child import Identifier, math_token, math_token_regexp
+
+# tag of the words of a <description>.
+description_tag_regexp = re.compile(r'(NN[PS]{0,2}|NP)')
+
+Token = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class TokenTest:
+    """test on one (word, tag) token.
+    the word must be one of `words` (if any) and the tag one of `tags` (if any).
+    an optional test is skipped when it does not match.
+    """
+    words: FrozenSet[str] = frozenset()
+    tags: FrozenSet[str] = frozenset()
+    optional: bool = False
+
+    def __call__(self, token: Token) -> bool:
+        return (not self.words or token[0] in self.words) \
+            and (not self.tags or token[1] in self.tags)
+
+
+def word(*words: str, optional: bool = False) -> TokenTest:
+    return TokenTest(words=frozenset(words), optional=optional)
+
+
+def tag(*tags: str, optional: bool = False) -> TokenTest:
+    return TokenTest(tags=frozenset(tags), optional=optional)
+
+
+@dataclass(frozen=True)
+class DescriptionPattern:
+    """<description> pattern around an <identifier>.
+
+    `before` and `after` are the tokens right before and after the
+    identifier, in sentence order. The description is the longest run of
+    nouns (see description_tag_regexp) adjacent to `before` (description='before')
+    or to `after` (description='after').
+    """
+    name: str
+    before: Tuple[TokenTest, ...] = ()
+    after: Tuple[TokenTest, ...] = ()
+    description: str = 'after'
+
+
+# patterns of pattern_based_extract_description, in order of output.
+DESCRIPTION_PATTERNS = [
+    DescriptionPattern('<description> <identifier>', description='before'),
+    DescriptionPattern('<identifier> is [the] <description>',
+                       after=(word('is'), word('the', optional=True))),
+    DescriptionPattern('let <identifier> be the <description>',
+                       before=(word('let'),), after=(word('be'), word('the'))),
+    DescriptionPattern('<description> is|are denoted by <identifier>',
+                       before=(word('is', 'are'), word('denoted'), word('by')),
+                       description='before'),
+    DescriptionPattern('<identifier> denotes */DT <description>',
+                       after=(word('denotes'), tag('DT'))),
+]
+
+
+def _match_tests(tokens: Sequence[Token], tests: Iterable[TokenTest],
+                 position: int, step: int) -> Optional[int]:
+    """match tests from `position` towards `step` and return the position
+    next to the matched tokens (None if a test fails).
+    """
+    for test_ in tests:
+        if 0 <= position < len(tokens) and test_(tokens[position]):
+            position += step
+        elif not test_.optional:
+            return None
+    return position
+
+
+@dataclass
+class DescriptionMatcher:
+    """patterns compiled into dispatch tables over tagged sentences.
+
+    A pattern is only tried at an identifier whose adjacent word can start it:
+    patterns are indexed by the words of their test next to the identifier
+    (after side first), and the others are tried everywhere. Each sentence
+    is scanned once for all the identifiers it contains.
+
+    ----------------------
+    usage:
+    matcher = DescriptionMatcher()
+    descriptions = matcher.match_sentence(sentence.tagged)  # {'MATH000001': [...], ...}
+    """
+    patterns: List[DescriptionPattern] = field(
+        default_factory=lambda: list(DESCRIPTION_PATTERNS))
+    identifier_tag: str = 'NN'
+
+    def __post_init__(self):
+        self._by_next_word: Dict[str, List[int]] = {}
+        self._by_previous_word: Dict[str, List[int]] = {}
+        self._unindexed: List[int] = []
+        self._noun_tags: Dict[str, bool] = {}
+        for i, pattern_ in enumerate(self.patterns):
+            if pattern_.after and pattern_.after[0].words and not pattern_.after[0].optional:
+                table, words = self._by_next_word, pattern_.after[0].words
+            elif pattern_.before and pattern_.before[-1].words \
+                    and not pattern_.before[-1].optional:
+                table, words = self._by_previous_word, pattern_.before[-1].words
+            else:
+                self._unindexed.append(i)
+                continue
+            for word_ in words:
+                table.setdefault(word_, []).append(i)
+        # (before tests from the identifier outwards, after tests, description side).
+        self._compiled = [(tuple(reversed(pattern_.before)), pattern_.after,
+                           pattern_.description == 'before')
+                          for pattern_ in self.patterns]
+
+    def match_sentence(self, tokens: Sequence[Token]) -> Dict[str, List[str]]:
+        """return the descriptions of every identifier of a tagged sentence.
+
+        Returns:
+            descriptions (dict): identifier token (see xmldoc_child.math_token) -> descriptions,
+                in order of occurrence and then of patterns.
+        """
+        n = len(tokens)
+        descriptions = {}
+        for index_target, (word_, tag_) in enumerate(tokens):
+            if tag_ != self.identifier_tag or not word_.startswith('MATH') \
+                    or not math_token_regexp.fullmatch(word_):
+                continue
+            descriptions_ = descriptions.setdefault(word_, [])
+            next_word = tokens[index_target + 1][0] if index_target + 1 < n else None
+            previous_word = tokens[index_target - 1][0] if index_target >= 1 else None
+            pattern_indexes = self._by_next_word.get(next_word, []) \
+                + self._by_previous_word.get(previous_word, [])
+            pattern_indexes = sorted(pattern_indexes + self._unindexed) \
+                if pattern_indexes else self._unindexed
+            for i in pattern_indexes:
+                before, after, description_before = self._compiled[i]
+                start = _match_tests(tokens, before, index_target - 1, -1)
+                if start is None:
+                    continue
+                end = _match_tests(tokens, after, index_target + 1, 1)
+                if end is None:
+                    continue
+                if description_before:
+                    end = start + 1
+                    while start >= 0 and self._is_noun(tokens[start]):
+                        start -= 1
+                    start += 1
+                else:
+                    start = end
+                    while end < n and self._is_noun(tokens[end]):
+                        end += 1
+                if start < end:
+                    descriptions_.append(' '.join(token[0] for token in tokens[start:end]))
+        return descriptions
+
+    def _is_noun(self, token: Token) -> bool:
+        """whether a token can be a word of a <description>."""
+        is_noun_tag = self._noun_tags.get(token[1])
+        if is_noun_tag is None:
+            is_noun_tag = self._noun_tags[token[1]] = \
+                bool(description_tag_regexp.fullmatch(token[1]))
+        return is_noun_tag and 'MATH' not in token[0]
+
+    def match_identifiers(self, identifiers: List[Identifier]) -> List[List[Optional[str]]]:
+        """return the descriptions of each identifier of a document (in the
+        format of pattern_based_extract_description: [None] if nothing matches).
+        each sentence is matched once, however many identifiers it contains.
+        """
+        matched: Dict[int, Dict[str, List[str]]] = {}
+        description_list_list = []
+        for identifier in identifiers:
+            identifier_text = math_token(identifier.id)
+            description_list = []
+            for sentence in identifier.sentences:
+                if sentence.id not in matched:
+                    matched[sentence.id] = self.match_sentence(sentence.tagged)
+                description_list.extend(matched[sentence.id].get(identifier_text, []))
+            description_list_list.append(description_list or [None])
+        return description_list_list
+
+
+description_matcher = DescriptionMatcher()
+
+
+# templates of pattern_based_extract_description_using_noun_phrases, in
+# order of output. a tuple is an alternation of words.
+NOUN_PHRASE_TEMPLATES = [
+    ('<description>', '<identifier>'),
+    ('<identifier>', 'is', '<description>'),
+    ('let', '<identifier>', 'be', '<description>'),
+    ('<description>', ('is', 'are'), 'denoted', 'by', '<identifier>'),
+    ('<identifier>', 'denotes', '<description>'),
+]
+
+
+def _match_piece(token: str, piece: FrozenSet[str], first: bool, last: bool) -> bool:
+    if first and last:
+        return any(piece_ in token for piece_ in piece)
+    if first:
+        return any(token.endswith(piece_) for piece_ in piece)
+    if last:
+        return any(token.startswith(piece_) for piece_ in piece)
+    return token in piece
+
+
+def _match_pieces(tokens: List[str], pieces: List[FrozenSet[str]], start: int) -> bool:
+    """whether ' '.join(pieces) occurs in ' '.join(tokens) from the token
+    `start`: the first piece may end a token and the last may start one.
+    """
+    if start < 0 or start + len(pieces) > len(tokens):
+        return False
+    last = len(pieces) - 1
+    return all(_match_piece(tokens[start + j], piece, j == 0, j == last)
+               for j, piece in enumerate(pieces))
+
+
+@dataclass
+class NounPhraseTemplateMatcher:
+    """match the candidates (noun phrases) of identifiers against templates.
+
+    Sentences are split on spaces once, and each template is checked on
+    the tokens around the positions of the identifier, so candidates are
+    compared as plain text (no regex is compiled per candidate).
+    A template matches where its text occurs in the sentence, as a
+    substring search would.
+
+    ----------------------
+    usage:
+    matcher = NounPhraseTemplateMatcher()
+    description_list_list = matcher.match_identifiers(doc.identifiers)
+    """
+    templates: List[Tuple] = field(default_factory=lambda: list(NOUN_PHRASE_TEMPLATES))
+
+    def __post_init__(self):
+        # (pieces before <description>, pieces after it) of each template,
+        # where None stands for the identifier.
+        self._compiled = []
+        for template in self.templates:
+            pieces = [None if piece == '<identifier>'
+                      else frozenset(piece) if isinstance(piece, tuple)
+                      else piece if piece == '<description>'
+                      else frozenset([piece])
+                      for piece in template]
+            k = pieces.index('<description>')
+            self._compiled.append((pieces[:k], pieces[k + 1:]))
+
+    def match_identifiers(self, identifiers: List[Identifier]) -> List[List[str]]:
+        """return the candidates (text) of each identifier of a document
+        matching each template, in order of candidates and then of templates.
+        """
+        tokens_cache: Dict[int, List[str]] = {}
+        positions_cache: Dict[Tuple[int, str], List[int]] = {}
+        description_list_list = []
+        for identifier in identifiers:
+            identifier_text = math_token(identifier.id)
+            identifier_piece = frozenset([identifier_text])
+            description_list = []
+            for candidate_ in identifier.candidates:
+                sentence = candidate_.included_sentence
+                tokens = tokens_cache.get(sentence.id)
+                if tokens is None:
+                    tokens = tokens_cache[sentence.id] = sentence.original.split(' ')
+                positions = positions_cache.get((sentence.id, identifier_text))
+                if positions is None:
+                    positions = positions_cache[(sentence.id, identifier_text)] = \
+                        [i for i, token in enumerate(tokens) if identifier_text in token]
+                if not positions:
+                    continue
+                description = [frozenset([piece]) for piece in candidate_.text.split(' ')]
+                for before, after in self._compiled:
+                    pieces = before + description + after
+                    k = pieces.index(None)
+                    pieces[k] = identifier_piece
+                    if any(_match_pieces(tokens, pieces, position - k)
+                           for position in positions):
+                        description_list.append(candidate_.text)
+            description_list_list.append(description_list)
+        return description_list_list
+
+
+noun_phrase_matcher = NounPhraseTemplateMatcher()
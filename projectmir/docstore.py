@@ -0,0 +1,363 @@
+from dataclasses import dataclass, field
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from projectmir.instrumentation import DocumentMetrics
+from projectmir.ranking import CandidateFeatures
+from projectmir.xmldoc_child import Candidate, Formulae, Identifier, Sentence
+from projectmir.xmldocument import STAGES, XMLDocument
+
+# file layout: MAGIC, format version (uint32), header length (uint32),
+# JSON header, then the columns, each aligned to ALIGNMENT bytes.
+MAGIC = b'PMIRDOC\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+DOCUMENT_ATTRIBUTES = ['path', 'title', 'namespace', 'document_id']
+PRODUCTS = ['identifiers', 'formulae', 'sentences_list', 'math_token_index']
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+@dataclass
+class _ColumnWriter:
+    """collect the columns of a document as numpy arrays.
+    strings are stored as utf-8 data and offsets; lists as values and offsets.
+    """
+    arrays: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    def add(self, name: str, values, dtype):
+        self.arrays[name] = np.ascontiguousarray(values, dtype=dtype)
+
+    def add_strings(self, name: str, strings: List[str]):
+        encoded = [string.encode('utf-8') for string in strings]
+        self.add(f'{name}.offsets', np.cumsum([0] + [len(data) for data in encoded]), np.int64)
+        self.add(f'{name}.data', np.frombuffer(b''.join(encoded), dtype=np.uint8), np.uint8)
+
+    def add_lists(self, name: str, lists: List[List], dtype):
+        self.add(f'{name}.offsets', np.cumsum([0] + [len(list_) for list_ in lists]), np.int64)
+        self.add(f'{name}.values', [value for list_ in lists for value in list_], dtype)
+
+    def add_string_lists(self, name: str, lists: List[List[str]]):
+        self.add(f'{name}.offsets', np.cumsum([0] + [len(list_) for list_ in lists]), np.int64)
+        self.add_strings(f'{name}.values', [value for list_ in lists for value in list_])
+
+    def write(self, path: str, metadata: Dict[str, Any]):
+        columns, offset = {}, 0
+        for name, array in self.arrays.items():
+            columns[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                             'offset': offset, 'nbytes': array.nbytes}
+            offset = _aligned(offset + array.nbytes)
+        header = json.dumps({'version': FORMAT_VERSION, **metadata, 'columns': columns},
+                            ensure_ascii=False).encode('utf-8')
+        data_start = _aligned(_PREAMBLE.size + len(header))
+        with open(path, 'wb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            for name, array in self.arrays.items():
+                f.seek(data_start + columns[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+
+def save_document(doc: XMLDocument, path: str):
+    """write a processed document in the columnar document format.
+    only the products already computed are written; no stage is run.
+
+    ----------------------
+    usage:
+    doc = XMLDocument('./data/test_latexml/Enthalpy.html')
+    save_document(doc, './data/Enthalpy.pmirdoc')
+    doc = load_document('./data/Enthalpy.pmirdoc')
+    """
+    products = [product for product in PRODUCTS if product in doc.__dict__]
+    writer = _ColumnWriter()
+    writer.add_strings('document.text', [doc.text])
+    writer.add_strings('document.body', [doc.body])
+
+    if 'sentences_list' in products:
+        sentences = doc.sentences_list
+        writer.add('sentence.id', [sentence.id for sentence in sentences], np.int64)
+        writer.add_strings('sentence.original', [sentence.original for sentence in sentences])
+        writer.add_string_lists('sentence.words', [sentence.words for sentence in sentences])
+        writer.add_string_lists('sentence.tags', [sentence.tags for sentence in sentences])
+
+    if 'identifiers' in products:
+        identifiers = doc.identifiers
+        writer.add('identifier.id', [identifier.id for identifier in identifiers], np.int64)
+        writer.add_strings('identifier.text_tex',
+                           [identifier.text_tex for identifier in identifiers])
+        writer.add_string_lists('identifier.mi_list',
+                                [identifier.mi_list for identifier in identifiers])
+        writer.add_lists('identifier.sentences',
+                         [[sentence.id for sentence in identifier.sentences]
+                          for identifier in identifiers], np.int64)
+        candidates = [(i, candidate) for i, identifier in enumerate(identifiers)
+                      for candidate in identifier.candidates]
+        writer.add('candidate.identifier_index', [i for i, _ in candidates], np.int64)
+        writer.add('candidate.sentence_id',
+                   [candidate.sentence.id for _, candidate in candidates], np.int64)
+        writer.add_strings('candidate.text', [candidate.text for _, candidate in candidates])
+        for name in ['word_count_btwn_var_cand', 'candidate_count_in_sentence']:
+            writer.add(f'candidate.{name}',
+                       [getattr(candidate, name) for _, candidate in candidates], np.int64)
+        for name in ['score_match_character', 'score_pagel', 'score_propsed']:
+            writer.add(f'candidate.{name}',
+                       [getattr(candidate, name) for _, candidate in candidates], np.float64)
+        if 'compute_candidate_statistics' in doc.completed_stages:
+            # ranking features, so that ranking does not rebuild the objects.
+            features = CandidateFeatures.from_identifiers(identifiers)
+            for name in ['delta', 'n_sentence', 'tf']:
+                writer.add(f'features.{name}', getattr(features, name), np.float64)
+
+    if 'formulae' in products:
+        writer.add_strings('formula.text_tex', [formula.text_tex for formula in doc.formulae])
+        writer.add_strings('formula.text_replaced',
+                           [formula.text_replaced for formula in doc.formulae])
+        writer.add_lists('formula.identifier_ids',
+                         [formula.identifier_ids for formula in doc.formulae], np.int64)
+
+    if 'math_token_index' in products:
+        math_token_index = doc.math_token_index
+        writer.add_strings('math_token.token', list(math_token_index))
+        writer.add_lists('math_token.occurrences',
+                         [[value for occurrence in occurrences for value in occurrence]
+                          for occurrences in math_token_index.values()], np.int64)
+
+    writer.write(path, {
+        'document': {name: getattr(doc, name) for name in DOCUMENT_ATTRIBUTES},
+        'products': products,
+        'completed_stages': list(doc.completed_stages),
+        'fingerprints': dict(doc.fingerprints),
+        'metrics': doc.metrics.to_dict()})
+
+
+@dataclass
+class DocumentFile:
+    """reader of a file written by save_document.
+    columns are read lazily, as views of the memory-mapped file if `use_mmap`.
+
+    ----------------------
+    usage:
+    with DocumentFile('./data/Enthalpy.pmirdoc') as document_file:
+        features = document_file.candidate_features()
+    """
+    path: str
+    use_mmap: bool = True
+
+    def __post_init__(self):
+        self._file = open(self.path, 'rb')
+        magic, version, header_length = _PREAMBLE.unpack(self._file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{self.path} is not a projectmir document file')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{self.path}: unsupported format version {version} '
+                             f'(supported: {FORMAT_VERSION})')
+        self.header = json.loads(self._file.read(header_length).decode('utf-8'))
+        self._data_start = _aligned(_PREAMBLE.size + header_length)
+        if self.use_mmap:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file.seek(0)
+            self._buffer = self._file.read()
+
+    @property
+    def columns(self) -> Dict[str, Dict[str, Any]]:
+        return self.header['columns']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def column(self, name: str) -> np.ndarray:
+        """return a column (read-only) without copying it."""
+        column = self.columns[name]
+        dtype = np.dtype(column['dtype'])
+        return np.frombuffer(self._buffer, dtype=dtype,
+                             count=column['nbytes'] // dtype.itemsize,
+                             offset=self._data_start + column['offset']
+                             ).reshape(column['shape'])
+
+    def strings(self, name: str) -> List[str]:
+        offsets = self.column(f'{name}.offsets').tolist()
+        data = self.column(f'{name}.data').tobytes()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def lists(self, name: str) -> List[list]:
+        offsets = self.column(f'{name}.offsets').tolist()
+        values = self.column(f'{name}.values').tolist()
+        return [values[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def string_lists(self, name: str) -> List[List[str]]:
+        offsets = self.column(f'{name}.offsets').tolist()
+        values = self.strings(f'{name}.values')
+        return [values[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def candidate_features(self, texts: bool = True) -> CandidateFeatures:
+        """load the ranking features of the candidates only.
+        candidate texts (needed to return definitions) are skipped if not `texts`.
+        """
+        if 'features.tf' not in self:
+            raise ValueError(f'{self.path}: candidate statistics were not computed')
+        return CandidateFeatures(
+            identifier_index=self.column('candidate.identifier_index'),
+            delta=self.column('features.delta'),
+            n_sentence=self.column('features.n_sentence'),
+            tf=self.column('features.tf'),
+            score_match_character=self.column('candidate.score_match_character'),
+            texts=self.strings('candidate.text') if texts else [],
+            n_identifiers=len(self.column('identifier.id')))
+
+    def document(self, **document_kwargs) -> XMLDocument:
+        """rebuild the XMLDocument (no stage is run).
+        `document_kwargs` are passed to XMLDocument (e.g. corenlp_session).
+        """
+        products = self.header['products']
+        doc = XMLDocument(**self.header['document'],
+                          text=self.strings('document.text')[0],
+                          body=self.strings('document.body')[0],
+                          lazy=True, **document_kwargs)
+
+        sentences = []
+        if 'sentences_list' in products:
+            sentences = [Sentence(id=id_, original=original, words=words, tags=tags)
+                         for id_, original, words, tags in zip(
+                             self.column('sentence.id').tolist(),
+                             self.strings('sentence.original'),
+                             self.string_lists('sentence.words'),
+                             self.string_lists('sentence.tags'))]
+            doc.sentences_list = sentences
+        sentence_dict = {sentence.id: sentence for sentence in sentences}
+
+        if 'identifiers' in products:
+            identifiers = [
+                Identifier(text_tex=text_tex, mi_list=mi_list, id=id_,
+                           sentences=[sentence_dict[sentence_id] for sentence_id in sentence_ids])
+                for id_, text_tex, mi_list, sentence_ids in zip(
+                    self.column('identifier.id').tolist(),
+                    self.strings('identifier.text_tex'),
+                    self.string_lists('identifier.mi_list'),
+                    self.lists('identifier.sentences'))]
+            for values in zip(
+                    self.column('candidate.identifier_index').tolist(),
+                    self.strings('candidate.text'),
+                    self.column('candidate.sentence_id').tolist(),
+                    self.column('candidate.word_count_btwn_var_cand').tolist(),
+                    self.column('candidate.candidate_count_in_sentence').tolist(),
+                    self.column('candidate.score_match_character').tolist(),
+                    self.column('candidate.score_pagel').tolist(),
+                    self.column('candidate.score_propsed').tolist()):
+                i, text, sentence_id, word_count, candidate_count, score_match, pagel, propsed \
+                    = values
+                identifiers[i].candidates.append(Candidate(
+                    text=text, score_pagel=pagel, score_propsed=propsed,
+                    sentence=sentence_dict[sentence_id],
+                    word_count_btwn_var_cand=word_count,
+                    candidate_count_in_sentence=candidate_count,
+                    score_match_character=score_match))
+            doc.identifiers = identifiers
+
+        if 'formulae' in products:
+            text_tex_list = self.strings('formula.text_tex')
+            # files written before extract_formulae have no identifier ids.
+            identifier_ids_list = self.lists('formula.identifier_ids') \
+                if 'formula.identifier_ids.offsets' in self else [[]] * len(text_tex_list)
+            doc.formulae = [Formulae(text_replaced=text_replaced, text_tex=text_tex,
+                                     identifier_ids=list(identifier_ids))
+                            for text_tex, text_replaced, identifier_ids in zip(
+                                text_tex_list,
+                                self.strings('formula.text_replaced'),
+                                identifier_ids_list)]
+
+        if 'math_token_index' in products:
+            doc.math_token_index = {
+                token: [tuple(occurrences[k:k + 2]) for k in range(0, len(occurrences), 2)]
+                for token, occurrences in zip(self.strings('math_token.token'),
+                                              self.lists('math_token.occurrences'))}
+
+        doc.completed_stages = list(self.header['completed_stages'])
+        doc.fingerprints = dict(self.header.get('fingerprints', {}))
+        doc.metrics = DocumentMetrics.from_dict(self.header.get('metrics', {}))
+        return doc
+
+    def close(self):
+        if self.use_mmap:
+            try:
+                self._buffer.close()
+            except BufferError:
+                # columns are still in use; the map is released with them.
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback_):
+        self.close()
+
+
+def load_document(path: str, use_mmap: bool = True, **document_kwargs) -> XMLDocument:
+    """load a document written by save_document."""
+    with DocumentFile(path, use_mmap=use_mmap) as document_file:
+        return document_file.document(**document_kwargs)
+
+
+def update_document(path: str,
+                    store_path: str,
+                    source: Optional[str] = None,
+                    stages: Optional[List[str]] = None,
+                    **document_kwargs) -> XMLDocument:
+    """process a document incrementally and save it to `store_path`.
+
+    If `store_path` exists, the stored document is loaded, and only its
+    stale stages (whose markup, code or configuration changed, see
+    XMLDocument.stage_fingerprint) and the stages depending on them run
+    again. For example, after changing compute_candidate_statistics, only
+    this stage runs: stanza and CoreNLP are not called.
+
+    Args:
+        path (str): path of the document (read unless `source` is given).
+        store_path (str): file written by save_document.
+        source (str): markup of the document (see XMLDocument).
+        stages (list): stages to be completed (all stages if None).
+
+    Returns:
+        doc (XMLDocument): the processed document.
+
+    ----------------------
+    usage:
+    for path in Path('./data/test_latexml/').glob('*.html'):
+        update_document(str(path), str(path.with_suffix('.pmirdoc')))
+    """
+    if os.path.exists(store_path):
+        doc = load_document(store_path, **document_kwargs)
+        doc.path, doc.source = path, source
+        doc.invalidate_stages(doc.stale_stages())
+    else:
+        doc = XMLDocument(path, source=source, lazy=True, **document_kwargs)
+    completed_stages = list(doc.completed_stages)
+    doc.run_stages(stages or STAGES)
+    if doc.completed_stages != completed_stages:
+        save_document(doc, store_path)
+    return doc
+
+
+def load_candidate_features(paths: List[str], texts: bool = True) -> CandidateFeatures:
+    """load and concatenate the candidate features of several documents.
+
+    ----------------------
+    usage:
+    features = load_candidate_features(glob.glob('./data/*.pmirdoc'))
+    """
+    features_list = []
+    for path in paths:
+        with DocumentFile(path) as document_file:
+            features_list.append(document_file.candidate_features(texts=texts))
+    return CandidateFeatures.concatenate(features_list)
@@ -0,0 +1,213 @@
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from projectmir.xmldoc_child import Identifier
+
+
+@dataclass
+class GoldIndex:
+    """hash index over gold identifiers and definitions, built once.
+
+    Gold definitions of an identifier are either a list of definitions
+    (a prediction is correct if it is one of them) or a string
+    (a prediction is correct if it is a substring of it), as in
+    evaluate_identifier_definition.
+    """
+    identifier_ids: Dict[str, int] = field(default_factory=dict)
+    definitions: List[Union[str, FrozenSet[str]]] = field(default_factory=list)
+    n_identifiers: int = 0
+    n_definitions: int = 0
+
+    @classmethod
+    def from_lists(cls,
+                   gold_identifier_list: List[str],
+                   gold_definition_list: List[Union[str, List[str]]]) -> 'GoldIndex':
+        identifier_ids = {}
+        for i, gold_identifier in enumerate(gold_identifier_list):
+            # list.index() returns the first occurrence.
+            identifier_ids.setdefault(gold_identifier, i)
+        definitions = [gold_definition if isinstance(gold_definition, str)
+                       else frozenset(gold_definition)
+                       for gold_definition in gold_definition_list]
+        return cls(identifier_ids=identifier_ids,
+                   definitions=definitions,
+                   n_identifiers=len(gold_identifier_list),
+                   n_definitions=len(gold_definition_list))
+
+    def lookup(self, text_tex: str) -> Optional[int]:
+        """return the gold id of an identifier (None if it is not gold)."""
+        return self.identifier_ids.get(text_tex)
+
+    def is_correct(self, gold_id: int, definition: Optional[str]) -> bool:
+        """return whether a definition is a gold definition of a gold identifier."""
+        if definition is None:
+            return False
+        return definition in self.definitions[gold_id]
+
+
+@dataclass
+class EvaluationResult:
+    """identifier and definition scores at every rank cutoff 1..max_rank.
+    definition scores are arrays whose k-1 th element is the score at rank k.
+    """
+    identifier_tp: int = 0
+    n_identifiers: int = 0
+    n_gold_identifiers: int = 0
+    n_gold_definitions: int = 0
+    definition_tp: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    definition_positive: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    # sum of reciprocal ranks of the first correct definition, and the
+    # number of gold identifiers it is averaged over.
+    reciprocal_rank_sum: float = 0.0
+    n_ranked: int = 0
+
+    @property
+    def identifier_recall(self) -> float:
+        return self.identifier_tp / self.n_gold_identifiers
+
+    @property
+    def identifier_precision(self) -> float:
+        return self.identifier_tp / self.n_identifiers
+
+    @property
+    def definition_recall(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.definition_tp / self.n_gold_definitions
+
+    @property
+    def definition_precision(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.definition_tp / self.definition_positive
+
+    @property
+    def definition_f1(self) -> np.ndarray:
+        recall, precision = self.definition_recall, self.definition_precision
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(recall + precision > 0,
+                            2 * recall * precision / (recall + precision), 0.0)
+
+    @property
+    def mrr(self) -> float:
+        return self.reciprocal_rank_sum / self.n_ranked if self.n_ranked else 0.0
+
+    def __add__(self, other: 'EvaluationResult') -> 'EvaluationResult':
+        """micro-average two results (e.g. of two documents)."""
+        return EvaluationResult(
+            identifier_tp=self.identifier_tp + other.identifier_tp,
+            n_identifiers=self.n_identifiers + other.n_identifiers,
+            n_gold_identifiers=self.n_gold_identifiers + other.n_gold_identifiers,
+            n_gold_definitions=self.n_gold_definitions + other.n_gold_definitions,
+            definition_tp=_add_padded(self.definition_tp, other.definition_tp),
+            definition_positive=_add_padded(self.definition_positive,
+                                            other.definition_positive),
+            reciprocal_rank_sum=self.reciprocal_rank_sum + other.reciprocal_rank_sum,
+            n_ranked=self.n_ranked + other.n_ranked)
+
+    def at(self, rank: int) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """return scores at a rank cutoff in the format of
+        evaluate_identifier_definition.
+        """
+        return (self.identifier_recall, self.identifier_precision), \
+               (float(self.definition_recall[rank - 1]),
+                float(self.definition_precision[rank - 1]))
+
+    def to_rows(self) -> List[Dict[str, float]]:
+        """return one row of scores per rank cutoff."""
+        return [{'max_rank': k + 1,
+                 'identifier_recall': self.identifier_recall,
+                 'identifier_precision': self.identifier_precision,
+                 'definition_recall': float(self.definition_recall[k]),
+                 'definition_precision': float(self.definition_precision[k]),
+                 'definition_f1': float(self.definition_f1[k]),
+                 'mrr': self.mrr}
+                for k in range(len(self.definition_tp))]
+
+
+def _add_padded(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) < len(b):
+        a, b = b, a
+    result = a.copy()
+    result[:len(b)] += b
+    return result
+
+
+def evaluate_definitions(identifier_list: List[Identifier],
+                         definition_list_list: Sequence[Sequence],
+                         gold: GoldIndex,
+                         max_rank: int = 1) -> EvaluationResult:
+    """evaluate ranked definitions at every cutoff 1..max_rank in one pass.
+
+    Args:
+        identifier_list (list): extracted identifiers.
+        definition_list_list (list): ranked definitions (Definition) of each identifier.
+        gold (GoldIndex): gold identifiers and definitions.
+        max_rank (int): largest rank cutoff.
+
+    Returns:
+        EvaluationResult: scores at each rank cutoff and MRR.
+    """
+    if len(identifier_list) != len(definition_list_list):
+        raise ValueError(f'{len(identifier_list)} identifiers but definitions '
+                         f'of {len(definition_list_list)} identifiers')
+    definition_tp = np.zeros(max_rank, dtype=np.int64)
+    definition_positive = np.zeros(max_rank, dtype=np.int64)
+    identifier_tp, reciprocal_rank_sum = 0, 0.0
+    for identifier_, definition_list in zip(identifier_list, definition_list_list):
+        gold_id = gold.lookup(identifier_.text_tex)
+        if gold_id is None:
+            continue
+        identifier_tp += 1
+        correct = np.zeros(max_rank, dtype=np.int64)
+        n_ranked = min(max_rank, len(definition_list))
+        for rank, definition_ in enumerate(definition_list[:n_ranked]):
+            if gold.is_correct(gold_id, definition_.definition):
+                if not correct.any():
+                    reciprocal_rank_sum += 1 / (rank + 1)
+                correct[rank] = 1
+        definition_tp += np.cumsum(correct)
+        definition_positive += np.minimum(np.arange(1, max_rank + 1), n_ranked)
+    return EvaluationResult(identifier_tp=identifier_tp,
+                            n_identifiers=len(identifier_list),
+                            n_gold_identifiers=gold.n_identifiers,
+                            n_gold_definitions=gold.n_definitions,
+                            definition_tp=definition_tp,
+                            definition_positive=definition_positive,
+                            reciprocal_rank_sum=reciprocal_rank_sum,
+                            n_ranked=identifier_tp)
+
+
+def evaluate_systems(documents: List[Tuple[List[Identifier], Dict[str, Sequence[Sequence]]]],
+                     gold_list: List[GoldIndex],
+                     max_rank: int = 1) -> Dict[str, EvaluationResult]:
+    """evaluate several systems on several documents at once.
+    scores of the documents are micro-averaged per system.
+
+    Args:
+        documents (list): (identifier_list, {system name: definition_list_list})
+            of each document.
+        gold_list (list): GoldIndex of each document.
+        max_rank (int): largest rank cutoff.
+
+    Returns:
+        results (dict): EvaluationResult of each system.
+
+    ----------------------
+    usage:
+    gold = GoldIndex.from_lists(gold_identifier, gold_definition_list)
+    results = evaluate_systems(
+        [(doc0.identifiers, {'pagel': definition_list_pagel,
+                             'kato': definition_list_kato})],
+        [gold], max_rank=5)
+    print(results['kato'].to_rows())
+    """
+    if len(documents) != len(gold_list):
+        raise ValueError(f'{len(documents)} documents but {len(gold_list)} gold indexes')
+    results = {}
+    for (identifier_list, system_outputs), gold in zip(documents, gold_list):
+        for system, definition_list_list in system_outputs.items():
+            result = evaluate_definitions(identifier_list, definition_list_list,
+                                          gold, max_rank)
+            results[system] = results[system] + result if system in results else result
+    return results
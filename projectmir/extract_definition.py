@@ -1,10 +1,25 @@
 from dataclasses import dataclass, field
 import math
-import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 
+from projectmir.description_patterns import description_matcher, noun_phrase_matcher
+from projectmir.evaluation import GoldIndex, evaluate_definitions
 from projectmir.xmldoc_child import Identifier
 
+# default parameters of kato_ranking_candidates and pagel_ranking_candidates
+# (and of their vectorized versions in ranking).
+DEFAULT_KATO_PARAMS = {'sigma_d': math.sqrt(12 / math.log(2)),
+                       'sigma_s': 2 / math.sqrt(math.log(2)),
+                       'alpha': 1,
+                       'beta': 1,
+                       'gamma': 0.1,
+                       'eta': 1}
+DEFAULT_PAGEL_PARAMS = {'sigma_d': math.sqrt(12 / math.log(2)),
+                        'sigma_s': 2 / math.sqrt(math.log(2)),
+                        'alpha': 1,
+                        'beta': 1,
+                        'gamma': 0.1}
+
 
 @dataclass
 class Definition:
@@ -23,12 +38,7 @@ def kato_ranking_candidates(identifier: Identifier, params=None):
         Definition_list (List[Definition])
     """
     if params is None:
-        params = {'sigma_d': math.sqrt(12 / math.log(2)),
-                  'sigma_s': 2 / math.sqrt(math.log(2)),
-                  'alpha': 1,
-                  'beta': 1,
-                  'gamma': 0.1,
-                  'eta': 1}
+        params = dict(DEFAULT_KATO_PARAMS)
     ranked_definition_list = []
 
     for candidate_ in identifier.candidates:
@@ -74,11 +84,7 @@ def pagel_ranking_candidates(identifier: Identifier, params=None):
         Definition_list (List[Definition])
     """
     if params is None:
-        params = {'sigma_d': math.sqrt(12 / math.log(2)),
-                  'sigma_s': 2 / math.sqrt(math.log(2)),
-                  'alpha': 1,
-                  'beta': 1,
-                  'gamma': 0.1}
+        params = dict(DEFAULT_PAGEL_PARAMS)
     ranked_definition_list = []
     for candidate_ in identifier.candidates:
         n_sentence = candidate_.included_sentence.id - identifier.sentences[0].id
@@ -132,6 +138,8 @@ def pattern_based_extract_description(identifier: Identifier):
     # 5. <description> is|are denoted by <identifier>
     # 6. <identifier> denotes <description>
 
+    The patterns are declared in description_patterns.DESCRIPTION_PATTERNS.
+
     [1]: Pagel, R. and Schubotz, M.: Mathematical Language Processing Project,
     in Joint Proceedings of the MathUI, OpenMath and ThEdu Workshops and Work
     in Progress track at CICM, No. 1186, Aachen (2014)
@@ -144,111 +152,23 @@ def pattern_based_extract_description(identifier: Identifier):
         definition = pattern_based_extract_description(identifier)
         pattern_based_definition_list.append(definition)
     """
-    reg_description = re.compile(r'(NN[PS]{0,2}|NP)')
-    extracted_description_list = []
-    math_id = identifier.id
-    identifier_text = f'MATH{math_id:04d}'
-    for sentence in identifier.sentences:
-        sentence_tagged = sentence.tagged
-        description_candidate_ = []
-        indexes_target = [
-            n for n, v in enumerate(sentence_tagged)
-            if v == (identifier_text, 'NN')]
-        for index_target in indexes_target:
-            # 1. <description> <identifier>
-            description = []
-            if index_target >= 1:
-                for i in range(index_target - 1, -1, -1):
-                    (description_, pos_) = sentence_tagged[i]
-                    if ('MATH' not in description_) \
-                            and reg_description.fullmatch(pos_):
-                        description.append(description_)
-                    else:
-                        break
-                if description:
-                    description = description[::-1]
-                    extracted_description_list.append(' '.join(description))
-
-            # 2. <identifier> is <description>
-            # 3. <identifier> is the <description>
-            description = []
-            if index_target < len(sentence_tagged) - 1:
-                if sentence_tagged[index_target + 1][0] == 'is':
-                    mid_pattern = ' is '
-                    index_start = index_target + 2
-                    if index_target < len(sentence_tagged) - 3:
-                        if sentence_tagged[index_target + 2][0] == 'the':
-                            index_start = index_target + 3
-                            mid_pattern += 'the '
-                    for i in range(index_start, len(sentence_tagged)):
-                        (description_, pos_) = sentence_tagged[i]
-                        if ('MATH' not in description_) and reg_description.fullmatch(
-                                pos_):
-                            description.append(description_)
-                        else:
-                            break
-                    if description:
-                        extracted_description_list.append(
-                            ' '.join(description))
-
-            # 4. let <identifier> be the <description>
-            description = []
-            if 1 <= index_target < len(sentence_tagged) - 3:
-                if (sentence_tagged[index_target - 1][0] == 'let') and \
-                        (sentence_tagged[index_target + 1][0] == 'be') and \
-                        (sentence_tagged[index_target + 2][0] == 'the'):
-                    for i in range(index_target + 3, len(sentence_tagged)):
-                        (description_, pos_) = sentence_tagged[i]
-                        if ('MATH' not in description_) and reg_description.fullmatch(
-                                pos_):
-                            description.append(description_)
-                        else:
-                            break
-                    if description:
-                        extracted_description_list.append(
-                            ' '.join(description))
-
-            # 5. <description> is|are denoted by <identifier>
-            description = []
-            if index_target >= 4:
-                if (sentence_tagged[index_target - 1][0] == 'by') and \
-                        (sentence_tagged[index_target - 2][0] == 'denoted') and \
-                        (sentence_tagged[index_target - 3][0] == ('is' or 'are')):
-                    for i in range(index_target - 4, -1, -1):
-                        (description_, pos_) = sentence_tagged[i]
-                        if ('MATH' not in description_) and reg_description.fullmatch(
-                                pos_):
-                            description.append(description_)
-                        else:
-                            break
-                    if description:
-                        description = description[::-1]
-                        extracted_description_list.append(
-                            ' '.join(description))
-
-            # 6. <identifier> denotes */DT <description>
-            description = []
-            if index_target < len(sentence_tagged) - 3:
-                if (sentence_tagged[index_target + 1][0] == 'denotes') and \
-                        (sentence_tagged[index_target + 2][1] == 'DT'):
-                    for i in range(index_target + 3, len(sentence_tagged)):
-                        (description_, pos_) = sentence_tagged[i]
-                        if ('MATH' not in description_) and \
-                                reg_description.fullmatch(pos_):
-                            description.append(description_)
-                        else:
-                            break
-                    if description:
-                        extracted_description_list.append(
-                            ' '.join(description))
-    if not extracted_description_list:
-        extracted_description_list.append(None)
-
-    if not extracted_description_list:
-        return [Definition(definition='')]
+    extracted_description_list = description_matcher.match_identifiers([identifier])[0]
     return [Definition(definition=d) for d in extracted_description_list]
 
 
+def pattern_based_extract_descriptions(identifiers: List[Identifier]):
+    """pattern_based_extract_description for all identifiers of a document.
+    each sentence is matched once for all the identifiers it contains.
+
+    ----------------------
+    usage:
+    pattern_based_definition_list = pattern_based_extract_descriptions(doc.identifiers)
+    """
+    return [[Definition(definition=d) for d in extracted_description_list]
+            for extracted_description_list
+            in description_matcher.match_identifiers(identifiers)]
+
+
 # sometimes noun phrases are not extracted accurately.
 # Thus, the accuracy of the following method is not so high.
 def pattern_based_extract_description_using_noun_phrases(
@@ -267,6 +187,8 @@ def pattern_based_extract_description_using_noun_phrases(
     # 4. <description> is|are denoted by <identifier>
     # 5. <identifier> denotes <description>
 
+    The templates are declared in description_patterns.NOUN_PHRASE_TEMPLATES.
+
     [1]: Pagel, R. and Schubotz, M.: Mathematical Language Processing Project,
     in Joint Proceedings of the MathUI, OpenMath and ThEdu Workshops and Work
     in Progress track at CICM, No. 1186, Aachen (2014)
@@ -278,81 +200,44 @@ def pattern_based_extract_description_using_noun_phrases(
         definition = pattern_based_extract_description_using_noun_phrases(identifier)
         pattern_based_definition_list.append(definition)
     """
-    extracted_description_list = []
-    math_id_ = identifier.id
-    identifier_text = f'MATH{math_id_:04d}'
-    candidates_list = identifier.candidates
-    for candidate_ in candidates_list:
-        description_candidate = candidate_.text
-        replace_pattern_list = ['(', ')', '[', ']', '{', '}']
-        for replace_pattern_ in replace_pattern_list:
-            description_candidate = \
-                description_candidate.replace(
-                    replace_pattern_,
-                    '\\' + replace_pattern_)
-        sentence = candidate_.included_sentence.original
-        pattern_list = [
-            re.compile(
-                description_candidate +
-                ' ' +
-                identifier_text),
-            re.compile(
-                identifier_text +
-                ' is ' +
-                description_candidate),
-            re.compile(
-                'let ' +
-                identifier_text +
-                ' be ' +
-                description_candidate),
-            re.compile(
-                description_candidate +
-                r' [is|are] denoted by ' +
-                identifier_text),
-            re.compile(
-                identifier_text +
-                ' denotes ' +
-                description_candidate)]
-
-        for pattern_ in pattern_list:
-            if pattern_.search(sentence):
-                extracted_description_list.append(description_candidate)
+    extracted_description_list = noun_phrase_matcher.match_identifiers([identifier])[0]
     if not extracted_description_list:
         return [Definition(definition='')]
     return [Definition(definition=d) for d in extracted_description_list]
 
 
+def pattern_based_extract_descriptions_using_noun_phrases(identifiers: List[Identifier]):
+    """pattern_based_extract_description_using_noun_phrases for all
+    identifiers of a document. each sentence is split once.
+    """
+    return [[Definition(definition=d) for d in extracted_description_list]
+            or [Definition(definition='')]
+            for extracted_description_list
+            in noun_phrase_matcher.match_identifiers(identifiers)]
+
+
 def evaluate_identifier_definition(
         identifier_list: List[Identifier],
         gold_identifier_list: List[str],
         definition_list_list: List[List[Definition]],
         gold_definition_list: List[str],
-        max_rank=1):
-    score_identifier_tp, score_identifier_fp = 0, 0
-    score_definition_tp, score_definition_fp = 0, 0
-    count_definition_positive = 0
-
-    for i, identifier_ in enumerate(identifier_list):
-        if identifier_.text_tex in gold_identifier_list:
-            score_identifier_tp += 1
-
-            id_identifier = gold_identifier_list.index(identifier_.text_tex)
-            for definition_ in definition_list_list[i][:min(max_rank, len(definition_list_list[i]))]:
-                count_definition_positive += 1
-                if definition_.definition in gold_definition_list[id_identifier]:
-                    # print(definition_.definition)
-                    score_definition_tp += 1
-                else:
-                    score_definition_fp += 1
-        else:
-            # print(identifier_.text_tex)
-            score_identifier_fp += 1
-
-    score_identifier_recall = score_identifier_tp / len(gold_identifier_list)
-    score_identifier_precision = score_identifier_tp / len(identifier_list)
-
-    score_definition_recall = score_definition_tp / len(gold_definition_list)
-    score_definition_precision = score_definition_tp / count_definition_positive
+        max_rank=1,
+        gold: Optional[GoldIndex] = None):
+    """evaluate identifiers and their definitions ranked up to max_rank.
+    pass a GoldIndex built once as `gold` to evaluate many rankings against
+    the same gold data; use evaluation.evaluate_definitions for the scores at
+    every rank cutoff and MRR.
+    """
+    if gold is None:
+        gold = GoldIndex.from_lists(gold_identifier_list, gold_definition_list)
+    result = evaluate_definitions(identifier_list, definition_list_list, gold, max_rank)
+
+    score_identifier_recall = result.identifier_tp / gold.n_identifiers
+    score_identifier_precision = result.identifier_tp / len(identifier_list)
+
+    score_definition_recall = int(result.definition_tp[-1]) / gold.n_definitions
+    score_definition_precision = \
+        int(result.definition_tp[-1]) / int(result.definition_positive[-1])
 
     return (score_identifier_recall, score_identifier_precision), \
            (score_definition_recall, score_definition_precision)
@@ -0,0 +1,169 @@
+from collections import Counter
+import contextlib
+import cProfile
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, ContextManager, Dict, Iterable, List
+
+
+@dataclass
+class StageMetrics:
+    """resources used by one run of a stage (excluding its dependencies).
+    peak_memory is the peak of memory allocated by python during the stage,
+    above the memory allocated when it started (0 unless memory is traced).
+    """
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    peak_memory: int = 0
+
+
+@dataclass
+class DocumentMetrics:
+    """metrics of a document: per-stage resources and counters
+    (math nodes, identifiers, sentences, NLP calls, cache hits, ...).
+    parts of stages are measured as '<stage>:<part>' (e.g.
+    'extract_identifiers:substitution'); their time is included in the stage.
+
+    ----------------------
+    usage:
+    doc = XMLDocument(path, trace_memory=True)
+    print(doc.metrics.to_json())
+    """
+    stages: Dict[str, StageMetrics] = field(default_factory=dict)
+    counters: Counter = field(default_factory=Counter)
+    # traced memory peaks of the measures in progress, innermost last.
+    _peaks: List[int] = field(default_factory=list, init=False, repr=False, compare=False)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def merge(self, other: 'DocumentMetrics'):
+        """add the stages and counters of metrics recorded apart (e.g. by another thread)."""
+        self.stages.update(other.stages)
+        self.counters.update(other.counters)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str, trace_memory: bool = False):
+        """record the wall time, CPU time and (optionally) peak memory of a stage.
+        measures may be nested (parts of stages): an inner measure resets the
+        peak of tracemalloc, and hands the peak it saw over to the outer one.
+        """
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if trace_memory:
+            memory_start = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):  # python 3.9+
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            self._peaks.append(0)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            metrics = StageMetrics(wall_time=time.perf_counter() - wall_start,
+                                   cpu_time=time.process_time() - cpu_start)
+            if trace_memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                metrics.peak_memory = max(0, peak - memory_start)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages[stage] = metrics
+
+    @property
+    def wall_time(self) -> float:
+        # parts ('<stage>:<part>') are already included in their stage.
+        return sum(metrics.wall_time for stage, metrics in self.stages.items()
+                   if ':' not in stage)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'stages': {stage: asdict(metrics) for stage, metrics in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    @classmethod
+    def from_dict(cls, metrics: Dict[str, Any]) -> 'DocumentMetrics':
+        return cls(stages={stage: StageMetrics(**stage_metrics)
+                           for stage, stage_metrics in metrics.get('stages', {}).items()},
+                   counters=Counter(metrics.get('counters', {})))
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+@dataclass
+class CorpusMetrics:
+    """metrics aggregated over the documents of a corpus run.
+    stage resources are summed (and their maximum kept), counters are summed.
+
+    ----------------------
+    usage:
+    corpus_metrics = CorpusMetrics()
+    for doc in documents:
+        corpus_metrics.add(doc.metrics)
+    corpus_metrics.write_json('metrics.json')
+    """
+    documents: int = 0
+    stages: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    counters: Counter = field(default_factory=Counter)
+
+    def add(self, metrics: DocumentMetrics):
+        self.documents += 1
+        for stage, stage_metrics in metrics.stages.items():
+            aggregated = self.stages.setdefault(
+                stage, {'count': 0, 'wall_time': 0.0, 'max_wall_time': 0.0,
+                        'cpu_time': 0.0, 'max_peak_memory': 0})
+            aggregated['count'] += 1
+            aggregated['wall_time'] += stage_metrics.wall_time
+            aggregated['max_wall_time'] = max(aggregated['max_wall_time'],
+                                              stage_metrics.wall_time)
+            aggregated['cpu_time'] += stage_metrics.cpu_time
+            aggregated['max_peak_memory'] = max(aggregated['max_peak_memory'],
+                                                stage_metrics.peak_memory)
+        self.counters.update(metrics.counters)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'documents': self.documents,
+                'stages': self.stages,
+                'counters': dict(self.counters)}
+
+    def write_json(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def profile_stages(stages: Iterable[str],
+                   directory: str = '.') -> Callable[[Any, str], ContextManager]:
+    """return a stage hook (see XMLDocument.stage_hook) that profiles the
+    given stages with cProfile, and dumps the statistics of each run to
+    `directory`/<stage>.prof (readable by pstats or snakeviz).
+    sampling profilers such as py-spy need no hook: each stage runs in its
+    own XMLDocument method, which appears in their stack traces.
+
+    ----------------------
+    usage:
+    doc = XMLDocument(path, stage_hook=profile_stages(['extract_identifiers']))
+    # python -m pstats extract_identifiers.prof
+    """
+    stages = set(stages)
+
+    @contextlib.contextmanager
+    def hook(doc, stage: str):
+        if stage not in stages:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f'{stage}.prof'))
+
+    return hook
@@ -0,0 +1,114 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import warnings
+
+import lxml.html
+
+# tags of MathML elements that may be identifiers, in order of extraction.
+IDENTIFIER_TAGS = ['msubsup', 'msub', 'msup', 'munderover', 'munder', 'mover', 'mi']
+TOKEN_TAGS = ('mi', 'mo', 'mn')
+# tags whose parts (scripts, then base) are components of an identifier.
+UNDER_OVER_TAGS = ('munderover', 'munder', 'mover')
+# operators (text of <mo>) that make a <math> a formula: equalities and inequalities.
+RELATION_OPERATORS = frozenset([
+    '=', '≠', '≈', '≃', '≅', '≡', '∼', '∝', ':=', '≔',
+    '<', '>', '≤', '≥', '≦', '≧', '≪', '≫',
+])
+
+
+def _child(texts: List[str], i: int) -> str:
+    return texts[i] if i < len(texts) else ''
+
+
+def compose(tag: str, texts: List[str]) -> Tuple[str, List[str]]:
+    """return the TeX-like text of an element from the texts of its children,
+    and its parts: [over, under, base] of munderover, [over, base] of mover,
+    [under, base] of munder, and [text] otherwise.
+    """
+    if tag == 'mrow':
+        text = ''.join(texts)
+    elif tag == 'msubsup':
+        text = _child(texts, 0) + '_' + _child(texts, 1) + '^' + _child(texts, 2)
+    elif tag == 'msub':
+        text = _child(texts, 0) + '_' + _child(texts, 1)
+    elif tag == 'msup':
+        text = _child(texts, 0) + '^' + _child(texts, 1)
+    elif tag == 'munderover':
+        over, under, base = _child(texts, 2), _child(texts, 1), _child(texts, 0)
+        return r'\overset{' + over + '}{' + r'\underset{' + under + '}{' + base + '}}', \
+            [over, under, base]
+    elif tag == 'mover':
+        over, base = _child(texts, 1), _child(texts, 0)
+        return r'\overset{' + over + '}{' + base + '}', [over, base]
+    elif tag == 'munder':
+        under, base = _child(texts, 1), _child(texts, 0)
+        return r'\underset{' + under + '}{' + base + '}', [under, base]
+    else:
+        return None, []
+    return text, [text]
+
+
+def _unexpected(element):
+    warnings.warn('unexpected tag')
+    print(f'{element}')
+    print('######################')
+
+
+@dataclass
+class MathMLEncoder:
+    """encode MathML elements to TeX-like text and identifier components.
+
+    Elements are encoded bottom-up without recursion, and the encoding of
+    every element is cached, so each node of a <math> tree is encoded once
+    however many identifier elements contain it. Encode the elements of a
+    tree before modifying it (extract_identifiers drops extracted elements).
+
+    ----------------------
+    usage:
+    encoder = MathMLEncoder()
+    text, components = encoder.encode(lxml.html.fromstring(
+        '<msub><mover><mi>x</mi><mo>¯</mo></mover><mi>i</mi></msub>'))
+    # text = '\\overset{¯}{x}_i', components = ['¯', 'x', 'i']
+    """
+    # element -> (text, parts, components)
+    _cache: Dict[lxml.html.HtmlElement, Tuple[str, List[str], List[str]]] = field(
+        default_factory=dict, init=False, repr=False)
+
+    def encode(self, element) -> Tuple[str, List[str]]:
+        """return the TeX-like text of an element and its components:
+        its children, where munderover/munder/mover children are split into
+        their scripts and base.
+        """
+        cache = self._cache
+        stack = [(element, False)]
+        while stack:
+            node, children_encoded = stack.pop()
+            if node in cache:
+                continue
+            if not isinstance(node, lxml.html.HtmlElement):
+                _unexpected(node)
+                cache[node] = ('', [''], [])
+            elif node.tag in TOKEN_TAGS:
+                text = node.text_content()
+                cache[node] = (text, [text], [text])
+            elif not children_encoded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node))
+            else:
+                texts = [cache[child][0] for child in node]
+                text, parts = compose(node.tag, texts)
+                if text is None:
+                    _unexpected(node)
+                    text, parts = '', ['']
+                components = [part for child in node for part in cache[child][1]]
+                cache[node] = (text, parts, components)
+        text, _, components = cache[element]
+        return text, components
+
+    def clear(self):
+        self._cache.clear()
+
+
+def encode_mathml(element) -> Tuple[str, List[str]]:
+    """encode one MathML element (see MathMLEncoder.encode)."""
+    return MathMLEncoder().encode(element)
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+import re
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from projectmir.corenlp_session import CoreNLPSession, NOUN_PHRASE_ANNOTATORS, corenlp_version
+from projectmir.xmldoc_child import Sentence
+
+
+@dataclass
+class NounPhraseBackend(ABC):
+    """extracts the noun phrases of sentences (the sources of definition
+    candidates, see XMLDocument.extract_definition_candidate).
+
+    A backend returns the noun phrases of each sentence as texts of
+    space-separated words of the sentence. Results are cached in the
+    annotation cache under `annotator` (not cached if None) and `version`,
+    which is also part of the fingerprint of extract_definition_candidate.
+    Subclasses implement noun_phrases.
+    """
+    # whether the backend reads the POS tags of sentences (see pos_tagging).
+    uses_pos_tags = False
+
+    @property
+    def annotator(self) -> Optional[str]:
+        return None
+
+    @property
+    def version(self) -> str:
+        return type(self).__name__
+
+    @abstractmethod
+    def noun_phrases(self, sentences: List[Sentence]) -> List[List[str]]:
+        """return the noun phrases of each sentence."""
+
+
+@dataclass
+class CoreNLPNounPhraseBackend(NounPhraseBackend):
+    """noun phrases (tregex 'NP') of the constituency parses of CoreNLP.
+    a temporary CoreNLP session is started if no session is given.
+    """
+    session: Optional[CoreNLPSession] = field(default=None, repr=False)
+
+    @property
+    def annotator(self) -> Optional[str]:
+        return f'corenlp:tregex:NP:{NOUN_PHRASE_ANNOTATORS}'
+
+    @property
+    def version(self) -> str:
+        version = self.session.version if self.session is not None else corenlp_version()
+        return f'corenlp {version} {NOUN_PHRASE_ANNOTATORS}'
+
+    def noun_phrases(self, sentences: List[Sentence]) -> List[List[str]]:
+        texts = [sentence.original for sentence in sentences]
+        if self.session is None:
+            with CoreNLPSession(timeout=30000, memory='16G') as session:
+                return session.noun_phrases(texts)
+        return self.session.noun_phrases(texts)
+
+
+# symbol of each POS tag (Penn Treebank xpos) in the strings matched by the chunker.
+CHUNK_TAG_SYMBOLS = {
+    'DT': 'D', 'PDT': 'D', 'PRP$': 'D', 'WP$': 'D',
+    'CD': 'C',
+    'JJ': 'J', 'JJR': 'J', 'JJS': 'J', 'VBN': 'J', 'VBG': 'J',
+    'RB': 'B', 'RBR': 'B', 'RBS': 'B',
+    'NN': 'N', 'NNS': 'N', 'NNP': 'N', 'NNPS': 'N', 'FW': 'N',
+    'PRP': 'R',
+    'POS': 'O',
+    'IN': 'I', 'TO': 'I',
+    'CC': 'A',
+    ',': ',',
+}
+# base noun phrases: [possessor 's] [determiner] [numbers] [adjectives] nouns, or a pronoun.
+BASE_NOUN_PHRASE_REGEXP = re.compile(r'(?:D?(?:B*J|C)*N+O)?D?(?:B*J|C)*N+|R')
+# noun phrases with prepositional phrases (X: base noun phrase), attached to the right.
+PREPOSITIONAL_NOUN_PHRASE_REGEXP = re.compile(r'X(?:IX)+')
+# coordinated noun phrases (P: noun phrase with prepositional phrases).
+COORDINATED_NOUN_PHRASE_REGEXP = re.compile(r'[XP](?:,[XP])*,?A[XP]')
+
+Unit = Tuple[str, int, int]  # (symbol, first word, last word + 1)
+
+
+def _group(units: List[Unit], regexp, symbol: str,
+           split_after: str = '') -> Tuple[List[Unit], List[Tuple[int, int]]]:
+    """group the units matching `regexp` (over their symbols) into units
+    `symbol`, and return the new units and the word spans of the groups.
+    a group is also split before each unit following a `split_after` unit,
+    which gives the nested phrases of right-branching attachments.
+    """
+    string = ''.join(unit[0] for unit in units)
+    grouped, spans, position = [], [], 0
+    for match in regexp.finditer(string):
+        grouped.extend(units[position:match.start()])
+        start, end = units[match.start()][1], units[match.end() - 1][2]
+        grouped.append((symbol, start, end))
+        spans.append((start, end))
+        for k in range(match.start() + 1, match.end()):
+            if units[k - 1][0] in split_after:
+                spans.append((units[k][1], end))
+        position = match.end()
+    grouped.extend(units[position:])
+    return grouped, spans
+
+
+@dataclass
+class ChunkerNounPhraseBackend(NounPhraseBackend):
+    """noun phrases found by a cascade of regular expressions over POS tags.
+
+    Needs no parser: the xpos tags of pos_tagging are mapped to symbols
+    (CHUNK_TAG_SYMBOLS) and matched in three passes, for base noun phrases,
+    noun phrases with prepositional phrases (only with `prepositions`), and
+    coordinations. Like tregex on a parse, it returns the nested noun phrases
+    too, outer phrases first. Faster than CoreNLP, but less accurate where
+    attachments are ambiguous.
+
+    ----------------------
+    usage:
+    doc = XMLDocument(path, noun_phrase_backend=ChunkerNounPhraseBackend())
+    """
+    prepositions: FrozenSet[str] = frozenset(
+        ['of', 'in', 'for', 'on', 'at', 'with', 'between', 'from', 'per'])
+    coordination: bool = True
+
+    uses_pos_tags = True
+
+    @property
+    def version(self) -> str:
+        return f'chunker {sorted(self.prepositions)} {self.coordination}'
+
+    def chunk(self, words: List[str], tags: List[str]) -> List[Tuple[int, int]]:
+        """return the word spans of the noun phrases of a tagged sentence."""
+        symbols = ''.join(
+            'x' if symbol == 'I' and word.lower() not in self.prepositions else symbol
+            for symbol, word in ((CHUNK_TAG_SYMBOLS.get(tag_, 'x'), word_)
+                                 for word_, tag_ in zip(words, tags)))
+        spans = [match.span() for match in BASE_NOUN_PHRASE_REGEXP.finditer(symbols)]
+        units = []
+        position = 0
+        for start, end in spans:
+            units.extend((symbols[i], i, i + 1) for i in range(position, start))
+            units.append(('X', start, end))
+            position = end
+        units.extend((symbols[i], i, i + 1) for i in range(position, len(symbols)))
+        units, prepositional_spans = _group(
+            units, PREPOSITIONAL_NOUN_PHRASE_REGEXP, 'P', split_after='I')
+        spans.extend(prepositional_spans)
+        if self.coordination:
+            units, coordinated_spans = _group(units, COORDINATED_NOUN_PHRASE_REGEXP, 'Q')
+            spans.extend(coordinated_spans)
+        return sorted(set(spans), key=lambda span: (span[0], -span[1]))
+
+    def noun_phrases(self, sentences: List[Sentence]) -> List[List[str]]:
+        return [[' '.join(sentence.words[start:end])
+                 for start, end in self.chunk(sentence.words, sentence.tags)]
+                for sentence in sentences]
+
+
+def compare_noun_phrase_backends(documents: List,
+                                 backends: Dict[str, NounPhraseBackend],
+                                 reference: str = 'corenlp') -> Dict[str, Dict[str, float]]:
+    """compare the definition candidates of noun phrase backends with those
+    of a reference backend (micro-averaged over documents).
+
+    Args:
+        documents (list): XMLDocuments (their candidates are recomputed).
+        backends (dict): backends by name, including `reference`.
+        reference (str): name of the reference backend.
+
+    Returns:
+        results (dict): candidates, recall and precision of the candidates
+            (per identifier) against the reference, and time of
+            extract_definition_candidate, of each backend.
+
+    ----------------------
+    usage:
+    docs = [XMLDocument(path, stages=['pos_tagging']) for path in paths]
+    results = compare_noun_phrase_backends(
+        docs, {'corenlp': CoreNLPNounPhraseBackend(session),
+               'chunker': ChunkerNounPhraseBackend()})
+    print(results['chunker']['recall'])
+    """
+    candidates = {name: [] for name in backends}
+    results = {name: {'candidates': 0, 'wall_time': 0.0} for name in backends}
+    for doc in documents:
+        doc.run_stage('pos_tagging')
+        for name, backend in backends.items():
+            doc.invalidate_stages(['extract_definition_candidate'])
+            doc.noun_phrase_backend = backend
+            start = time.perf_counter()
+            doc.run_stage('extract_definition_candidate')
+            results[name]['wall_time'] += time.perf_counter() - start
+            candidates[name].extend(
+                {candidate.text for candidate in identifier.candidates}
+                for identifier in doc.identifiers)
+    for name in backends:
+        n_common = sum(len(candidates_ & reference_) for candidates_, reference_
+                       in zip(candidates[name], candidates[reference]))
+        n_candidates = sum(len(candidates_) for candidates_ in candidates[name])
+        n_reference = sum(len(reference_) for reference_ in candidates[reference])
+        results[name].update(candidates=n_candidates,
+                             recall=n_common / n_reference if n_reference else 0.0,
+                             precision=n_common / n_candidates if n_candidates else 0.0)
+    return results
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import gc
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import stanza
+
+
+@dataclass
+class PooledPipeline:
+    pipeline: Any
+    loaded_at: float = 0.0
+    last_used: float = 0.0
+    use_count: int = 0
+
+
+@dataclass
+class PipelinePool:
+    """process-wide registry of stanza pipelines.
+
+    Pipelines are loaded lazily on first request and shared by every
+    XMLDocument of the process. They are keyed by (lang, processors, device)
+    plus any extra keyword argument given to stanza.Pipeline.
+    Pipelines that have not been used for `idle_timeout` seconds are evicted,
+    and at most `max_pipelines` pipelines are kept (least recently used first)
+    so that RSS stays bounded when several processor sets are in use.
+    Pipelines are built by `loader` (stanza.Pipeline if None), which takes
+    the keyword arguments of stanza.Pipeline.
+
+    ----------------------
+    usage:
+    # load models once at worker start.
+    pipeline_pool.warmup(lang='en', processors='tokenize')
+    nlp = pipeline_pool.get(lang='en', processors='tokenize')
+    """
+    max_pipelines: int = 4
+    idle_timeout: Optional[float] = None
+    loader: Optional[Callable[..., Any]] = field(default=None, repr=False)
+    pipelines: 'OrderedDict[Tuple, PooledPipeline]' = field(
+        default_factory=OrderedDict, repr=False)
+
+    def __post_init__(self):
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(lang='en', processors=None, device=None, **kwargs) -> Tuple:
+        """return the hashable key of a pipeline configuration."""
+        if isinstance(processors, dict):
+            processors = tuple(sorted(processors.items()))
+        return lang, processors, device, tuple(sorted(kwargs.items()))
+
+    def get(self, lang='en', processors=None, device=None, **kwargs):
+        """return a shared stanza pipeline, loading it if necessary.
+
+        Args:
+            lang (str): language of the pipeline.
+            processors (str or dict): processors of the pipeline.
+                None means the stanza default processors of `lang`.
+            device (str): device on which the models are placed (e.g. 'cpu').
+                None means the stanza default.
+            **kwargs: extra keyword arguments passed to stanza.Pipeline.
+
+        Returns:
+            stanza.Pipeline: loaded pipeline.
+        """
+        key = self.make_key(lang, processors, device, **kwargs)
+        with self._lock:
+            self.evict_idle()
+            pooled = self.pipelines.get(key)
+            if pooled is None:
+                pooled = PooledPipeline(
+                    pipeline=self._load(lang, processors, device, **kwargs),
+                    loaded_at=time.time())
+                self.pipelines[key] = pooled
+            self.pipelines.move_to_end(key)
+            self._evict_overflow()
+            pooled.last_used = time.time()
+            pooled.use_count += 1
+            return pooled.pipeline
+
+    def warmup(self, lang='en', processors=None, device=None, **kwargs):
+        """load a pipeline in advance (e.g. at worker start).
+        """
+        self.get(lang, processors, device, **kwargs)
+
+    def evict_idle(self, idle_timeout=None) -> int:
+        """evict pipelines that have been unused for `idle_timeout` seconds.
+
+        Returns:
+            int: number of evicted pipelines.
+        """
+        if idle_timeout is None:
+            idle_timeout = self.idle_timeout
+        if idle_timeout is None:
+            return 0
+        now = time.time()
+        with self._lock:
+            idle_keys = [key for key, pooled in self.pipelines.items()
+                         if now - pooled.last_used > idle_timeout]
+            for key in idle_keys:
+                del self.pipelines[key]
+        if idle_keys:
+            gc.collect()
+        return len(idle_keys)
+
+    def _evict_overflow(self):
+        evicted = False
+        while len(self.pipelines) > max(self.max_pipelines, 1):
+            self.pipelines.popitem(last=False)
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def clear(self):
+        """drop every loaded pipeline."""
+        with self._lock:
+            self.pipelines.clear()
+        gc.collect()
+
+    def _load(self, lang, processors, device, **kwargs):
+        if processors is not None:
+            kwargs['processors'] = processors
+        if device is not None:
+            kwargs['device'] = device
+        loader = self.loader if self.loader is not None else stanza.Pipeline
+        return loader(lang=lang, **kwargs)
+
+    def __len__(self):
+        return len(self.pipelines)
+
+    def __getstate__(self):
+        # loaded models are not shipped to other processes.
+        return {'max_pipelines': self.max_pipelines,
+                'idle_timeout': self.idle_timeout,
+                'loader': self.loader,
+                'pipelines': OrderedDict()}
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+
+# default pool shared by every XMLDocument of the process.
+pipeline_pool = PipelinePool()
@@ -0,0 +1,181 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from projectmir.extract_definition import DEFAULT_KATO_PARAMS, DEFAULT_PAGEL_PARAMS, Definition
+from projectmir.xmldoc_child import Identifier
+
+
+@dataclass
+class CandidateFeatures:
+    """ranking features of candidates packed into columns.
+
+    Candidates of all identifiers (of a document or a corpus) are stored
+    contiguously, identifier by identifier, in the order of
+    `Identifier.candidates`. `identifier_index` is the position of the
+    identifier of each candidate in the identifier list.
+    """
+    identifier_index: np.ndarray
+    delta: np.ndarray
+    n_sentence: np.ndarray
+    tf: np.ndarray
+    score_match_character: np.ndarray
+    texts: List[str] = field(default_factory=list)
+    n_identifiers: int = 0
+
+    def __len__(self):
+        # texts are empty if skipped when loading (see docstore.candidate_features).
+        return len(self.identifier_index)
+
+    @classmethod
+    def from_identifiers(cls, identifiers: List[Identifier]) -> 'CandidateFeatures':
+        """extract the features used by kato/pagel ranking from identifiers.
+        """
+        identifier_index, delta, n_sentence, tf, match, texts = [], [], [], [], [], []
+        for i, identifier in enumerate(identifiers):
+            for candidate_ in identifier.candidates:
+                identifier_index.append(i)
+                n_sentence.append(candidate_.sentence.id - identifier.sentences[0].id)
+                delta.append(candidate_.word_count_btwn_var_cand + 1)  # minimum is 1.
+                tf.append(candidate_.candidate_count_in_sentence
+                          / len(candidate_.replaced.strip()))
+                match.append(candidate_.score_match_character)
+                texts.append(candidate_.text)
+        return cls(identifier_index=np.asarray(identifier_index, dtype=np.int64),
+                   delta=np.asarray(delta, dtype=np.float64),
+                   n_sentence=np.asarray(n_sentence, dtype=np.float64),
+                   tf=np.asarray(tf, dtype=np.float64),
+                   score_match_character=np.asarray(match, dtype=np.float64),
+                   texts=texts,
+                   n_identifiers=len(identifiers))
+
+    @classmethod
+    def concatenate(cls, features_list: List['CandidateFeatures']) -> 'CandidateFeatures':
+        """pack the features of several documents into one set of columns.
+        identifiers are numbered consecutively across documents.
+        """
+        offsets = np.cumsum([0] + [features.n_identifiers for features in features_list])
+        return cls(
+            identifier_index=np.concatenate(
+                [features.identifier_index + offset
+                 for features, offset in zip(features_list, offsets)]
+                or [np.zeros(0, dtype=np.int64)]),
+            delta=np.concatenate([features.delta for features in features_list] or [[]]),
+            n_sentence=np.concatenate(
+                [features.n_sentence for features in features_list] or [[]]),
+            tf=np.concatenate([features.tf for features in features_list] or [[]]),
+            score_match_character=np.concatenate(
+                [features.score_match_character for features in features_list] or [[]]),
+            texts=[text for features in features_list for text in features.texts],
+            n_identifiers=int(offsets[-1]))
+
+
+def distance_scores(features: CandidateFeatures, sigma_d, sigma_s):
+    """return R_sigma_d (word distance) and R_sigma_s (sentence distance).
+    sigma_d and sigma_s may be arrays of shape (n, 1) to score n parameter
+    sets at once.
+    """
+    r_sigma_d = np.exp(- 1 / 2 * (features.delta ** 2 - 1) / np.square(sigma_d))
+    r_sigma_s = np.exp(- 1 / 2 * (features.n_sentence ** 2 - 1) / np.square(sigma_s))
+    return r_sigma_d, r_sigma_s
+
+
+def kato_scores(features: CandidateFeatures, params: Optional[Dict] = None) -> np.ndarray:
+    """vectorized score of kato_ranking_candidates."""
+    if params is None:
+        params = DEFAULT_KATO_PARAMS
+    r_sigma_d, r_sigma_s = distance_scores(features, params['sigma_d'], params['sigma_s'])
+    score = (params['alpha'] * r_sigma_d
+             + params['beta'] * r_sigma_s
+             + params['gamma'] * features.tf
+             + params['eta'] * features.score_match_character)
+    return score / (params['alpha'] + params['beta'] + params['gamma'] + params['eta'])
+
+
+def pagel_scores(features: CandidateFeatures, params: Optional[Dict] = None) -> np.ndarray:
+    """vectorized score of pagel_ranking_candidates."""
+    if params is None:
+        params = DEFAULT_PAGEL_PARAMS
+    r_sigma_d, r_sigma_s = distance_scores(features, params['sigma_d'], params['sigma_s'])
+    score = (params['alpha'] * r_sigma_d
+             + params['beta'] * r_sigma_s
+             + params['gamma'] * features.tf)
+    return score / (params['alpha'] + params['beta'] + params['gamma'])
+
+
+def rank_candidates(features: CandidateFeatures,
+                    scores: np.ndarray,
+                    top_k: Optional[int] = None) -> List[np.ndarray]:
+    """rank candidates of each identifier by descending score.
+    ties keep the order of the candidates, as sorted() does.
+
+    Args:
+        features (CandidateFeatures): features of the scored candidates.
+        scores (np.ndarray): score of each candidate.
+        top_k (int): number of candidates kept per identifier (all if None).
+
+    Returns:
+        ranking (list): candidate indexes (np.ndarray) of each identifier.
+    """
+    if features.n_identifiers == 0:
+        return []
+    group = features.identifier_index
+    order = np.lexsort((-scores, group))
+    group_sorted = group[order]
+    boundaries = np.searchsorted(group_sorted, np.arange(features.n_identifiers + 1))
+    if top_k is not None:
+        rank_in_group = np.arange(len(order)) - boundaries[group_sorted]
+        keep = rank_in_group < top_k
+        order, group_sorted = order[keep], group_sorted[keep]
+        boundaries = np.searchsorted(group_sorted, np.arange(features.n_identifiers + 1))
+    return np.split(order, boundaries[1:-1])
+
+
+def ranked_definitions(features: CandidateFeatures,
+                       scores: np.ndarray,
+                       params: Dict,
+                       top_k: Optional[int] = None) -> List[List[Definition]]:
+    """return ranked Definition lists of each identifier, in the format of
+    kato_ranking_candidates and pagel_ranking_candidates. the texts of the
+    candidates are needed (see docstore.load_candidate_features).
+    """
+    if len(features.texts) != len(features):
+        raise ValueError('candidate texts are missing: load the features with texts=True, '
+                         'or rank them with rank_candidates')
+    definition_list_list = []
+    for candidate_indexes in rank_candidates(features, scores, top_k):
+        if len(candidate_indexes) == 0:
+            definition_list_list.append([Definition(definition='')])
+            continue
+        definition_list_list.append(
+            [Definition(definition=features.texts[j], score=float(scores[j]), params=params)
+             for j in candidate_indexes])
+    return definition_list_list
+
+
+def kato_ranking(identifiers: List[Identifier], params=None, top_k=None,
+                 features: Optional[CandidateFeatures] = None) -> List[List[Definition]]:
+    """rank the candidates of all identifiers like kato_ranking_candidates.
+
+    ----------------------
+    usage:
+    features = CandidateFeatures.from_identifiers(doc.identifiers)
+    definition_list_kato = kato_ranking(doc.identifiers, features=features)
+    """
+    if params is None:
+        params = dict(DEFAULT_KATO_PARAMS)
+    if features is None:
+        features = CandidateFeatures.from_identifiers(identifiers)
+    return ranked_definitions(features, kato_scores(features, params), params, top_k)
+
+
+def pagel_ranking(identifiers: List[Identifier], params=None, top_k=None,
+                  features: Optional[CandidateFeatures] = None) -> List[List[Definition]]:
+    """rank the candidates of all identifiers like pagel_ranking_candidates.
+    """
+    if params is None:
+        params = dict(DEFAULT_PAGEL_PARAMS)
+    if features is None:
+        features = CandidateFeatures.from_identifiers(identifiers)
+    return ranked_definitions(features, pagel_scores(features, params), params, top_k)
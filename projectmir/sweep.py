@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from dataclasses import dataclass
+import itertools
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from projectmir.evaluation import GoldIndex
+from projectmir.ranking import CandidateFeatures
+from projectmir.xmldoc_child import Identifier
+
+PARAM_NAMES = {'kato': ['sigma_d', 'sigma_s', 'alpha', 'beta', 'gamma', 'eta'],
+               'pagel': ['sigma_d', 'sigma_s', 'alpha', 'beta', 'gamma']}
+
+
+def parameter_grid(grid: Dict[str, Sequence[float]]) -> Dict[str, np.ndarray]:
+    """expand a parameter grid into columns of all its combinations.
+    the last parameter varies fastest, as in nested for loops.
+
+    ----------------------
+    usage:
+    grid = parameter_grid({'sigma_d': [math.sqrt(12 / math.log(2))],
+                           'sigma_s': [2 / math.sqrt(math.log(2))],
+                           'alpha': [0.1 * i for i in range(1, 11)],
+                           'beta': [0.1 * i for i in range(1, 11)],
+                           'gamma': [0.1 * i for i in range(1, 11)],
+                           'eta': [0.1 * i for i in range(1, 11)]})
+    """
+    names = list(grid)
+    combinations = np.array(list(itertools.product(*(grid[name] for name in names))),
+                            dtype=np.float64).reshape(-1, len(names))
+    return {name: combinations[:, i] for i, name in enumerate(names)}
+
+
+@dataclass
+class SweepProblem:
+    """candidate features and gold correctness of one document, extracted
+    once and reused by every grid point.
+    evaluation follows evaluate_identifier_definition.
+    """
+    features: CandidateFeatures
+    # whether each candidate is a gold definition of its identifier.
+    correct: np.ndarray
+    # whether each identifier is a gold identifier.
+    gold_identifier: np.ndarray
+    # number of gold identifiers without candidates (ranked as one empty
+    # definition) and how many of those empty definitions are correct.
+    n_empty_positive: int
+    n_empty_correct: int
+    n_identifiers: int
+    n_gold_identifiers: int
+    n_gold_definitions: int
+
+    @classmethod
+    def from_identifiers(cls,
+                         identifiers: List[Identifier],
+                         gold_identifier_list: List[str],
+                         gold_definition_list: List[Union[str, List[str]]],
+                         features: Optional[CandidateFeatures] = None,
+                         gold: Optional[GoldIndex] = None) -> 'SweepProblem':
+        if features is None:
+            features = CandidateFeatures.from_identifiers(identifiers)
+        if gold is None:
+            gold = GoldIndex.from_lists(gold_identifier_list, gold_definition_list)
+        gold_id_list = [gold.lookup(identifier.text_tex) for identifier in identifiers]
+
+        correct = np.array(
+            [gold_id_list[i] is not None and gold.is_correct(gold_id_list[i], text)
+             for i, text in zip(features.identifier_index, features.texts)],
+            dtype=bool)
+        n_empty_positive, n_empty_correct = 0, 0
+        for identifier, gold_id in zip(identifiers, gold_id_list):
+            if gold_id is not None and not identifier.candidates:
+                n_empty_positive += 1
+                n_empty_correct += int(gold.is_correct(gold_id, ''))
+        return cls(features=features,
+                   correct=correct,
+                   gold_identifier=np.array([gold_id is not None for gold_id in gold_id_list],
+                                            dtype=bool),
+                   n_empty_positive=n_empty_positive,
+                   n_empty_correct=n_empty_correct,
+                   n_identifiers=len(identifiers),
+                   n_gold_identifiers=gold.n_identifiers,
+                   n_gold_definitions=gold.n_definitions)
+
+    def grid_scores(self, grid: Dict[str, np.ndarray], method: str) -> np.ndarray:
+        """scores of every candidate for every grid point, shape (grid, candidates).
+        """
+        column = {name: np.asarray(grid[name], dtype=np.float64)[:, None]
+                  for name in PARAM_NAMES[method]}
+        features = self.features
+        r_sigma_d = np.exp(- 1 / 2 * (features.delta ** 2 - 1) / column['sigma_d'] ** 2)
+        r_sigma_s = np.exp(- 1 / 2 * (features.n_sentence ** 2 - 1) / column['sigma_s'] ** 2)
+        score = (column['alpha'] * r_sigma_d
+                 + column['beta'] * r_sigma_s
+                 + column['gamma'] * features.tf)
+        weight = column['alpha'] + column['beta'] + column['gamma']
+        if method == 'kato':
+            score = score + column['eta'] * features.score_match_character
+            weight = weight + column['eta']
+        return score / weight
+
+    def count(self, grid: Dict[str, np.ndarray], method: str, max_rank: int):
+        """return (true positives, positives) of definitions for every grid point.
+        """
+        n_grid = len(next(iter(grid.values())))
+        group = self.features.identifier_index
+        # candidates are grouped by identifier, so the rank of each position
+        # after sorting by (identifier, -score) does not depend on the scores.
+        group_start = np.searchsorted(group, np.arange(self.n_identifiers))
+        rank_in_group = np.arange(len(group)) - group_start[group]
+        evaluated = (rank_in_group < max_rank) & self.gold_identifier[group]
+        n_positive = int(evaluated.sum()) + self.n_empty_positive
+        if len(group) == 0:
+            return np.full(n_grid, self.n_empty_correct), n_positive
+
+        scores = self.grid_scores(grid, method)
+        order = np.lexsort((-scores, np.broadcast_to(group, scores.shape)), axis=-1)
+        n_tp = (self.correct[order] & evaluated).sum(axis=1) + self.n_empty_correct
+        return n_tp, n_positive
+
+
+def _evaluate_block(problems: List[SweepProblem],
+                    grid: Dict[str, np.ndarray],
+                    method: str,
+                    max_rank: int) -> Dict[str, np.ndarray]:
+    n_grid = len(next(iter(grid.values())))
+    n_tp, n_positive = np.zeros(n_grid, dtype=np.int64), 0
+    for problem in problems:
+        n_tp_, n_positive_ = problem.count(grid, method, max_rank)
+        n_tp += n_tp_
+        n_positive += n_positive_
+    n_gold_definitions = sum(problem.n_gold_definitions for problem in problems)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'definition_tp': n_tp,
+                'definition_positive': np.full(n_grid, n_positive),
+                'definition_recall': n_tp / n_gold_definitions,
+                'definition_precision': n_tp / n_positive}
+
+
+def sweep(problems: Union[SweepProblem, List[SweepProblem]],
+          grid: Dict[str, Sequence[float]],
+          method: str = 'kato',
+          max_rank: int = 1,
+          block_size: int = 1024,
+          workers: int = 1) -> Dict[str, np.ndarray]:
+    """evaluate a ranking method on every point of a parameter grid.
+
+    Features are extracted once (in the problems); each block of
+    `block_size` grid points is scored with one broadcast computation, and
+    blocks are shared across `workers` processes. With several documents,
+    counts are summed over documents (micro average).
+
+    Args:
+        problems (SweepProblem or list): documents to be evaluated.
+        grid (dict): values of each parameter, expanded by parameter_grid.
+        method (str): 'kato' or 'pagel'.
+        max_rank (int): number of ranked definitions evaluated per identifier.
+        block_size (int): number of grid points scored at once.
+        workers (int): number of processes.
+
+    Returns:
+        table (dict): columns of parameters and scores, one row per grid point.
+    """
+    if isinstance(problems, SweepProblem):
+        problems = [problems]
+    if method not in PARAM_NAMES:
+        raise ValueError(f'unknown method: {method}')
+    grid = parameter_grid(grid)
+    n_grid = len(next(iter(grid.values())))
+    blocks = [{name: values[start:start + block_size] for name, values in grid.items()}
+              for start in range(0, n_grid, block_size)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                _evaluate_block, itertools.repeat(problems), blocks,
+                itertools.repeat(method), itertools.repeat(max_rank)))
+    else:
+        results = [_evaluate_block(problems, block, method, max_rank) for block in blocks]
+
+    n_identifiers = sum(problem.n_identifiers for problem in problems)
+    n_identifier_tp = sum(int(problem.gold_identifier.sum()) for problem in problems)
+    n_gold_identifiers = sum(problem.n_gold_identifiers for problem in problems)
+    table = {'method': np.full(n_grid, method), 'max_rank': np.full(n_grid, max_rank)}
+    table.update(grid)
+    table['identifier_recall'] = np.full(n_grid, n_identifier_tp / n_gold_identifiers)
+    table['identifier_precision'] = np.full(n_grid, n_identifier_tp / n_identifiers)
+    for name in results[0] if results else []:
+        table[name] = np.concatenate([result[name] for result in results])
+    return table
+
+
+def write_table(table: Dict[str, np.ndarray], path: str):
+    """write a sweep table as CSV, or as Parquet if `path` ends with .parquet
+    (requires pyarrow).
+    """
+    if path.endswith('.parquet'):
+        import pyarrow
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(
+            pyarrow.table({name: np.asarray(values) for name, values in table.items()}),
+            path)
+        return
+    names = list(table)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(np.asarray(table[name]).tolist() for name in names)))
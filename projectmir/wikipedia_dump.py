@@ -0,0 +1,100 @@
+import bz2
+from dataclasses import dataclass, field
+import gzip
+import re
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Set, Tuple
+
+from projectmir.xmldocument import XMLDocument
+
+namespace_regexp = re.compile(rb'<ns>\s*(-?\d+)\s*</ns>')
+
+
+def open_dump(path: str) -> BinaryIO:
+    """open a (.bz2 or .gz compressed) Wikipedia dump as a binary stream.
+    """
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+@dataclass
+class WikipediaDumpReader:
+    """stream `<page>` elements of a Wikipedia XML dump as XMLDocuments.
+
+    The dump is read line by line, so it is never materialized in memory.
+    Pages whose namespace is not in `namespaces` are skipped before any
+    XMLDocument (and thus any NLP) is created. Documents are lazy: their
+    stages run when the caller reads them, so a page that fails can be
+    skipped without stopping the iteration.
+    `offset` is the byte offset in the decompressed stream where reading
+    starts. The reader keeps no position: a caller resumes a stopped run from
+    the offset of the first page whose result was not saved (pages after it
+    may then be processed again, i.e. delivery is at least once).
+    Compressed dumps are resumed by decompressing up to the offset.
+
+    ----------------------
+    usage:
+    reader = WikipediaDumpReader('enwiki-latest-pages-articles.xml.bz2',
+                                 namespaces={'0'})
+    for doc in reader:
+        try:
+            print(doc.title, len(doc.identifiers))
+        except Exception:
+            continue
+    """
+    path: str
+    namespaces: Optional[Set[str]] = None
+    offset: int = 0
+    # keyword arguments passed to XMLDocument (e.g. corenlp_session).
+    document_kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def iter_pages(self) -> Iterator[Tuple[int, bytes]]:
+        """yield (offset, markup) of each page of the dump.
+        the page takes the bytes [offset, offset + len(page)) of the stream.
+
+        Returns:
+            offset (int): byte offset of the page in the decompressed stream.
+            page (bytes): markup of the page from <page> to </page>.
+        """
+        with open_dump(self.path) as dump:
+            if self.offset:
+                dump.seek(self.offset)
+            # position: offset of the current line; a line may hold several
+            # page boundaries (e.g. '</page><page>').
+            position = self.offset
+            page_parts, page_offset = None, 0
+            for line in dump:
+                cursor = 0
+                while True:
+                    if page_parts is None:
+                        start = line.find(b'<page>', cursor)
+                        if start < 0:
+                            break
+                        page_parts, page_offset, cursor = [], position + start, start
+                    end = line.find(b'</page>', cursor)
+                    if end < 0:
+                        page_parts.append(line[cursor:])
+                        break
+                    end += len(b'</page>')
+                    page_parts.append(line[cursor:end])
+                    page = b''.join(page_parts)
+                    page_parts, cursor = None, end
+                    yield page_offset, page
+                position += len(line)
+
+    def accept(self, page: bytes) -> bool:
+        """return whether the namespace of the page is requested."""
+        if self.namespaces is None:
+            return True
+        namespace = namespace_regexp.search(page)
+        namespace = namespace.group(1).decode() if namespace else '0'
+        return namespace in {str(namespace_) for namespace_ in self.namespaces}
+
+    def __iter__(self) -> Iterator[XMLDocument]:
+        for page_offset, page in self.iter_pages():
+            if self.accept(page):
+                yield XMLDocument(path=f'{self.path}#{page_offset}',
+                                  source=page.decode('utf-8'),
+                                  **{**self.document_kwargs, 'lazy': True})
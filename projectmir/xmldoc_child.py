@@ -1,26 +1,124 @@
-from dataclasses import dataclass, field
-from typing import List
+from dataclasses import InitVar, dataclass, field
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import warnings
 
 
-@dataclass
+# __slots__ of the data model (dataclass supports them from python 3.10).
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# identifiers are replaced in the text by MATH and their id in
+# MATH_TOKEN_DIGITS digits. all tokens have the same width, so a token is
+# never read as the prefix of another, as MATH1000 was in MATH10000.
+MATH_TOKEN_DIGITS = 6
+math_token_regexp = re.compile(rf'MATH\d{{{MATH_TOKEN_DIGITS}}}')
+
+
+def math_token(identifier_id: int) -> str:
+    """token replacing an identifier in the text (see MATH_TOKEN_DIGITS)."""
+    return f'MATH{identifier_id:0{MATH_TOKEN_DIGITS}d}'
+
+
+@dataclass(**_SLOTS)
 class Sentence:
+    """a sentence of a document, shared by all identifiers and candidates
+    appearing in it. POS tags are stored as parallel lists of words and tags.
+    """
     id: int = 0
     original: str = ''
-    tagged: str = ''
-    replaced: str = ''
+    words: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    # deprecated: (word, tag) pairs, now passed as words and tags.
+    tagged: InitVar[Optional[Sequence[Tuple[str, str]]]] = None
 
-@dataclass
+    def __post_init__(self, tagged):
+        if tagged is not None:
+            warnings.warn('Sentence(tagged=...) is deprecated, pass words and tags',
+                          DeprecationWarning, stacklevel=3)
+            _set_tagged(self, tagged)
+
+
+def _get_tagged(sentence: Sentence) -> Tuple[Tuple[str, str], ...]:
+    return tuple(zip(sentence.words, sentence.tags))
+
+
+def _set_tagged(sentence: Sentence, tagged: Sequence[Tuple[str, str]]):
+    sentence.words = [word for word, _ in tagged]
+    sentence.tags = [tag for _, tag in tagged]
+
+
+# set after the class is built: in the class body, the property would be
+# taken as the default of the `tagged` argument.
+Sentence.tagged = property(
+    _get_tagged, _set_tagged,
+    doc='(word, tag) of each word, built on each access; assigning sets words and tags.')
+
+
+def replace_candidate(sentence: Sentence, text: str) -> str:
+    """return the sentence where the candidate `text` is replaced with CANDIDATE."""
+    return sentence.original.replace(text, 'CANDIDATE').rstrip(',. :;')
+
+
+@dataclass(frozen=True, **_SLOTS)
+class IncludedSentence:
+    """view of the sentence of a candidate, where the candidate is replaced
+    with CANDIDATE. `replaced` is computed, so the sentence is not copied.
+    """
+    sentence: Sentence
+    text: str
+
+    @property
+    def id(self) -> int:
+        return self.sentence.id
+
+    @property
+    def original(self) -> str:
+        return self.sentence.original
+
+    @property
+    def tagged(self) -> Tuple[Tuple[str, str], ...]:
+        return self.sentence.tagged
+
+    @property
+    def replaced(self) -> str:
+        return replace_candidate(self.sentence, self.text)
+
+
+@dataclass(**_SLOTS)
 class Candidate:
     text: str
     score_pagel: float = 0.0
     score_propsed: float = 0.0
-    included_sentence: Sentence = field(default_factory=Sentence)
+    # the sentence including the candidate (shared, not copied).
+    sentence: Sentence = field(default_factory=Sentence)
     word_count_btwn_var_cand: int = 0
     candidate_count_in_sentence: int = 0
     score_match_character: int = 0
+    # deprecated: the sentence, now passed as `sentence`.
+    included_sentence: InitVar[Optional[Sentence]] = None
 
+    def __post_init__(self, included_sentence):
+        if included_sentence is not None:
+            warnings.warn('Candidate(included_sentence=...) is deprecated, pass sentence',
+                          DeprecationWarning, stacklevel=3)
+            self.sentence = included_sentence
 
-@dataclass
+    @property
+    def replaced(self) -> str:
+        """the sentence where the candidate is replaced with CANDIDATE."""
+        return replace_candidate(self.sentence, self.text)
+
+
+def _get_included_sentence(candidate: Candidate) -> IncludedSentence:
+    return IncludedSentence(candidate.sentence, candidate.text)
+
+
+# set after the class is built, like Sentence.tagged.
+Candidate.included_sentence = property(_get_included_sentence)
+
+
+@dataclass(**_SLOTS)
 class Identifier:
     text_tex: str = ''
     mi_list: List[str] = field(default_factory=list)
@@ -29,7 +127,41 @@ class Identifier:
     candidates: List[Candidate] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class Formulae:
+    """a <math> containing a relation (see extract_formulae).
+    text_replaced is its text with identifiers replaced by their tokens, and
+    identifier_ids are the ids of those identifiers in order of occurrence.
+    """
     text_replaced: str = ''
     text_tex: str = ''
+    identifier_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class IdentifierRegistry:
+    """identifiers of a document keyed by their canonical form
+    (text_tex, mi_list). ids are assigned in order of registration,
+    so the id of an identifier never changes once registered. a document has
+    at most 10 ** MATH_TOKEN_DIGITS identifiers (the ids of the tokens).
+    """
+    ids: Dict[Tuple[str, Tuple[str, ...]], int] = field(default_factory=dict)
+
+    def register(self, text_tex: str, mi_list: List[str]) -> int:
+        """return the id of an identifier, registering it if it is new."""
+        key = (text_tex, tuple(mi_list))
+        identifier_id = self.ids.get(key)
+        if identifier_id is None:
+            identifier_id = len(self.ids)
+            if identifier_id >= 10 ** MATH_TOKEN_DIGITS:
+                raise ValueError(f'more than {10 ** MATH_TOKEN_DIGITS} identifiers')
+            self.ids[key] = identifier_id
+        return identifier_id
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Tuple[str, List[str]]]:
+        """iterate (text_tex, mi_list) in order of id."""
+        for text_tex, mi_list in self.ids:
+            yield text_tex, list(mi_list)
@@ -1,81 +1,436 @@
-import copy
+import contextlib
 from dataclasses import dataclass, field
-from typing import List
+import functools
+import hashlib
+import inspect
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
 import time
-import warnings
 import lxml.html
 import re
 
 import stanza
 from stanza.server import CoreNLPClient
 
-from projectmir.xmldoc_child import Identifier, Formulae, Sentence, Candidate
+from projectmir.annotation_cache import AnnotationCache
+from projectmir.corenlp_session import CoreNLPSession
+from projectmir.instrumentation import DocumentMetrics
+from projectmir.mathml import IDENTIFIER_TAGS, RELATION_OPERATORS, MathMLEncoder, compose
+from projectmir.noun_phrases import (ChunkerNounPhraseBackend, CoreNLPNounPhraseBackend,
+                                     NounPhraseBackend)
+from projectmir.pipeline_pool import PipelinePool, pipeline_pool as default_pipeline_pool
+from projectmir.xmldoc_child import (Identifier, IdentifierRegistry, Formulae, Sentence, Candidate,
+                                     math_token, math_token_regexp)
+
+
+def _trie_regexp(strings: List[str]) -> str:
+    """return a regular expression matching any of `strings`, factorized
+    as a trie so that matching does not try every string at every position.
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def to_regexp(node):
+        # follow chains of single characters iteratively to keep the recursion
+        # depth proportional to the number of branches, not to string lengths.
+        chain = []
+        while len(node) == 1 and '' not in node:
+            (char, node), = node.items()
+            chain.append(re.escape(char))
+        branches = [re.escape(char) + to_regexp(child)
+                    for char, child in node.items() if char]
+        if not branches:
+            return ''.join(chain)
+        if len(branches) == 1:
+            group = f'(?:{branches[0]})'
+        else:
+            group = f'(?:{"|".join(branches)})'
+        if '' in node:
+            group += '?'
+        return ''.join(chain) + group
+
+    return to_regexp(trie)
+
+
+def compile_replacement(replacement_list: List[Tuple[str, str]]):
+    """compile (old, new) replacements into a function that applies all of
+    them in a single pass over a string. where several olds match at the same
+    position, the longest one is replaced; if two pairs share an old,
+    the first one is used. if any two olds are nested or disjoint where they
+    occur (as serialized elements are) and no new contains an old, the result
+    is that of str.replace applied from the longest old to the shortest.
+
+    Args:
+        replacement_list (list): (old, new) pairs of strings.
+
+    Returns:
+        replace (callable): function that returns the replaced string.
+    """
+    replacement_dict = {}
+    for old, new in replacement_list:
+        if old:
+            replacement_dict.setdefault(old, new)
+    if not replacement_dict:
+        return lambda string: string
+    try:
+        regexp = re.compile(_trie_regexp(list(replacement_dict)))
+    except (RecursionError, OverflowError, re.error):
+        regexp = re.compile('|'.join(
+            re.escape(old) for old in sorted(replacement_dict, key=len, reverse=True)))
+    return lambda string: regexp.sub(
+        lambda match: replacement_dict[match.group(0)], string)
+
+
+# element replacing an extracted identifier in the <math> trees (see _mark_identifiers).
+IDENTIFIER_PLACEHOLDER_TAG = 'mplaceholder'
+
+
+def read_formula(html_math) -> Optional[Formulae]:
+    """read a <math> tree marked by XMLDocument._mark_identifiers in one walk.
+
+    Args:
+        html_math (lxml.html.HtmlElement): <math> element.
+
+    Returns:
+        formula (Formulae): the formula, or None if the <math> has no relation.
+    """
+    is_formula = False
+    text_tex, text_replaced, identifier_ids = [], [], []
+    stack = [(html_math, False)]
+    while stack:
+        element, children_read = stack.pop()
+        if children_read:
+            if element is not html_math and element.tail:
+                text_tex.append(element.tail)
+                text_replaced.append(element.tail)
+            continue
+        stack.append((element, True))
+        if not isinstance(element.tag, str):  # comments
+            continue
+        if element.tag == IDENTIFIER_PLACEHOLDER_TAG:
+            text_tex.append(element.text or '')
+            text_replaced.append(element.get('token'))
+            identifier_id = element.get('identifier')
+            if identifier_id is not None and int(identifier_id) not in identifier_ids:
+                identifier_ids.append(int(identifier_id))
+            continue
+        if element.text:
+            text_tex.append(element.text)
+            text_replaced.append(element.text)
+            if element.tag == 'mo' and element.text.strip() in RELATION_OPERATORS:
+                is_formula = True
+        stack.extend((child, False) for child in reversed(element))
+    if not is_formula:
+        return None
+    return Formulae(text_replaced=''.join(text_replaced), text_tex=''.join(text_tex),
+                    identifier_ids=identifier_ids)
+
+
+# stages of the pipeline and the stages each of them depends on.
+# extract_definition_candidate also depends on pos_tagging if its noun
+# phrase backend reads POS tags (see XMLDocument.stage_dependencies).
+STAGE_DEPENDENCIES = {
+    'processor': [],
+    'extract_identifiers': ['processor'],
+    'extract_formulae': ['extract_identifiers'],
+    'pos_tagging': ['extract_identifiers'],
+    'extract_definition_candidate': ['extract_identifiers'],
+    'compute_candidate_statistics': ['extract_definition_candidate'],
+}
+STAGES = list(STAGE_DEPENDENCIES)
+STAGE_MESSAGES = {
+    'processor': 'processing data...',
+    'extract_identifiers': 'extract identifiers...',
+    'extract_formulae': 'extract formulae...',
+    'pos_tagging': 'POS tagging...',
+    'extract_definition_candidate': 'extract candidate definition...',
+    'compute_candidate_statistics': 'compute the properties of candidates...',
+}
+# versions of the configuration of a stage (models, annotators); change a
+# version to recompute a stage when something outside its code changes.
+# the version of extract_definition_candidate is that of its noun phrase backend.
+STAGE_VERSIONS = {
+    'pos_tagging': f'stanza {stanza.__version__}',
+}
+# attributes produced by a stage; the stage runs on their first access.
+STAGE_PRODUCTS = {
+    'identifiers': 'extract_identifiers',
+    'formulae': 'extract_formulae',
+    'sentences_list': 'extract_identifiers',
+    'math_token_index': 'extract_identifiers',
+}
 
 
 @dataclass
 class XMLDocument:
+    """document processed by the identifier-definition extraction pipeline.
+
+    By default every stage runs in __post_init__. With `stages`, only the
+    given stages (and the stages they depend on) run; with `lazy=True`,
+    nothing runs until a product (`identifiers`, `formulae`,
+    `sentences_list`, `candidates`) is accessed. Each stage runs once.
+
+    ----------------------
+    usage:
+    # only identifiers are needed: stanza POS tagging and CoreNLP never run.
+    doc = XMLDocument(path, stages=['extract_identifiers'])
+    # nothing runs until doc.identifiers or doc.candidates is accessed.
+    doc = XMLDocument(path, lazy=True)
+    """
     path: str
     title: str = ''
     namespace: str = ''
     document_id: int = 0
     text: str = ''
     body: str = ''
-    identifiers: List[Identifier] = field(default_factory=list)
-    formulae: List[Formulae] = field(default_factory=list)
-    sentences_list: List[Sentence] = field(default_factory=list)
+    # products of the stages (see STAGE_PRODUCTS); they are left out of repr
+    # and comparisons, which would otherwise run the stages of a lazy document.
+    identifiers: List[Identifier] = field(default_factory=list, repr=False, compare=False)
+    formulae: List[Formulae] = field(default_factory=list, repr=False, compare=False)
+    sentences_list: List[Sentence] = field(default_factory=list, repr=False, compare=False)
+    math_token_index: Dict[str, List[Tuple[int, int]]] = field(
+        default_factory=dict, repr=False, compare=False)
+    # markup of the document; `path` is read if None (see wikipedia_dump).
+    source: Optional[str] = field(default=None, repr=False)
+    # stanza pipelines are shared through this pool (process-wide by default).
+    pipeline_pool: Optional[PipelinePool] = field(default=None, repr=False)
+    # number of sentences sent to stanza per POS tagging call (0: all at once).
+    pos_batch_size: int = 0
+    # CoreNLP server shared by many documents (a temporary one if None).
+    corenlp_session: Optional[CoreNLPSession] = field(default=None, repr=False)
+    # extraction of noun phrases (CoreNLP tregex with corenlp_session if None).
+    noun_phrase_backend: Optional[NounPhraseBackend] = field(default=None, repr=False)
+    # on-disk cache of stanza and CoreNLP annotations (no cache if None).
+    annotation_cache: Optional[AnnotationCache] = field(default=None, repr=False)
+    # stages run in __post_init__ (all stages if None).
+    stages: Optional[List[str]] = field(default=None, repr=False)
+    # if True, stages run on first access of their products.
+    lazy: bool = field(default=False, repr=False)
+    # if True, the peak memory of each stage is traced (see metrics).
+    trace_memory: bool = field(default=False, repr=False)
+    # context manager factory hook(doc, stage) wrapping each stage
+    # (e.g. instrumentation.profile_stages).
+    stage_hook: Optional[Callable[['XMLDocument', str], ContextManager]] = field(
+        default=None, repr=False)
+    completed_stages: List[str] = field(default_factory=list, init=False, repr=False)
+    # fingerprint of each completed stage when it ran (see stage_fingerprint).
+    fingerprints: Dict[str, str] = field(default_factory=dict, init=False, repr=False)
+    # time and memory of each stage, and counters of the document.
+    metrics: DocumentMetrics = field(default_factory=DocumentMetrics, init=False, repr=False)
 
     def __post_init__(self):
+        # products that were not given are computed by their stage on demand.
+        for product in STAGE_PRODUCTS:
+            if not self.__dict__[product]:
+                del self.__dict__[product]
+        if self.lazy:
+            return
+
         start_time = time.time()
         print('loaded data.')
-        print('processing data...')
-        self.processor()
-        print('extract identifiers...')
-        self.extract_identifiers()
-        print('POS tagging...')
-        self.pos_tagging()
-        print('extract candidate definition...')
-        self.extract_definition_candidate()
-        print('compute the properties of candidates...')
-        self.compute_candidate_statistics()
+        self.run_stages(self.stages or STAGES)
         print(f'elapsed time: {(time.time() - start_time):.5f} seconds ---')
 
+    def __getattr__(self, name):
+        # called only when the attribute is missing, i.e. not computed yet.
+        stage = STAGE_PRODUCTS.get(name)
+        if stage is None or 'completed_stages' not in self.__dict__:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'")
+        self.run_stage(stage)
+        return self.__dict__[name]
+
+    def run_stage(self, stage: str):
+        """run a stage once, after the stages it depends on.
+
+        Args:
+            stage (str): name of the stage (see STAGES).
+        """
+        if stage not in STAGE_DEPENDENCIES:
+            raise ValueError(f'unknown stage: {stage}')
+        if stage in self.completed_stages:
+            return
+        for dependency in self.stage_dependencies(stage):
+            self.run_stage(dependency)
+        for product, producer in STAGE_PRODUCTS.items():
+            if producer == stage:
+                self.__dict__.setdefault(
+                    product, self.__dataclass_fields__[product].default_factory())
+        print(STAGE_MESSAGES[stage])
+        hook = self.stage_hook(self, stage) if self.stage_hook is not None \
+            else contextlib.nullcontext()
+        with hook, self.metrics.measure(stage, self.trace_memory):
+            getattr(self, stage)()
+        self.completed_stages.append(stage)
+        self.fingerprints[stage] = self.stage_fingerprint(stage)
+
+    def run_stages(self, stages: List[str]):
+        """run stages in the order of the pipeline."""
+        for stage in stages:
+            if stage not in STAGE_DEPENDENCIES:
+                raise ValueError(f'unknown stage: {stage}')
+        for stage in sorted(stages, key=STAGES.index):
+            self.run_stage(stage)
+
+    def input_fingerprint(self) -> str:
+        """hash of the markup of the document (`source` or the file at `path`)."""
+        if '_input_fingerprint' not in self.__dict__:
+            fingerprint = hashlib.sha1()
+            if self.source is not None:
+                source = self.source
+                fingerprint.update(source.encode('utf-8') if isinstance(source, str) else source)
+            else:
+                with open(self.path, 'rb') as document_open:
+                    for chunk in iter(lambda: document_open.read(1 << 16), b''):
+                        fingerprint.update(chunk)
+            self._input_fingerprint = fingerprint.hexdigest()
+        return self._input_fingerprint
+
+    def stage_fingerprint(self, stage: str) -> str:
+        """fingerprint of the result of a stage: hash of the code of the stage
+        (STAGE_CODE), its configuration (STAGE_VERSIONS), and the document
+        markup for the first stage or the fingerprints of its dependencies.
+        a stage whose fingerprint changed since it ran is stale.
+        """
+        fingerprint = hashlib.sha1(stage.encode('utf-8'))
+        fingerprint.update(self.stage_version(stage).encode('utf-8'))
+        for function in STAGE_CODE[stage]:
+            fingerprint.update(_code_fingerprint(function))
+        dependencies = self.stage_dependencies(stage)
+        if not dependencies:
+            fingerprint.update(self.input_fingerprint().encode('utf-8'))
+        for dependency in dependencies:
+            fingerprint.update(self.stage_fingerprint(dependency).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def stage_dependencies(self, stage: str) -> List[str]:
+        """stages a stage depends on (see STAGE_DEPENDENCIES)."""
+        if stage == 'extract_definition_candidate' \
+                and self.get_noun_phrase_backend().uses_pos_tags:
+            return STAGE_DEPENDENCIES[stage] + ['pos_tagging']
+        return STAGE_DEPENDENCIES[stage]
+
+    def stage_version(self, stage: str) -> str:
+        """version of the configuration of a stage (see STAGE_VERSIONS)."""
+        if stage != 'extract_definition_candidate':
+            return STAGE_VERSIONS.get(stage, '')
+        return self.get_noun_phrase_backend().version
+
+    def stale_stages(self) -> List[str]:
+        """completed stages whose fingerprint changed since they ran."""
+        return [stage for stage in self.completed_stages
+                if self.fingerprints.get(stage) != self.stage_fingerprint(stage)]
+
+    def invalidate_stages(self, stages: List[str]):
+        """forget the results of stages and of the stages depending on them,
+        so that they run again (on access or by run_stages).
+        """
+        invalidated = set(stages)
+        for stage in STAGES:
+            if any(dependency in invalidated for dependency in self.stage_dependencies(stage)):
+                invalidated.add(stage)
+        if 'processor' in invalidated:
+            self.__dict__.pop('_input_fingerprint', None)
+        if 'extract_definition_candidate' in invalidated and 'identifiers' in self.__dict__:
+            for identifier in self.identifiers:
+                identifier.candidates = []
+        for product, producer in STAGE_PRODUCTS.items():
+            if producer in invalidated:
+                self.__dict__.pop(product, None)
+        self.completed_stages = [stage for stage in self.completed_stages
+                                 if stage not in invalidated]
+        for stage in invalidated:
+            self.fingerprints.pop(stage, None)
+
+    @property
+    def candidates(self) -> List[Candidate]:
+        """definition candidates of all identifiers (computed on first access).
+        """
+        self.run_stage('compute_candidate_statistics')
+        return [candidate for identifier in self.identifiers
+                for candidate in identifier.candidates]
+
+    def _parse_markup(self):
+        """parse and hash the markup of the document. the markup is read and
+        fed to the parser in chunks (so it is not held as one string), but the
+        whole tree is built: memory is that of the tree, not flat.
+        """
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        fingerprint = hashlib.sha1()
+        if self.source is not None:
+            source = self.source
+            if isinstance(source, str):
+                source = source.encode('utf-8')
+            for start in range(0, len(source), 1 << 16):
+                parser.feed(source[start:start + (1 << 16)])
+            fingerprint.update(source)
+        else:
+            with open(self.path, 'rb') as document_open:
+                for chunk in iter(lambda: document_open.read(1 << 16), b''):
+                    parser.feed(chunk)
+                    fingerprint.update(chunk)
+        html = parser.close()
+        self._input_fingerprint = fingerprint.hexdigest()
+        return html
+
     def processor(self):
         """process a document and extract text from html.
+        the markup is read from `source` if given, otherwise from `path`.
+        the document is parsed once (see _parse_markup) and the whole parsed
+        tree is kept for extract_identifiers and extract_formulae. annotation-xml and annotation elements
+        are removed from the tree before the body is serialized.
         """
-        title_regexp = re.compile(r'(?:<title>)(.*?)(?:</title>)', re.DOTALL)
-        namespace_regexp = re.compile(r'(?:<ns>)(.*?)(?:</ns>)', re.DOTALL)
-        id_regexp = re.compile(
-            r'(?:<revision>.*?<id>)(\d+)(?:</id>)', re.DOTALL)
-        text_regexp = re.compile(r'(?:<text.*?>)(.*?)(?:</text>)', re.DOTALL)
-        body_regexp = re.compile(r'(?:<body.*?>)(.*?)(?:</body>)', re.DOTALL)
-        annotation_xml_regexp = re.compile(
-            r'(?:<annotation-xml.*?>)(.*?)(?:</annotation-xml>)', re.DOTALL)
-        annotation_regexp = re.compile(
-            r'(?:<annotation.*?>)(.*?)(?:</annotation>)', re.DOTALL)
-
-        with open(self.path, 'r') as document_open:
-            document_read = document_open.read()
-            title = title_regexp.findall(document_read)
-            namespace = namespace_regexp.findall(document_read)
-            document_id = id_regexp.findall(document_read)
-            text = text_regexp.findall(document_read)
-            body = body_regexp.findall(document_read)
-
-            if title:
-                self.title = title[0]
-            if namespace:
-                self.namespace = namespace[0]
-            if document_id:
-                self.document_id = document_id[0]
-            if text:
-                self.text = text[0]
-            if body:
-                body = body[0]
-                # remove annotation-xml tag and annotation tag
-                body = annotation_xml_regexp.sub('', body)
-                body = annotation_regexp.sub('', body)
-                self.body = body
-            print("preprocessed document")
+        html = self._parse_markup()
+
+        title, namespace, document_id, text, body = None, None, None, None, None
+        annotation_list = []
+        for element in html.iter('title', 'ns', 'revision', 'text', 'body',
+                                 'annotation', 'annotation-xml'):
+            if element.tag in ('annotation', 'annotation-xml'):
+                annotation_list.append(element)
+            elif element.tag == 'title' and title is None:
+                title = element.text_content()
+            elif element.tag == 'ns' and namespace is None:
+                namespace = element.text_content()
+            elif element.tag == 'revision' and document_id is None:
+                id_element = element.find('.//id')
+                if id_element is not None and id_element.text_content().isdigit():
+                    document_id = id_element.text_content()
+            elif element.tag == 'text' and text is None:
+                text = element.text_content()
+            elif element.tag == 'body' and body is None:
+                body = element
+
+        # remove annotation-xml tag and annotation tag
+        for annotation in annotation_list:
+            if annotation.getparent() is not None:
+                annotation.drop_tree()
+
+        if title is not None:
+            self.title = title
+        if namespace is not None:
+            self.namespace = namespace
+        if document_id is not None:
+            self.document_id = document_id
+        if text is not None:
+            self.text = text
+        if body is not None:
+            body_string = lxml.html.tostring(body, encoding='unicode', with_tail=False)
+            self.body = body_string[body_string.index('>') + 1:body_string.rindex('</body>')]
+        self._html = html
+        print("preprocessed document")
+
+    def __getstate__(self):
+        # the parsed tree is only needed between processor and
+        # extract_formulae, and can not be pickled.
+        state = dict(self.__dict__)
+        state.pop('_html', None)
+        state.pop('_math_components', None)
+        state['stage_hook'] = None
+        return state
 
     # TODO: 変数の定義を変更する
     # 現在：mathタグ内のタグを調べ，mi, moタグを有するものを変数としている
@@ -86,12 +441,58 @@ class XMLDocument:
     def extract_identifiers(self):
         """extract identifiers from sentences.
         """
-        tree = lxml.html.parse(self.path)
-        html = tree.getroot()
+        html = self.__dict__.pop('_html', None)
+        if html is None:
+            self.processor()
+            html = self.__dict__.pop('_html')
         math_components = html.cssselect("math")
         print(f'Number of math components is {len(math_components)}')
+        self.metrics.count('math_nodes', len(math_components))
+        identifier_registry, replaced_string_list = self._mark_identifiers(math_components)
+        # the marked <math> trees are read by extract_formulae.
+        self._math_components = math_components
+
+        replaced_string_list = list(set(replaced_string_list))
+        replaced_string_list = sorted(
+            replaced_string_list, key=lambda x: len(x[0]), reverse=True)
+        with self.metrics.measure('extract_identifiers:substitution'):
+            replace_math = compile_replacement(
+                [(replaced_string[1], replaced_string[2])
+                 for replaced_string in replaced_string_list])
+            self.body = replace_math(self.body)
+        self.text = lxml.html.fromstring(self.body).text_content()
+        with self.metrics.measure('extract_identifiers:sentence_segmentation'):
+            self.sentence_segmentation()
+
+        for i, identifier_ in enumerate(identifier_registry):
+            sentence_id_list = sorted(set(
+                sentence_id for sentence_id, _
+                in self.math_token_index.get(math_token(i), [])))
+            sentences_list_ = [self.sentences_list[sentence_id]
+                               for sentence_id in sentence_id_list]
+            self.identifiers.append(Identifier(text_tex=identifier_[0],
+                                               mi_list=identifier_[1],
+                                               id=i,
+                                               sentences=sentences_list_))
+        self.metrics.count('identifiers', len(self.identifiers))
+        self.metrics.count('sentences', len(self.sentences_list))
+
+    @staticmethod
+    def _mark_identifiers(math_components):
+        """register the identifiers of <math> trees, and replace each extracted
+        element by a placeholder (IDENTIFIER_PLACEHOLDER_TAG) holding its text,
+        its token (see xmldoc_child.math_token, or its text) and its identifier id.
+
+        Args:
+            math_components (list): <math> elements of a document.
+
+        Returns:
+            identifier_registry (IdentifierRegistry): identifiers in order of extraction.
+            replaced_string_list (list): (text, markup, token) of each extracted
+                element, used to replace identifiers in the body by their tokens.
+        """
         replaced_string_list = []
-        identifiers = []
+        identifier_registry = IdentifierRegistry()
 
         # def is_identifier(math_component):
         #     is_mi = (math_component.tag == 'mi')
@@ -111,182 +512,170 @@ class XMLDocument:
             not_number = math_txt[0] not in [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
             return not_number
 
-        def tree_to_str(ml_tree):
-            """identify identifiers and encode MathML to TeX-like text.
-
-            Args:
-                ml_tree (HtmlElement of list):
-
-            Returns:
-                math_txt (str): encoded TeX-like text.
-            """
-            ml_list = []
-            if isinstance(ml_tree, lxml.html.HtmlElement):
-                if ml_tree.tag in ['mi', 'mo', 'mn']:
-                    math_txt = ml_tree.text_content()
-                    ml_list = [math_txt]
-                else:
-                    ml_list = [tree_to_str(x)[0] for x in ml_tree]
-                    if ml_tree.tag == 'mrow':
-                        math_txt = ''.join(ml_list)
-                    elif ml_tree.tag == 'msubsup':
-                        math_txt = ml_list[0] + '_' + ml_list[1] \
-                                   + '^' + ml_list[2]
-                    elif ml_tree.tag == 'msub':
-                        math_txt = ml_list[0] + '_' + ml_list[1]
-                    elif ml_tree.tag == 'msup':
-                        math_txt = ml_list[0] + '^' + ml_list[1]
-                    elif ml_tree.tag == 'munderover':
-                        math_txt = r'\overset{' + ml_list[2] + '}{' + \
-                                   r'\underset{' + ml_list[1] + '}{' + ml_list[0] + '}}'
-                    elif ml_tree.tag == 'mover':
-                        math_txt = r'\overset{' + \
-                                   ml_list[1] + '}{' + ml_list[0] + '}'
-                    elif ml_tree.tag == 'munder':
-                        math_txt = r'\underset{' + \
-                                   ml_list[1] + '}{' + ml_list[0] + '}'
-                    else:
-                        math_txt = ''
-                        warnings.warn('unexpected tag')
-                        print(f'{ml_tree}')
-                        print('######################')
-
-            elif isinstance(ml_tree, list):
-                ml_list = [tree_to_str(x)[0] for x in ml_tree]
-                math_txt = ''.join(ml_list)
-
-            else:
-                math_txt = ''
-                warnings.warn('unexpected tag')
-                print(f'{ml_tree}')
-                print('######################')
-
-            return math_txt, ml_list
-
-        def extract_ml_component(
-                html_cssselect_math,
-                mltag,
-                identifiers,
-                replaced_string_list):
-            """update identifiers.
-            output 'replaced_string_list' is used to replace identifiers in original text
-            to 'MATHXXXX' (XXXX means number of identifiers).
+        def extract_ml_component(html_cssselect_math, mltag):
+            """register identifiers and update 'replaced_string_list' in place.
+            'replaced_string_list' is used to replace identifiers in original text
+            to their tokens (see xmldoc_child.math_token).
 
             Args:
                 html_cssselect_math (lxml.html.HtmlElement): extracted text that has math tag.
                 mltag (str): tag that represents a math identifier.
-                identifiers (list): list containing identifier.
-                replaced_string_list (list): explained above.
-
-            Returns:
-                identifiers (list): updated identifiers
-                replaced_string_list (list): updated replace_string_list
             """
-            identifiers_ = list(identifiers)
-            replaced_string_list_ = list(replaced_string_list)
             for html_math_mltag in html_cssselect_math.cssselect(mltag):
-                math_txt, ml_list_ = tree_to_str(html_math_mltag)
-                ml_list = []
-                # print(ml_list_)
-                # TODO: moverunderに対応する．
-                for ml_ in ml_list_:
-                    ml_component = re.findall(
-                        '[over|under]set{(.+)}{(.+)}', ml_)
-                    if ml_component:
-                        ml_list.extend(
-                            [ml_component[0][0], ml_component[0][1]])
-                    else:
-                        ml_list.append(ml_)
-                if is_identifier(math_txt) and (
-                        (math_txt, ml_list) not in identifiers_):
-                    identifiers_.append((math_txt, ml_list))
-                html_math_mltag.drop_tree()
-                replaced_string_ = lxml.html.tostring(html_math_mltag,
-                                                      encoding='unicode')
+                math_txt, ml_list = encoder.encode(html_math_mltag)
+                placeholder = lxml.html.Element(IDENTIFIER_PLACEHOLDER_TAG)
                 if is_identifier(math_txt):
-                    replaced_string_list_.append(
-                        (math_txt,
-                         replaced_string_,
-                         f'MATH{(identifiers_.index((math_txt, ml_list))):04d}'))
+                    identifier_id = identifier_registry.register(math_txt, ml_list)
+                    token = math_token(identifier_id)
+                    placeholder.set('identifier', str(identifier_id))
                 else:
-                    replaced_string_list_.append(
-                        (math_txt, replaced_string_, math_txt))
-            return identifiers_, replaced_string_list_
-
-        ml_tags = ['msubsup', 'msub', 'msup',
-                   'munderover', 'munder', 'mover', 'mi']
-
+                    token = math_txt
+                # the placeholder keeps the text and the tail of the element,
+                # which is serialized (with its tail) as it appears in the body.
+                placeholder.set('token', token)
+                placeholder.text = html_math_mltag.text_content()
+                placeholder.tail = html_math_mltag.tail
+                html_math_mltag.getparent().replace(html_math_mltag, placeholder)
+                replaced_string_ = lxml.html.tostring(html_math_mltag,
+                                                      encoding='unicode')
+                replaced_string_list.append((math_txt, replaced_string_, token))
 
-        # TODO: formulaeを正しく抜き出せるようにする．
+        ml_tags = IDENTIFIER_TAGS
+        encoder = MathMLEncoder()
         for html_math in math_components:
-            math_text_list = html_math.cssselect('math')
-            for math_text_ in math_text_list:
-                math_text_string = lxml.html.tostring(math_text_, encoding='unicode')
-                if '>=<' in math_text_string:
-                    self.formulae.append(
-                        Formulae(
-                            text_tex=lxml.html.fromstring(math_text_string).text_content(),
-                            text_replaced=math_text_string))
+            # encode the tree before extracted elements are replaced in it.
+            for html_math_mltag in html_math.iter(*ml_tags):
+                encoder.encode(html_math_mltag)
             for ml_tag in ml_tags:
-                identifiers, replaced_string_list = extract_ml_component(
-                    html_math, ml_tag, identifiers, replaced_string_list)
+                extract_ml_component(html_math, ml_tag)
+        return identifier_registry, replaced_string_list
 
-        replaced_string_list = list(set(replaced_string_list))
-        replaced_string_list = sorted(
-            replaced_string_list, key=lambda x: len(x[0]), reverse=True)
-        for replaced_string in replaced_string_list:
-            self.body = self.body.replace(
-                replaced_string[1], replaced_string[2])
-            for i_formula, _ in enumerate(self.formulae):
-                text_replaced_ = self.formulae[i_formula].text_replaced
-                text_replaced_ = text_replaced_.replace(
-                    replaced_string[1], replaced_string[2])
-                self.formulae[i_formula].text_replaced = text_replaced_
-        self.text = lxml.html.fromstring(self.body).text_content()
-        self.sentence_segmentation()
-
-        for i, identifier_ in enumerate(identifiers):
-            sentences_list_ = []
-            for sentence in self.sentences_list:
-                math_txt = f'MATH{i:04d}'
-                if math_txt in sentence.original:
-                    sentences_list_.append(sentence)
-            self.identifiers.append(Identifier(text_tex=identifier_[0],
-                                               mi_list=identifier_[1],
-                                               id=i,
-                                               sentences=sentences_list_))
+    def extract_formulae(self):
+        """extract formulae: <math> elements containing a relation (an <mo>
+        in RELATION_OPERATORS). the <math> trees marked by extract_identifiers
+        are walked once each; identifiers are read from their placeholders.
+        """
+        math_components = self.__dict__.pop('_math_components', None)
+        if math_components is None:
+            # the trees are not kept with the document (e.g. it was loaded
+            # from a docstore file): parse and mark them again. identifiers
+            # are registered in the same order, so they get the same ids.
+            math_components = self._parse_markup().cssselect('math')
+            for html_math in math_components:
+                for annotation in list(html_math.iter('annotation', 'annotation-xml')):
+                    if annotation.getparent() is not None:
+                        annotation.drop_tree()
+            self._mark_identifiers(math_components)
+        for html_math in math_components:
+            formula = read_formula(html_math)
+            if formula is not None:
+                self.formulae.append(formula)
+        self.metrics.count('formulae', len(self.formulae))
+
+    def get_pipeline(self, lang='en', processors=None, **kwargs):
+        """return a stanza pipeline shared through the pipeline pool.
+        """
+        pool = self.pipeline_pool if self.pipeline_pool is not None else default_pipeline_pool
+        return pool.get(lang=lang, processors=processors, **kwargs)
+
+    def annotate(self, texts, annotator, annotate_function, model_version=''):
+        """annotate texts through the annotation cache (if any).
+
+        Args:
+            texts (list): texts (str) to be annotated.
+            annotator (str): name of the annotator used as a part of cache key.
+            annotate_function (callable): function that annotates a list of texts.
+            model_version (str): version of the model behind the annotator.
+
+        Returns:
+            annotations (list): annotation of each text.
+        """
+        # counters are named after the tool and the annotation (e.g. stanza:pos).
+        name = ':'.join(annotator.split(':')[:2])
+        n_annotated = 0
+
+        def counted_function(texts_):
+            nonlocal n_annotated
+            n_annotated += len(texts_)
+            self.metrics.count(f'{name}.calls')
+            return annotate_function(texts_)
+
+        if self.annotation_cache is None:
+            annotations = counted_function(texts)
+        else:
+            annotations = self.annotation_cache.annotate(
+                texts, annotator, counted_function, model_version=model_version)
+            self.metrics.count(f'{name}.cache_hits', len(texts) - n_annotated)
+        self.metrics.count(f'{name}.texts', n_annotated)
+        return annotations
 
     def sentence_segmentation(self):
         """extract sentences which contain the identifier from the text.
-        sentences are segmented using stanza.
+        sentences are segmented using stanza, and `math_token_index` maps
+        each identifier token (MATHxxxxxx) to the sentences and token positions where it appears.
 
         Returns:
             sentences (list): sentences which contain the identifier the text.
         """
-        # stanza.download('en')
-        nlp = stanza.Pipeline(lang='en', processors='tokenize')
-        doc_sentence_segmented = nlp(self.text)
-        sentences_list_ = []
-        for i, sentence in enumerate(doc_sentence_segmented.sentences):
-            sentence_text = ' '.join(
-                [f'{token.text}' for token in sentence.tokens])
-            sentences_list_.append(Sentence(id=i, original=sentence_text))
-        self.sentences_list = sentences_list_
+        def segment(texts):
+            # stanza.download('en')
+            nlp = self.get_pipeline(lang='en', processors='tokenize')
+            sentence_text_list_list = []
+            for text in texts:
+                doc_sentence_segmented = nlp(text)
+                sentence_text_list_list.append(
+                    [' '.join([f'{token.text}' for token in sentence.tokens])
+                     for sentence in doc_sentence_segmented.sentences])
+            return sentence_text_list_list
+
+        sentence_text_list = self.annotate(
+            [self.text], 'stanza:tokenize', segment, stanza.__version__)[0]
+        self.sentences_list = [Sentence(id=i, original=sentence_text)
+                               for i, sentence_text in enumerate(sentence_text_list)]
+
+        # index identifier tokens once: token -> [(sentence id, token position)].
+        math_token_index = {}
+        for sentence in self.sentences_list:
+            for position, token in enumerate(sentence.original.split()):
+                for math_token in math_token_regexp.findall(token):
+                    math_token_index.setdefault(math_token, []).append(
+                        (sentence.id, position))
+        self.math_token_index = math_token_index
 
     def pos_tagging(self):
         """POS tags are used for pattern-based extraction.
         this method is based on stanza.
+        sentences shared by several identifiers are tagged only once, and
+        they are sent to stanza as pre-tokenized documents of
+        `pos_batch_size` sentences (all sentences at once if 0).
         """
-        nlp = stanza.Pipeline('en')
-        for i, identifier in enumerate(self.identifiers):
-            sentence_list = identifier.sentences
-            if sentence_list:
-                for j, sentence in enumerate(sentence_list):
-                    doc = nlp(sentence.original)
-                    for sentence_ in doc.sentences:
-                        word_pos = [(word.text, word.xpos)
-                                    for word in sentence_.words]
-                        self.identifiers[i].sentences[j].tagged = word_pos
+        unique_sentences = {}
+        for identifier in self.identifiers:
+            for sentence in identifier.sentences:
+                unique_sentences.setdefault(sentence.id, sentence)
+        if not unique_sentences:
+            return
+
+        def tag(texts):
+            nlp = self.get_pipeline(lang='en', tokenize_pretokenized=True)
+            batch_size = self.pos_batch_size or len(texts)
+            tagged_list = []
+            for start in range(0, len(texts), batch_size):
+                doc = nlp([text.split() for text in texts[start:start + batch_size]])
+                tagged_list.extend([[(word.text, word.xpos) for word in sentence_.words]
+                                    for sentence_ in doc.sentences])
+            return tagged_list
+
+        tagged_list = self.annotate(
+            [sentence.original for sentence in unique_sentences.values()],
+            'stanza:pos', tag, stanza.__version__)
+        for sentence, tagged in zip(unique_sentences.values(), tagged_list):
+            sentence.tagged = tagged
+        # sentences are normally shared by identifiers; copies share the tags.
+        for identifier in self.identifiers:
+            for sentence in identifier.sentences:
+                unique_sentence = unique_sentences[sentence.id]
+                sentence.words, sentence.tags = unique_sentence.words, unique_sentence.tags
 
     def pos_tagging_corenlp(self):
         """POS tags are used for pattern-based extraction.
@@ -307,43 +696,71 @@ class XMLDocument:
                                     for token in sentence_.token]
                         self.identifiers[i].sentences[j].tagged = word_pos
 
+    def get_noun_phrase_backend(self) -> NounPhraseBackend:
+        if self.noun_phrase_backend is None:
+            return CoreNLPNounPhraseBackend(self.corenlp_session)
+        return self.noun_phrase_backend
+
+    def extract_noun_phrases(self):
+        """extract noun phrases of every sentence that contains an identifier.
+        all sentences of the document are sent to the noun phrase backend at once.
+        with CoreNLP, if no session is given, a temporary CoreNLP session is
+        started (only when some sentence is missing from the annotation cache).
+        sentences are POS tagged first if the backend reads their tags (as a
+        dependency of extract_definition_candidate, pos_tagging has already run).
+
+        Returns:
+            noun_phrases_dict (dict): noun phrases (list) keyed by sentence id.
+        """
+        unique_sentences = {}
+        for identifier in self.identifiers:
+            for sentence in identifier.sentences:
+                unique_sentences.setdefault(sentence.id, sentence)
+        if not unique_sentences:
+            return {}
+
+        backend = self.get_noun_phrase_backend()
+        if backend.uses_pos_tags:
+            self.run_stage('pos_tagging')
+        sentences = list(unique_sentences.values())
+        if backend.annotator is None:
+            noun_phrase_list = backend.noun_phrases(sentences)
+        else:
+            sentence_dict = {sentence.original: sentence for sentence in sentences}
+            noun_phrase_list = self.annotate(
+                [sentence.original for sentence in sentences], backend.annotator,
+                lambda texts: backend.noun_phrases([sentence_dict[text] for text in texts]),
+                backend.version)
+        return dict(zip(unique_sentences.keys(), noun_phrase_list))
+
     def extract_definition_candidate(self):
         """extract definition candidate from candidate-included sentence.
         assumed that the definition is not a equation and does not have '=' and '≈'.
+        noun phrases already extracted (e.g. by async_pipeline) are used if given.
         """
-
-        def extract_noun_phrases(_client, _text, _annotators=None):
-            pattern = 'NP'
-            matches = _client.tregex(_text, pattern, annotators=_annotators)
-            return [sentence[match_id]['spanString']
-                    for sentence in matches['sentences'] for match_id in sentence]
-
-        # https://github.com/stanfordnlp/stanza/issues/288
-        # get noun phrases with tregex
-        with CoreNLPClient(timeout=30000, memory='16G') as client:
-            for i, identifier_ in enumerate(self.identifiers):
-                definition_candidate_list = []
-                if identifier_.sentences:
-                    for sentence_ in identifier_.sentences:
-                        noun_phrase_list = extract_noun_phrases(
-                            client,
-                            sentence_.original,
-                            _annotators='tokenize,ssplit,pos,lemma,parse')
-
-                        for j, noun_phrase in enumerate(noun_phrase_list):
-                            noun_phrase_ = noun_phrase.rstrip(', ')
-                            if noun_phrase_[-8:] == f'MATH{i:04d}':
-                                noun_phrase_ = noun_phrase_[:-8].rstrip(', ')
-                            if noun_phrase_ and (
-                                    noun_phrase_ not in definition_candidate_list) and (
-                                    f'MATH{i:04d}' not in noun_phrase_) and not (
-                                    re.search('[=|≈]', noun_phrase_)) and ('MATH' not in noun_phrase_):
-                                definition_candidate_list.append(noun_phrase_)
-                                included_sentence = copy.copy(sentence_)
-                                included_sentence.replaced = included_sentence.original.replace(
-                                    noun_phrase_, 'CANDIDATE').rstrip(',. :;')
-                                self.identifiers[i].candidates.append(
-                                    Candidate(text=noun_phrase_, included_sentence=included_sentence))
+        noun_phrases_dict = self.__dict__.pop('_noun_phrases', None)
+        if noun_phrases_dict is None:
+            with self.metrics.measure('extract_definition_candidate:noun_phrases'):
+                noun_phrases_dict = self.extract_noun_phrases()
+        for i, identifier_ in enumerate(self.identifiers):
+            token = math_token(i)
+            definition_candidate_list = []
+            if identifier_.sentences:
+                for sentence_ in identifier_.sentences:
+                    noun_phrase_list = noun_phrases_dict[sentence_.id]
+
+                    for j, noun_phrase in enumerate(noun_phrase_list):
+                        noun_phrase_ = noun_phrase.rstrip(', ')
+                        if noun_phrase_.endswith(token):
+                            noun_phrase_ = noun_phrase_[:-len(token)].rstrip(', ')
+                        if noun_phrase_ and (
+                                noun_phrase_ not in definition_candidate_list) and (
+                                token not in noun_phrase_) and not (
+                                re.search('[=|≈]', noun_phrase_)) and ('MATH' not in noun_phrase_):
+                            definition_candidate_list.append(noun_phrase_)
+                            self.identifiers[i].candidates.append(
+                                Candidate(text=noun_phrase_, sentence=sentence_))
+            self.metrics.count('candidates', len(self.identifiers[i].candidates))
 
     def compute_candidate_statistics(self):
         """compute the following property of the candidate.
@@ -355,8 +772,8 @@ class XMLDocument:
         """
         for i, identifier_ in enumerate(self.identifiers):
             for j, candidate_ in enumerate(identifier_.candidates):
-                candidate_count_in_s = \
-                    candidate_.included_sentence.replaced.count('CANDIDATE')
+                replaced = candidate_.replaced
+                candidate_count_in_s = replaced.count('CANDIDATE')
                 self.identifiers[i].candidates[j].candidate_count_in_sentence = candidate_count_in_s
 
                 score_match_character = 0
@@ -368,8 +785,8 @@ class XMLDocument:
                 score_match_character /= len(identifier_.mi_list)
                 self.identifiers[i].candidates[j].score_match_character = score_match_character
 
-                math_txt = f'MATH{i:04d}'
-                sentence_list = candidate_.included_sentence.replaced.split()
+                math_txt = math_token(i)
+                sentence_list = replaced.split()
                 sentence_list = [s_.rstrip(',. :;') for s_ in sentence_list]
                 math_txt_index = [i for i, term in enumerate(
                     sentence_list) if term == math_txt]
@@ -382,3 +799,26 @@ class XMLDocument:
                             min(word_count_btwn_var_cand,
                                 abs(math_txt_index_ - candidate_index_) - 1)
                 self.identifiers[i].candidates[j].word_count_btwn_var_cand = word_count_btwn_var_cand
+
+
+@functools.lru_cache(maxsize=None)
+def _code_fingerprint(function) -> bytes:
+    try:
+        return inspect.getsource(function).encode('utf-8')
+    except (OSError, TypeError):
+        return function.__code__.co_code
+
+
+# code of each stage, including the helpers whose changes alter its results.
+STAGE_CODE = {
+    'processor': [XMLDocument.processor, XMLDocument._parse_markup],
+    'extract_identifiers': [XMLDocument.extract_identifiers, XMLDocument._mark_identifiers,
+                            XMLDocument.sentence_segmentation,
+                            compile_replacement, _trie_regexp, MathMLEncoder, compose],
+    'extract_formulae': [XMLDocument.extract_formulae, read_formula],
+    'pos_tagging': [XMLDocument.pos_tagging],
+    'extract_definition_candidate': [XMLDocument.extract_definition_candidate,
+                                     XMLDocument.extract_noun_phrases,
+                                     CoreNLPNounPhraseBackend, ChunkerNounPhraseBackend],
+    'compute_candidate_statistics': [XMLDocument.compute_candidate_statistics],
+}
@@ -0,0 +1,40 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+# POS tags of the fake tagger; other words are nouns.
+FAKE_TAGS = {'the': 'DT', 'a': 'DT', 'an': 'DT', 'is': 'VBZ', 'be': 'VB', 'let': 'VB',
+             'denotes': 'VBZ', 'of': 'IN', 'in': 'IN', 'by': 'IN', 'and': 'CC',
+             '.': '.', ',': ','}
+
+
+class FakePipeline:
+    """stand-in for stanza.Pipeline: splits sentences after '.', tokens on
+    words and punctuation, and tags words with FAKE_TAGS. needs no model.
+    """
+    loaded = []
+
+    def __init__(self, lang='en', processors=None, tokenize_pretokenized=False, **kwargs):
+        self.pretokenized = tokenize_pretokenized
+        FakePipeline.loaded.append(dict(lang=lang, processors=processors,
+                                        tokenize_pretokenized=tokenize_pretokenized, **kwargs))
+
+    def __call__(self, text):
+        if self.pretokenized:
+            sentences = text
+        else:
+            sentences = [re.findall(r'\w+|[^\w\s]', sentence)
+                         for sentence in re.split(r'(?<=\.)\s+', text.strip()) if sentence]
+        return SimpleNamespace(sentences=[
+            SimpleNamespace(tokens=words, words=words)
+            for words in ([SimpleNamespace(text=word, xpos=FAKE_TAGS.get(word.lower(), 'NN'))
+                           for word in sentence] for sentence in sentences)])
+
+
+@pytest.fixture
+def fake_pipeline_pool():
+    """a pipeline pool loading FakePipelines."""
+    from projectmir.pipeline_pool import PipelinePool
+    FakePipeline.loaded.clear()
+    return PipelinePool(loader=FakePipeline)
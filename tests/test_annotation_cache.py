@@ -0,0 +1,81 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from projectmir import annotation_cache as annotation_cache_module
+from projectmir.annotation_cache import AnnotationCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # every access gets a later time, so that the LRU order is well defined.
+    ticks = itertools.count()
+    monkeypatch.setattr(annotation_cache_module, 'time', SimpleNamespace(time=lambda: next(ticks)))
+
+
+def upper(texts, calls):
+    calls.append(list(texts))
+    return [text.upper() for text in texts]
+
+
+def size_of(text):
+    # annotations are stored as JSON strings.
+    return len(text) + 2
+
+
+def test_hits_and_misses(tmp_path):
+    cache = AnnotationCache(str(tmp_path / 'cache.sqlite3'))
+    calls = []
+    assert cache.annotate(['a', 'b', 'a'], 'test:upper', lambda t: upper(t, calls)) \
+        == ['A', 'B', 'A']
+    assert cache.annotate(['b', 'c'], 'test:upper', lambda t: upper(t, calls)) == ['B', 'C']
+    assert calls == [['a', 'b'], ['c']]
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'entries': 3, 'bytes': 3 * size_of('A')}
+    # annotators and model versions are parts of the key.
+    cache.annotate(['a'], 'test:lower', lambda t: upper(t, calls))
+    cache.annotate(['a'], 'test:upper', lambda t: upper(t, calls), model_version='2')
+    assert calls[2:] == [['a'], ['a']]
+    cache.close()
+
+
+def test_least_recently_used_annotations_are_evicted(tmp_path, clock):
+    cache = AnnotationCache(str(tmp_path / 'cache.sqlite3'), max_bytes=3 * size_of('A'))
+    calls = []
+    for text in ['a', 'b', 'c']:
+        cache.annotate([text], 'test:upper', lambda t: upper(t, calls))
+    cache.annotate(['a'], 'test:upper', lambda t: upper(t, calls))
+    # over the budget: evicted down to 90% of it, from the least recently used (b).
+    cache.annotate(['d'], 'test:upper', lambda t: upper(t, calls))
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] <= 0.9 * cache.max_bytes
+    calls.clear()
+    cache.annotate(['a', 'b', 'c', 'd'], 'test:upper', lambda t: upper(t, calls))
+    assert calls == [['b', 'c']]
+    cache.close()
+
+
+def test_evict_down_to_a_budget(tmp_path, clock):
+    cache = AnnotationCache(str(tmp_path / 'cache.sqlite3'))
+    cache.put_many({str(i): 'x' * 10 for i in range(10)})
+    assert cache.evict(target_bytes=5 * size_of('x' * 10)) == 5
+    assert cache.stats()['bytes'] == 5 * size_of('x' * 10)
+    assert cache.evict(target_bytes=0) == 5
+    assert cache.stats()['entries'] == 0
+    assert cache.evict(target_bytes=0) == 0
+    cache.close()
+
+
+def test_the_budget_counts_the_annotations_of_every_process(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite3')
+    budget = 10 * size_of('x' * 10)
+    caches = [AnnotationCache(path, max_bytes=budget) for _ in range(2)]
+    for i in range(20):
+        caches[i % 2].put_many({str(i): 'x' * 10})
+        assert caches[0].stats()['bytes'] <= budget
+    assert caches[1].stats() == {**caches[0].stats(), 'hits': 0, 'misses': 0}
+    # the most recent annotations were kept.
+    assert caches[0].get_many([str(i) for i in range(20)]).keys() \
+        == {str(i) for i in range(10, 20)}
+    for cache in caches:
+        cache.close()
@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.annotation_cache import AnnotationCache  # noqa: E402
+from projectmir.corenlp_session import (CoreNLPSession, StubCoreNLPServer,  # noqa: E402
+                                        _parse_properties, corenlp_version)
+from projectmir.noun_phrases import CoreNLPNounPhraseBackend  # noqa: E402
+from projectmir.xmldocument import XMLDocument  # noqa: E402
+
+SENTENCES = ['the heat MATH000000 denotes the enthalpy .',
+             'let MATH000001 be the mass .',
+             'the pressure MATH000002 is high .']
+
+
+def first_words(sentence, pattern):
+    return sentence.split()[:2]
+
+
+class IgnoringEolonlyServer(StubCoreNLPServer):
+    """a server that splits requests in its own way (here: never)."""
+
+    def respond(self, text, pattern, properties):
+        return super().respond(text.replace('\n', ' '), pattern, {})
+
+
+@pytest.fixture
+def stub():
+    with StubCoreNLPServer(first_words) as server:
+        yield server
+
+
+def session_of(server, **kwargs):
+    return CoreNLPSession(endpoint=server.endpoint, start_server=False, **kwargs)
+
+
+def test_parse_properties():
+    assert _parse_properties(None) == {}
+    assert _parse_properties('{"ssplit.eolonly": "true"}') == {'ssplit.eolonly': 'true'}
+    # stanza sends str(dict).
+    assert _parse_properties(str({'ssplit.eolonly': 'true', 'annotators': 'parse'})) \
+        == {'ssplit.eolonly': 'true', 'annotators': 'parse'}
+
+
+def test_sentences_are_sent_in_one_request(stub):
+    with session_of(stub) as session:
+        noun_phrases = session.noun_phrases(SENTENCES)
+    assert noun_phrases == [sentence.split()[:2] for sentence in SENTENCES]
+    assert stub.requests == [('NP', SENTENCES)]
+
+
+def test_requests_hold_at_most_max_sentences_per_request(stub):
+    with session_of(stub, max_sentences_per_request=2) as session:
+        noun_phrases = session.noun_phrases(SENTENCES + ['a b c'])
+    assert noun_phrases[-1] == ['a', 'b']
+    assert [sentences for _, sentences in stub.requests] \
+        == [SENTENCES[:2], [SENTENCES[2], 'a b c']]
+
+
+def test_sentences_are_sent_one_by_one_if_the_server_splits_them_differently():
+    with IgnoringEolonlyServer(first_words) as server, session_of(server) as session:
+        matches = session.tregex(SENTENCES, 'NP')
+    assert [[match['spanString'] for match in sentence_matches.values()]
+            for sentence_matches in matches] == [sentence.split()[:2] for sentence in SENTENCES]
+    assert list(matches[0]) == ['0-0', '0-1']
+    # the bulk request, then one request per sentence.
+    assert [sentences for _, sentences in server.requests] \
+        == [[' '.join(SENTENCES)]] + [[sentence] for sentence in SENTENCES]
+
+
+def test_corenlp_version(tmp_path):
+    assert corenlp_version(str(tmp_path)) == 'unknown'
+    for name in ['stanford-corenlp-4.5.10.jar', 'stanford-corenlp-4.5.9.jar',
+                 'stanford-corenlp-4.5.10-models.jar', 'stanford-corenlp-4.5.10-sources.jar']:
+        (tmp_path / name).touch()
+    corenlp_version.cache_clear()
+    assert corenlp_version(str(tmp_path)) == '4.5.10'
+
+
+def test_cached_noun_phrases_depend_on_the_corenlp_version(stub, fake_pipeline_pool, tmp_path):
+    source = ('<html><body><p>The heat <math><mi>Q</mi></math> denotes the enthalpy.'
+              '</p></body></html>')
+    cache = AnnotationCache(str(tmp_path / 'cache.sqlite3'))
+
+    def candidates(server_version):
+        session = session_of(stub, server_version=server_version)
+        assert server_version in CoreNLPNounPhraseBackend(session).version
+        doc = XMLDocument('doc.html', source=source, stages=['extract_definition_candidate'],
+                          pipeline_pool=fake_pipeline_pool, corenlp_session=session,
+                          annotation_cache=cache)
+        return [candidate.text for candidate in doc.identifiers[0].candidates]
+
+    expected = candidates('4.5.9')
+    assert expected and len(stub.requests) == 1
+    assert candidates('4.5.9') == expected
+    assert len(stub.requests) == 1
+    assert candidates('4.5.10') == expected
+    assert len(stub.requests) == 2
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.corpus_runner import DumpCheckpoint, dump_tasks  # noqa: E402
+from projectmir.wikipedia_dump import WikipediaDumpReader  # noqa: E402
+
+DUMP = (b'<mediawiki>\n'
+        + b''.join(b'  <page><title>%d</title><ns>%d</ns></page>\n' % (i, i % 2)
+                   for i in range(6))
+        + b'</mediawiki>\n')
+
+
+def test_checkpoint_is_the_first_page_without_result(tmp_path):
+    path = tmp_path / 'dump.xml'
+    path.write_bytes(DUMP)
+    checkpoint = DumpCheckpoint(str(tmp_path / 'results.jsonl.offset'))
+    reader = WikipediaDumpReader(str(path), namespaces={'0'})
+    tasks = dump_tasks(reader, checkpoint)
+    first, second = next(tasks), next(tasks)
+    # results come in order of completion.
+    checkpoint.completed(second[0])
+    assert checkpoint.load() == DUMP.index(b'<page><title>0')
+    checkpoint.completed(first[0])
+    assert checkpoint.offset == DUMP.index(b'<page><title>3') - len(b'\n  ')
+
+    resumed = [task_path for task_path, _ in dump_tasks(
+        WikipediaDumpReader(str(path), namespaces={'0'},
+                            offset=DumpCheckpoint(checkpoint.path).load()))]
+    assert resumed == [f'{path}#{DUMP.index(b"<page><title>4")}']
+
+
+def test_checkpoint_without_file_starts_at_zero(tmp_path):
+    assert DumpCheckpoint(str(tmp_path / 'missing.offset')).load() == 0
@@ -0,0 +1,111 @@
+import contextlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir import xmldocument  # noqa: E402
+from projectmir.docstore import (DOCUMENT_ATTRIBUTES, load_candidate_features,  # noqa: E402
+                                 load_document, save_document, update_document)
+from projectmir.noun_phrases import ChunkerNounPhraseBackend  # noqa: E402
+from projectmir.extract_definition import DEFAULT_KATO_PARAMS  # noqa: E402
+from projectmir.ranking import CandidateFeatures, kato_scores, ranked_definitions  # noqa: E402
+from projectmir.xmldocument import STAGES, XMLDocument  # noqa: E402
+
+SOURCE = ('<html><head><title>Enthalpy</title></head><body><p>The enthalpy '
+          '<math><mi>H</mi></math> is the sum of the internal energy '
+          '<math><mi>U</mi></math> and the product of the pressure '
+          '<math><mi>p</mi></math> and the volume <math><mi>V</mi></math>.</p>'
+          '<p>Let <math><mi>H</mi><mo>=</mo><mi>U</mi><mo>+</mo><mi>p</mi><mi>V</mi></math> '
+          'be the enthalpy of the system.</p></body></html>')
+
+
+def make_document(pool, **kwargs):
+    return XMLDocument('enthalpy.html', source=SOURCE, pipeline_pool=pool,
+                       noun_phrase_backend=ChunkerNounPhraseBackend(), **kwargs)
+
+
+def assert_same_document(loaded, doc):
+    for name in DOCUMENT_ATTRIBUTES + ['text', 'body']:
+        assert getattr(loaded, name) == getattr(doc, name), name
+    for product in xmldocument.STAGE_PRODUCTS:
+        assert getattr(loaded, product) == getattr(doc, product), product
+    assert loaded.completed_stages == doc.completed_stages
+    assert loaded.fingerprints == doc.fingerprints
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_saved_document_is_loaded_equal(fake_pipeline_pool, tmp_path, use_mmap):
+    doc = make_document(fake_pipeline_pool)
+    assert doc.completed_stages == STAGES
+    assert any(identifier.candidates for identifier in doc.identifiers)
+    save_document(doc, str(tmp_path / 'enthalpy.pmirdoc'))
+    loaded = load_document(str(tmp_path / 'enthalpy.pmirdoc'), use_mmap=use_mmap,
+                           source=SOURCE, pipeline_pool=fake_pipeline_pool,
+                           noun_phrase_backend=ChunkerNounPhraseBackend())
+    assert_same_document(loaded, doc)
+    assert loaded.stale_stages() == []
+
+
+def test_update_runs_only_the_changed_stage(fake_pipeline_pool, tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'enthalpy.pmirdoc')
+    doc = update_document('enthalpy.html', store_path, source=SOURCE,
+                          pipeline_pool=fake_pipeline_pool,
+                          noun_phrase_backend=ChunkerNounPhraseBackend())
+    events = []
+
+    @contextlib.contextmanager
+    def hook(doc_, stage):
+        events.append(stage)
+        yield
+
+    def update():
+        return update_document('enthalpy.html', store_path, source=SOURCE,
+                               pipeline_pool=fake_pipeline_pool, stage_hook=hook,
+                               noun_phrase_backend=ChunkerNounPhraseBackend())
+
+    assert_same_document(update(), doc)
+    assert events == []
+
+    monkeypatch.setitem(xmldocument.STAGE_VERSIONS, 'compute_candidate_statistics', 'changed')
+    updated = update()
+    assert events == ['compute_candidate_statistics']
+    assert updated.identifiers == doc.identifiers
+    assert updated.fingerprints['compute_candidate_statistics'] \
+        != doc.fingerprints['compute_candidate_statistics']
+    # the updated fingerprint was saved: nothing runs again.
+    events.clear()
+    assert_same_document(update(), updated)
+    assert events == []
+
+
+def test_candidate_features_are_loaded_with_and_without_texts(fake_pipeline_pool, tmp_path):
+    doc = make_document(fake_pipeline_pool)
+    paths = [str(tmp_path / 'a.pmirdoc'), str(tmp_path / 'b.pmirdoc')]
+    for path in paths:
+        save_document(doc, path)
+    expected = CandidateFeatures.concatenate(
+        [CandidateFeatures.from_identifiers(doc.identifiers)] * 2)
+
+    features = load_candidate_features(paths)
+    for name in ['identifier_index', 'delta', 'n_sentence', 'tf', 'score_match_character']:
+        np.testing.assert_array_equal(getattr(features, name), getattr(expected, name))
+    assert features.texts == expected.texts
+    assert features.n_identifiers == expected.n_identifiers == 2 * len(doc.identifiers)
+    params = dict(DEFAULT_KATO_PARAMS)
+    assert ranked_definitions(features, kato_scores(features, params), params) \
+        == ranked_definitions(expected, kato_scores(expected, params), params)
+
+    without_texts = load_candidate_features(paths, texts=False)
+    np.testing.assert_array_equal(without_texts.tf, expected.tf)
+    assert len(without_texts) == len(expected) and without_texts.texts == []
+    with pytest.raises(ValueError, match='candidate texts are missing'):
+        ranked_definitions(without_texts, kato_scores(without_texts, params), params)
+
+
+def test_candidate_features_need_the_statistics(fake_pipeline_pool, tmp_path):
+    doc = make_document(fake_pipeline_pool, stages=['extract_definition_candidate'])
+    save_document(doc, str(tmp_path / 'a.pmirdoc'))
+    with pytest.raises(ValueError, match='candidate statistics were not computed'):
+        load_candidate_features([str(tmp_path / 'a.pmirdoc')])
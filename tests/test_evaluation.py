@@ -0,0 +1,11 @@
+import pytest
+
+from projectmir.evaluation import GoldIndex, evaluate_definitions, evaluate_systems
+
+
+def test_mismatched_lengths_are_rejected():
+    gold = GoldIndex.from_lists(['x'], ['length'])
+    with pytest.raises(ValueError, match='0 identifiers but definitions of 1'):
+        evaluate_definitions([], [[]], gold)
+    with pytest.raises(ValueError, match='1 documents but 2 gold indexes'):
+        evaluate_systems([([], {})], [gold, gold])
@@ -0,0 +1,13 @@
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.noun_phrases import NounPhraseBackend  # noqa: E402
+
+
+def test_incomplete_backends_cannot_be_created():
+    class Backend(NounPhraseBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Backend()
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.pipeline_pool import PipelinePool, pipeline_pool  # noqa: E402
+from projectmir.xmldocument import XMLDocument  # noqa: E402
+
+from conftest import FakePipeline  # noqa: E402
+
+
+def test_pipelines_are_loaded_once_per_configuration(fake_pipeline_pool):
+    nlp = fake_pipeline_pool.get(lang='en', processors='tokenize')
+    assert fake_pipeline_pool.get(lang='en', processors='tokenize') is nlp
+    assert fake_pipeline_pool.get(lang='en', tokenize_pretokenized=True) is not nlp
+    assert FakePipeline.loaded == [
+        {'lang': 'en', 'processors': 'tokenize', 'tokenize_pretokenized': False},
+        {'lang': 'en', 'processors': None, 'tokenize_pretokenized': True}]
+    assert fake_pipeline_pool.pipelines[PipelinePool.make_key('en', 'tokenize')].use_count == 2
+
+
+def test_least_recently_used_pipelines_are_evicted():
+    pool = PipelinePool(max_pipelines=2, loader=FakePipeline)
+    tokenize = pool.get(processors='tokenize')
+    pool.get(processors='pos')
+    pool.get(processors='tokenize')
+    pool.get(processors='lemma')
+    assert [key[1] for key in pool.pipelines] == ['tokenize', 'lemma']
+    assert pool.get(processors='tokenize') is tokenize
+
+
+def test_get_pipeline_uses_an_empty_injected_pool(fake_pipeline_pool):
+    doc = XMLDocument('unused.html', source='<html></html>', lazy=True,
+                      pipeline_pool=fake_pipeline_pool)
+    n_default = len(pipeline_pool)
+    assert isinstance(doc.get_pipeline(lang='en', processors='tokenize'), FakePipeline)
+    assert len(fake_pipeline_pool) == 1
+    assert len(pipeline_pool) == n_default
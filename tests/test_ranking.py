@@ -0,0 +1,52 @@
+import pytest
+
+from projectmir.extract_definition import kato_ranking_candidates, pagel_ranking_candidates
+from projectmir.ranking import CandidateFeatures, kato_ranking, pagel_ranking
+from projectmir.xmldoc_child import Candidate, Identifier, Sentence
+
+
+def make_identifiers():
+    sentences = [Sentence(id=i, original=original) for i, original in enumerate([
+        'Let MATH000000 be the length of the tank .',
+        'the tank has the length MATH000000 and the width MATH000001 .',
+        'the width is MATH000001 .'])]
+
+    def candidate(text, sentence, distance, match):
+        return Candidate(text, sentence=sentences[sentence], word_count_btwn_var_cand=distance,
+                         candidate_count_in_sentence=sentences[sentence].original.count(text),
+                         score_match_character=match)
+
+    return [
+        Identifier('l', ['l'], 0, sentences[:2], [
+            candidate('the length', 0, 1, 1.0), candidate('the tank', 0, 4, 0.0),
+            candidate('the length', 1, 0, 1.0),
+            # same features as the first candidate: ties keep their order.
+            candidate('the height', 0, 1, 1.0)]),
+        Identifier('w', ['w'], 1, sentences[1:], [
+            candidate('the width', 1, 0, 1.0), candidate('the width', 2, 1, 1.0),
+            candidate('the tank', 1, 8, 0.0)]),
+        Identifier('x', ['x'], 2, []),
+    ]
+
+
+@pytest.mark.parametrize('ranking, ranking_candidates', [
+    (kato_ranking, kato_ranking_candidates), (pagel_ranking, pagel_ranking_candidates)])
+def test_vectorized_rankings_equal_extract_definition(ranking, ranking_candidates):
+    identifiers = make_identifiers()
+    expected = [ranking_candidates(identifier) for identifier in identifiers]
+    ranked = ranking(identifiers)
+    assert [[definition.definition for definition in definitions] for definitions in ranked] \
+        == [[definition.definition for definition in definitions] for definitions in expected]
+    for definitions, expected_definitions in zip(ranked, expected):
+        assert [definition.score for definition in definitions] \
+            == pytest.approx([definition.score for definition in expected_definitions])
+        assert all(definition.params == expected_definitions[0].params
+                   for definition in definitions)
+
+
+def test_ranked_definitions_need_texts():
+    features = CandidateFeatures.from_identifiers(make_identifiers())
+    features.texts = []
+    assert len(features) == 7
+    with pytest.raises(ValueError, match='candidate texts are missing'):
+        kato_ranking([], features=features)
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+import pytest
+
+from projectmir.extract_definition import (evaluate_identifier_definition,
+                                           kato_ranking_candidates, pagel_ranking_candidates)
+from projectmir.sweep import SweepProblem, parameter_grid, sweep
+from projectmir.xmldoc_child import Candidate, Identifier, Sentence
+
+GRID = {'sigma_d': [0.5, math.sqrt(12 / math.log(2))],
+        'sigma_s': [0.5, 2 / math.sqrt(math.log(2))],
+        'alpha': [0.1, 1.0],
+        'beta': [1.0],
+        'gamma': [0.1, 5.0],
+        'eta': [0.0, 2.0]}
+
+
+def make_document():
+    sentences = [Sentence(id=i, original=original) for i, original in enumerate([
+        'Let MATH000000 be the length of the tank , the tank length .',
+        'the temperature MATH000001 of the water is the water temperature .',
+        'the mass MATH000002 of MATH000000 .',
+        'the pressure is high .'])]
+
+    def candidate(text, sentence, distance, match):
+        return Candidate(text, sentence=sentences[sentence], word_count_btwn_var_cand=distance,
+                         candidate_count_in_sentence=sentences[sentence].original.count(text),
+                         score_match_character=match)
+
+    identifiers = [
+        Identifier('l', ['l'], 0, [sentences[0], sentences[2]], [
+            candidate('the tank', 0, 3, 0.0), candidate('the length', 0, 1, 1.0),
+            candidate('the mass', 2, 0, 0.0), candidate('the tank length', 0, 7, 1.0)]),
+        Identifier('T', ['T'], 1, [sentences[1], sentences[3]], [
+            candidate('the water', 1, 2, 0.0), candidate('the temperature', 1, 0, 1.0),
+            candidate('the pressure', 3, 0, 0.0)]),
+        Identifier('m', ['m'], 2, [sentences[2]], [candidate('the mass', 2, 0, 1.0)]),
+        # gold identifiers without candidates: a string gold definition
+        # contains the empty definition, a list of definitions does not.
+        Identifier('p', ['p'], 3, []),
+        Identifier('q', ['q'], 4, []),
+        # not a gold identifier.
+        Identifier('z', ['z'], 5, [sentences[0]], [candidate('the tank', 0, 1, 0.0)]),
+    ]
+    gold_identifiers = ['l', 'T', 'm', 'p', 'q', 'V']
+    gold_definitions = [['the length', 'the tank length'], 'the temperature of the water',
+                        ['the mass'], 'the pressure', ['the pressure'], ['the volume']]
+    return identifiers, gold_identifiers, gold_definitions
+
+
+@pytest.mark.parametrize('method, ranking_candidates', [
+    ('kato', kato_ranking_candidates), ('pagel', pagel_ranking_candidates)])
+@pytest.mark.parametrize('max_rank', [1, 2, 3])
+def test_sweep_equals_the_scalar_evaluation(method, ranking_candidates, max_rank):
+    identifiers, gold_identifiers, gold_definitions = make_document()
+    problem = SweepProblem.from_identifiers(identifiers, gold_identifiers, gold_definitions)
+    assert (problem.n_empty_positive, problem.n_empty_correct) == (2, 1)
+    grid = GRID if method == 'kato' else {name: values for name, values in GRID.items()
+                                          if name != 'eta'}
+    table = sweep(problem, grid, method=method, max_rank=max_rank, block_size=5)
+    points = parameter_grid(grid)
+    n_grid = len(table['definition_tp'])
+    assert n_grid == len(points['alpha'])
+    rankings = set()
+    for k in range(n_grid):
+        params = {name: float(values[k]) for name, values in points.items()}
+        definition_list_list = [ranking_candidates(identifier, params)
+                                for identifier in identifiers]
+        rankings.add(tuple(definitions[0].definition for definitions in definition_list_list))
+        identifier_scores, definition_scores = evaluate_identifier_definition(
+            identifiers, gold_identifiers, definition_list_list, gold_definitions,
+            max_rank=max_rank)
+        assert (table['identifier_recall'][k], table['identifier_precision'][k]) \
+            == pytest.approx(identifier_scores)
+        assert (table['definition_recall'][k], table['definition_precision'][k]) \
+            == pytest.approx(definition_scores)
+    # the grid changes the rankings.
+    assert len(rankings) > 1
+
+
+def test_sweep_sums_documents():
+    identifiers, gold_identifiers, gold_definitions = make_document()
+    problem = SweepProblem.from_identifiers(identifiers, gold_identifiers, gold_definitions)
+    one = sweep(problem, GRID, max_rank=2)
+    two = sweep([problem, problem], GRID, max_rank=2, workers=1)
+    np.testing.assert_array_equal(two['definition_tp'], 2 * one['definition_tp'])
+    np.testing.assert_allclose(two['definition_precision'], one['definition_precision'])
@@ -0,0 +1,49 @@
+import bz2
+
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.wikipedia_dump import WikipediaDumpReader  # noqa: E402
+
+DUMP = (b'<mediawiki>\n'
+        b'  <page>\n    <title>A</title>\n  </page>\n'
+        b'  <page><title>B</title></page><page><title>C</title>\n'
+        b'  </page>  <page><title>D</title></page>\n'
+        b'</mediawiki>\n')
+
+
+def titles(pages):
+    return [page[page.index(b'<title>') + 7:page.index(b'</title>')].decode()
+            for _, page in pages]
+
+
+@pytest.mark.parametrize('suffix', ['.xml', '.xml.bz2'])
+def test_pages_sharing_a_line_are_all_read(tmp_path, suffix):
+    path = tmp_path / f'dump{suffix}'
+    path.write_bytes(bz2.compress(DUMP) if suffix.endswith('.bz2') else DUMP)
+    pages = list(WikipediaDumpReader(str(path)).iter_pages())
+    assert titles(pages) == ['A', 'B', 'C', 'D']
+    for page_offset, page in pages:
+        assert DUMP[page_offset:page_offset + len(page)] == page
+
+
+@pytest.mark.parametrize('n_read', [1, 2, 3])
+def test_resume_from_an_unfinished_page_reads_it_again(tmp_path, n_read):
+    path = tmp_path / 'dump.xml'
+    path.write_bytes(DUMP)
+    pages = WikipediaDumpReader(str(path)).iter_pages()
+    read = [next(pages) for _ in range(n_read)]
+    # crashed while the last page read was being processed.
+    pages.close()
+    resumed = list(WikipediaDumpReader(str(path), offset=read[-1][0]).iter_pages())
+    assert titles(read[:-1]) + titles(resumed) == ['A', 'B', 'C', 'D']
+
+
+def test_documents_are_built_lazily(tmp_path):
+    path = tmp_path / 'dump.xml'
+    path.write_bytes(DUMP)
+    docs = list(WikipediaDumpReader(str(path), document_kwargs={'lazy': False}))
+    assert len(docs) == 4
+    assert all(doc.completed_stages == [] for doc in docs)
+    assert docs[1].path == f'{path}#{DUMP.index(b"<page><title>B")}'
@@ -0,0 +1,32 @@
+import pytest
+
+from projectmir.xmldoc_child import Candidate, Sentence
+
+
+def test_deprecated_keywords_still_work():
+    with pytest.deprecated_call():
+        sentence = Sentence(id=1, original='the length MATH000000', tagged=[
+            ('the', 'DT'), ('length', 'NN'), ('MATH000000', 'NN')])
+    assert sentence.words == ['the', 'length', 'MATH000000']
+    assert sentence.tags == ['DT', 'NN', 'NN']
+    with pytest.deprecated_call():
+        candidate = Candidate('length', included_sentence=sentence)
+    assert candidate.sentence is sentence
+    assert candidate.included_sentence.replaced == 'the CANDIDATE MATH000000'
+
+
+def test_tagged_is_a_view_of_words_and_tags():
+    sentence = Sentence(words=['a', 'length'], tags=['DT', 'NN'])
+    assert sentence.tagged == (('a', 'DT'), ('length', 'NN'))
+    sentence.words[0] = 'the'
+    assert sentence.tagged == (('the', 'DT'), ('length', 'NN'))
+    # assigning the tagged words sets the words and the tags.
+    sentence.tagged = [('the', 'DT')]
+    assert (sentence.words, sentence.tags) == (['the'], ['DT'])
+
+
+def test_candidate_and_its_sentence_view_replace_the_candidate_alike():
+    sentence = Sentence(id=1, original='the length MATH000000 of the tank .')
+    candidate = Candidate('the length', sentence=sentence)
+    assert candidate.replaced == candidate.included_sentence.replaced \
+        == 'CANDIDATE MATH000000 of the tank'
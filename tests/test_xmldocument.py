@@ -0,0 +1,113 @@
+import contextlib
+import random
+
+import pytest
+
+pytest.importorskip('stanza')
+
+from projectmir.description_patterns import DescriptionMatcher  # noqa: E402
+from projectmir.xmldoc_child import math_token  # noqa: E402
+from projectmir.xmldocument import XMLDocument, compile_replacement  # noqa: E402
+
+SOURCE = ('<html><head><title>T</title></head><body><p>Let '
+          '<math><mi>x</mi><mo>=</mo><mn>2</mn></math> be the length.</p></body></html>')
+
+
+def test_repr_of_a_lazy_document_runs_no_stage():
+    doc = XMLDocument('doc.html', source=SOURCE, lazy=True)
+    repr(doc)
+    assert doc == XMLDocument('doc.html', source=SOURCE, lazy=True)
+    assert doc.completed_stages == []
+
+
+def test_run_stages_rejects_unknown_stages():
+    doc = XMLDocument('doc.html', source=SOURCE, lazy=True)
+    with pytest.raises(ValueError, match='unknown stage: extract_identifier'):
+        doc.run_stages(['processor', 'extract_identifier'])
+    assert doc.completed_stages == []
+
+
+def sequential_replace(string, replacement_list):
+    # the replacement of extract_identifiers before it was compiled.
+    for old, new in sorted(replacement_list, key=lambda pair: len(pair[0]), reverse=True):
+        string = string.replace(old, new)
+    return string
+
+
+@pytest.mark.parametrize('string, olds', [
+    # nested olds: the inner one also occurs alone.
+    ('<mi>x</mi><mrow><mi>x</mi><mo>=</mo></mrow><mi>x</mi>',
+     ['<mi>x</mi>', '<mrow><mi>x</mi><mo>=</mo></mrow>']),
+    # olds sharing a prefix, and an old that is a prefix of another.
+    ('<mi>x</mi><mi>xy</mi><mi>x</mi><mi>y</mi>',
+     ['<mi>x</mi>', '<mi>xy</mi>', '<mi>x</mi><mi>y</mi>']),
+    ('<mrow><mi>x</mi></mrow><mrow><mi>x</mi><mi>y</mi></mrow>',
+     ['<mrow><mi>x</mi></mrow>', '<mrow><mi>x</mi><mi>y</mi></mrow>', '<mi>y</mi>']),
+    # repeated olds and a missing one.
+    ('ab ab abab', ['ab', 'abab', 'abc']),
+])
+def test_compiled_replacement_equals_sequential_replacement(string, olds):
+    replacement_list = [(old, f' {math_token(i)} ') for i, old in enumerate(olds)]
+    assert compile_replacement(replacement_list)(string) \
+        == sequential_replace(string, replacement_list)
+
+
+def test_compiled_replacement_of_random_elements():
+    generator = random.Random(0)
+
+    def element(depth):
+        if depth == 0 or generator.random() < 0.3:
+            return f'<mi>{generator.choice(["x", "y", "xy"])}</mi>'
+        tag = generator.choice(['mrow', 'msub'])
+        children = ''.join(element(depth - 1) for _ in range(generator.randint(1, 3)))
+        return f'<{tag}>{children}</{tag}>'
+
+    for _ in range(200):
+        elements = [element(generator.randint(0, 3)) for _ in range(generator.randint(1, 6))]
+        string = ' '.join(elements + generator.sample(elements, len(elements)))
+        olds = {old for old in elements + [element(1) for _ in range(3)]}
+        # serialized subelements too, nested in the olds above, and a
+        # sequence of elements that starts with an old.
+        olds |= {f'<mi>{text}</mi>' for text in ['x', 'y', 'xy'] if generator.random() < 0.5}
+        olds.add(' '.join(elements[:2]))
+        replacement_list = [(old, math_token(i)) for i, old in enumerate(sorted(olds))]
+        assert compile_replacement(replacement_list)(string) \
+            == sequential_replace(string, replacement_list)
+
+
+def test_identifier_tokens_do_not_collide(fake_pipeline_pool):
+    # ids 1000 and 10000 were MATH1000 and MATH10000: the first a prefix of the second.
+    n = 10001
+    source = '<html><body><p>' + ' '.join(
+        f'Let <math><mi>v{i}</mi></math> be the length {i}.' for i in range(n)) \
+        + ' The number MATH10000 and <math><mi>v1000</mi></math>7 is a noun.</p></body></html>'
+    doc = XMLDocument('doc.html', source=source, stages=['extract_identifiers'],
+                      pipeline_pool=fake_pipeline_pool)
+    assert len(doc.identifiers) == n
+    assert [sentence.id for sentence in doc.identifiers[1000].sentences] == [1000, n]
+    assert [sentence.id for sentence in doc.identifiers[10000].sentences] == [10000]
+    assert math_token(10000) in doc.sentences_list[10000].original
+    tagged = [(math_token(10000), 'NN'), ('is', 'VBZ'), ('the', 'DT'), ('length', 'NN')]
+    assert DescriptionMatcher().match_sentence(tagged) == {math_token(10000): ['length']}
+
+
+def test_chunker_candidates_depend_on_pos_tagging(fake_pipeline_pool):
+    from projectmir.noun_phrases import ChunkerNounPhraseBackend
+    events = []
+
+    @contextlib.contextmanager
+    def hook(doc, stage):
+        events.append(('start', stage))
+        yield
+        events.append(('end', stage))
+
+    doc = XMLDocument('doc.html', source=SOURCE, lazy=True, stage_hook=hook,
+                      pipeline_pool=fake_pipeline_pool,
+                      noun_phrase_backend=ChunkerNounPhraseBackend())
+    doc.run_stage('extract_definition_candidate')
+    # tagged before extract_definition_candidate is measured, not inside it.
+    assert events.index(('end', 'pos_tagging')) \
+        < events.index(('start', 'extract_definition_candidate'))
+    assert [candidate.text for candidate in doc.identifiers[0].candidates] == ['the length']
+    doc.invalidate_stages(['pos_tagging'])
+    assert 'extract_definition_candidate' not in doc.completed_stages